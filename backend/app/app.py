@@ -4,17 +4,16 @@
 import sys
 import time
 import uuid
-from datetime import timezone
 
 import bcrypt
 import jwt
-import redis
 from bleach import Linker
-from flask import Flask, g, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 from flask_socketio import (
     SocketIO,
     emit,
+    rooms,
 )
 from flask_socketio import (
     join_room as socket_join_room,
@@ -23,56 +22,136 @@ from flask_socketio import (
     leave_room as socket_leave_room,
 )
 from loguru import logger
+from redis import RedisError
+from sqlalchemy import and_
 from sqlalchemy.exc import NoResultFound, SQLAlchemyError
 
 import models
 from config import (
+    CORS_ORIGINS,
+    JOBS_IN_PROCESS,
+    LOG_FILE,
+    LOG_FILE_BACKUPS,
+    LOG_FILE_MAX_BYTES,
+    LOG_LEVEL,
+    LOG_POLICIES,
+    LOG_QUEUE_SIZE,
     MAX_MESSAGE_LENGTH,
-    REDIS_HOST,
-    REDIS_PORT,
+    METRICS_TOKEN,
+    PROFILING_SECRET,
+    REACTION_BROADCAST_INTERVAL,
+    SOCKET_AUTH_SWEEP_INTERVAL,
 )
-from db import init_db, session_local
-from lib.helper import get_username, render_message
+from db import engine, init_db, ping_db, session_local
+from lib.bootstrap import build_bootstrap
+from lib.dedupe import claim, record, release, valid_client_id
+from lib.directory import (
+    index_room,
+    index_user,
+    search_rooms,
+    search_users,
+    unindex_room,
+)
+from lib.export import export_batches, gzip_members
+from lib.helper import (
+    get_username,
+    insert_message,
+    recent_messages,
+    render_message,
+    room_member_ids,
+    user_rooms,
+)
+from lib.jobs import Worker, enqueue
 from lib.jwt_helper import (
     create_access_token,
     create_refresh_token,
     verify_access_token,
     verify_refresh_token,
 )
+from lib.kv import create_kv, message_queue_url
+from lib.lifecycle import lifecycle
+from lib.list_cache import (
+    bump_room_members,
+    bump_user_rooms,
+    cached_json,
+    conditional_json,
+    room_members_key,
+    user_rooms_key,
+)
+from lib.log_pipeline import (
+    AsyncSink,
+    LogPolicies,
+    RotatingFileWriter,
+    StreamWriter,
+    log_event,
+)
+from lib.members import (
+    InvalidQuery,
+    count_members,
+    list_members_page,
+    page_variant,
+    wants_page,
+)
+from lib.metrics import (
+    BROADCAST_FANOUT,
+    HTTP_REQUEST_DURATION,
+    MESSAGES_DEDUPED,
+    REACTIONS,
+    RENDER_DURATION,
+    ROOMS_JOINED,
+    SOCKET_AUTH_REFRESHES,
+    SOCKETS_CONNECTED,
+    SOCKETS_EXPIRED,
+    observe,
+    observe_pool,
+    render_metrics,
+    timed_event,
+)
+from lib.profiling import Profiler, verify_signature
+from lib.query_stats import (
+    end_query_scope,
+    start_query_scope,
+    track_queries,
+    tracked_event,
+)
+from lib.reactions import (
+    broadcasts,
+    fetch_counts,
+    message_room,
+    overlay,
+    react,
+    valid_emoji,
+)
+from lib.read_markers import mark_read
+from lib.room_purge import job_key, tombstone_room
+from lib.search import (
+    MAX_OFFSET,
+    SearchUnavailable,
+    enqueue_message,
+    index_status,
+    search_messages,
+)
+from lib.serialization import compress_response, json_provider, socketio_json
+from lib.socket_auth import expired_sids, expiry_hint
+from lib.tracing import (
+    end_root,
+    instrument_engine,
+    span,
+    start_root,
+    traced_event,
+)
+from lib.user_directory import users
 from models import MemberRole, Room_members
 
 # -------------------------
 # App & Socket.IO
 # -------------------------
+# Importing this module does no I/O: Socket.IO and CORS are attached in
+# create_app(), and MySQL/Redis are connected in the background by
+# lib.lifecycle once per worker process, so gunicorn can --preload it.
 app = Flask(__name__)
-
-socketio = SocketIO(
-    app,
-    cors_allowed_origins=[
-        "http://localhost:3000",
-        "http://localhost:5173",
-        "http://localhost:6767",
-        "https://crossing-watches-isle-fonts.trycloudflare.com",
-    ],
-    logger=False,
-    engineio_logger=False,
-    message_queue="redis://redis:6379/0",
-    async_mode="gevent",
-)
-
-
-CORS(
-    app,
-    origins=[
-        "http://localhost:3000",
-        "http://localhost:5173",
-        "http://localhost:6767",
-        "https://crossing-watches-isle-fonts.trycloudflare.com",
-    ],
-    supports_credentials=True,
-    allow_headers=["Content-Type", "Authorization"],
-    methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"],
-)
+app.json = json_provider(app)
+socketio = SocketIO()
 
 linker = Linker(
     callbacks=[
@@ -87,33 +166,85 @@ linker = Linker(
 # -------------------------
 # Redis
 # -------------------------
-for i in range(50):
-    try:
-        redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
-        redis_client.ping()
-        break
-    except redis.ConnectionError:
-        print("Waiting for Redis...")
-        time.sleep(1)
-else:
-    raise RuntimeError("Cannot connect to Redis")
+# the client connects lazily on its first command
+redis_client = create_kv()
+
+# the schema is created once per deployment by tools/init_db.py, not here
+lifecycle.register("database", check=ping_db)
+lifecycle.register("redis", check=redis_client.ping)
+
+# deferred work normally runs in worker.py; with JOBS_IN_PROCESS each app
+# process runs its own worker on a background thread instead
+if JOBS_IN_PROCESS:
+    import lib.tasks  # noqa: F401  registers the tasks
+
+    lifecycle.run_in_background(
+        "jobs", Worker(redis_client, ["default"], blocking=False).run
+    )
+
+# off until switched on via POST /admin/profiling or the Redis flag
+profiler = Profiler(redis_client)
+# SQL statements become spans of the current trace, if any
+instrument_engine(engine)
+# statement counts per request/event, slow query log
+track_queries(engine)
+
 
 # -------------------------
 # Logging
 # -------------------------
-logger.remove(0)
-logger.add(
-    sys.stderr,
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message} | {extra}",
-    level="TRACE",
-    colorize=True,
-)
-logger.add(
-    "/log/app.log",
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message} | {extra}",
-    level="TRACE",
-    serialize=True,
-)
+# writes happen on a background thread, see lib/log_pipeline.py
+def configure_logging():
+    policies = LogPolicies(LOG_LEVEL, LOG_POLICIES)
+    logger.remove()
+    logger.add(
+        AsyncSink("stderr", StreamWriter(sys.stderr), LOG_QUEUE_SIZE),
+        format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message} | {extra}",
+        level=policies.min_level,
+        filter=policies,
+        colorize=True,
+    )
+    if LOG_FILE:
+        logger.add(
+            AsyncSink(
+                "file",
+                RotatingFileWriter(LOG_FILE, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUPS),
+                LOG_QUEUE_SIZE,
+            ),
+            format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message} | {extra}",
+            level=policies.min_level,
+            filter=policies,
+            serialize=True,
+        )
+
+
+_app_configured = False
+
+
+def create_app() -> Flask:
+    global _app_configured
+    if _app_configured:
+        return app
+
+    configure_logging()
+    socketio.init_app(
+        app,
+        cors_allowed_origins=CORS_ORIGINS,
+        logger=False,
+        engineio_logger=False,
+        message_queue=message_queue_url(),
+        async_mode="gevent",
+        json=socketio_json(),
+    )
+    CORS(
+        app,
+        origins=CORS_ORIGINS,
+        supports_credentials=True,
+        allow_headers=["Content-Type", "Authorization"],
+        methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"],
+    )
+    _app_configured = True
+    return app
 
 
 def get_token_from_header():
@@ -128,23 +259,58 @@ def get_token_from_header():
 # -------------------------
 @app.before_request
 def start_request():
+    lifecycle.start()
+    g.started = time.perf_counter()
     g.request_id = str(uuid.uuid4())
+    # the rule template (or "unmatched") keeps metric labels bounded
+    rule = request.url_rule.rule if request.url_rule else "unmatched"
+    route = f"{request.method} {rule}"
+    g.query_stats = start_query_scope(route)
+    g.profile = profiler.maybe_start(f"http-{g.request_id}", route)
+    g.trace = start_root(
+        route,
+        traceparent=request.headers.get("traceparent"),
+        request_id=g.request_id,
+    )
     g.db = session_local()
-    g.log = logger.bind(request_id=g.request_id)
+    # "route" selects the log policy (LOG_POLICIES)
+    g.log = logger.bind(request_id=g.request_id, route=route)
+    if g.trace:
+        g.log = g.log.bind(trace_id=g.trace.trace.trace_id)
 
     token = get_token_from_header()
     g.user_id = None
     if token:
         try:
-            payload = verify_access_token(token)
+            with span("auth.verify_token"):
+                payload = verify_access_token(token)
             g.user_id = payload["sub"]
         except jwt.ExpiredSignatureError:
             g.log.warning("Token expired for request")
         except jwt.InvalidTokenError:
             g.log.warning("Invalid token for request")
 
-    g.log.bind(user_id=g.user_id)
-    g.log.trace(f"{request.method} {request.path} started")
+    g.log = g.log.bind(user_id=g.user_id)
+    g.log.trace("HTTP request started", path=request.path)
+
+
+@app.after_request
+def record_request(response):
+    if "started" in g:
+        # the rule template keeps label cardinality bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_DURATION.labels(
+            request.method, route, str(response.status_code)
+        ).observe(time.perf_counter() - g.started)
+    if g.get("trace"):
+        g.trace.attributes["http.status_code"] = response.status_code
+    return response
+
+
+# registered after record_request, so it runs before it
+@app.after_request
+def compress(response):
+    return compress_response(response)
 
 
 @app.teardown_request
@@ -157,16 +323,74 @@ def end_request(exc):
     db = g.pop("db", None)
     if db:
         db.close()
+    observe_pool(engine)
+    profiler.stop(g.pop("profile", None))
+    end_root(g.pop("trace", None), exc)
+    # last: in QUERY_STRICT mode this raises
+    end_query_scope(g.pop("query_stats", None), request_id=g.get("request_id"))
 
 
 # -------------------------
 # Health
 # -------------------------
+# liveness only: never touches a dependency
 @app.route("/ping")
 def ping():
     return "pong"
 
 
+@app.route("/ready")
+def ready():
+    is_ready = lifecycle.ready()
+    status_code = 200 if is_ready else 503
+    return jsonify({"ready": is_ready, "dependencies": lifecycle.status()}), status_code
+
+
+@app.route("/metrics")
+def metrics():
+    if METRICS_TOKEN and get_token_from_header() != METRICS_TOKEN:
+        return jsonify({"error": "Unauthorized"}), 401
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+# -------------------------
+# Admin
+# -------------------------
+@app.route("/admin/profiling", methods=["POST"])
+def set_profiling():
+    # signed with PROFILING_SECRET over "<X-Timestamp>.<raw body>", see
+    # tools/profiling.py
+    if not PROFILING_SECRET:
+        return jsonify({"error": "Not found"}), 404
+    if not verify_signature(
+        PROFILING_SECRET,
+        request.headers.get("X-Timestamp"),
+        request.get_data(),
+        request.headers.get("X-Signature"),
+    ):
+        g.log.warning("Invalid profiling signature")
+        return jsonify({"error": "Invalid signature"}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        fraction = float(data.get("fraction", 0))
+        duration = float(data.get("duration", 300))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid fraction or duration"}), 400
+    if not 0 <= fraction <= 1 or not 0 < duration <= 24 * 3600:
+        return jsonify({"error": "Invalid fraction or duration"}), 400
+
+    try:
+        state = profiler.enable(fraction, duration)
+    except Exception as e:
+        g.log.error("Failed to set profiling flag", error=str(e))
+        return jsonify({"error": "Failed to set profiling"}), 500
+
+    g.log.info("Profiling updated", fraction=fraction, duration=duration)
+    return jsonify(state), 200
+
+
 # -------------------------
 # Auth routes
 # -------------------------
@@ -214,8 +438,12 @@ def signup():
     pw_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
 
     try:
-        g.db.add(models.User(username=username, password_hash=pw_hash))
+        user = models.User(username=username, password_hash=pw_hash)
+        g.db.add(user)
+        g.db.flush()
+        user_id = user.user_id
         g.db.commit()
+        index_user(redis_client, user_id, username)
         g.log.info("User created", username=username)
         return jsonify({"message": "User created"}), 201
     except SQLAlchemyError as e:
@@ -235,12 +463,11 @@ def refresh_token():
     if not token:
         g.log.error("Missing token")
         return jsonify({"error": "Missing token"}), 400
-    g.log.info("Received refresh token", token=token)
 
     try:
         payload = verify_refresh_token(token)
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
         g.log.error("Invalid token")
@@ -263,12 +490,33 @@ def get_rooms_for_user(user_id: str, db) -> list[dict]:
             models.Room.room_id, models.Room.room_name, models.Room.room_description
         )
         .join(models.Room_members, models.Room.room_id == models.Room_members.room_id)
-        .filter(models.Room_members.user_id == user_id)
+        .filter(
+            models.Room_members.user_id == user_id,
+            models.Room.date_deleted.is_(None),
+        )
         .all()
     )
     return [{"room_id": r, "room_name": n, "room_description": d} for r, n, d in rooms]
 
 
+def room_not_found(room_id: str):
+    # a 404 response for a missing or tombstoned room (its purge may still be
+    # running), None for a live one
+    try:
+        room = (
+            g.db.query(models.Room.room_id)
+            .filter(models.Room.room_id == room_id, models.Room.date_deleted.is_(None))
+            .first()
+        )
+    except SQLAlchemyError as e:
+        g.log.error("Failed to fetch room", error=str(e))
+        return jsonify({"error": "Failed to fetch room"}), 500
+    if not room:
+        g.log.warning("room not found", room_id=room_id)
+        return jsonify({"error": "room not found"}), 404
+    return None
+
+
 @app.route("/room", methods=["POST"])
 def create_room():
     token = get_token_from_header()
@@ -279,6 +527,9 @@ def create_room():
         return jsonify({"error": "Room name not provided"}), 400
 
     room_description = data.get("room_description", "")
+    is_public = data.get("is_public", False)
+    if not isinstance(is_public, bool):
+        return jsonify({"error": "is_public must be a boolean"}), 400
 
     if not token:
         g.log.error("Token not provided")
@@ -296,7 +547,11 @@ def create_room():
         return jsonify({"error": "Invalid token"}), 401
 
     try:
-        room = models.Room(room_name=room_name, room_description=room_description)
+        room = models.Room(
+            room_name=room_name,
+            room_description=room_description,
+            is_public=is_public,
+        )
         g.db.add(room)
         g.db.flush()
         g.db.add(
@@ -313,6 +568,9 @@ def create_room():
         g.log.error("Room creation failed", error=str(e))
         return jsonify({"error": "Room creation failed"}), 500
 
+    bump_user_rooms(redis_client, payload["sub"])
+    index_room(redis_client, room_id, room_name, is_public)
+
     return jsonify({"message": "Room created", "room_id": room_id}), 201
 
 
@@ -327,34 +585,59 @@ def delete_room(room_id):
     try:
         payload = verify_access_token(token)
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
 
     try:
         user_id = payload["sub"]
-        member = (
-            g.db.query(models.Room_members)
-            .filter_by(room_id=room_id, user_id=user_id)
+        room = (
+            g.db.query(models.Room.room_id, models.Room_members.member_role)
+            .outerjoin(
+                models.Room_members,
+                and_(
+                    models.Room_members.room_id == models.Room.room_id,
+                    models.Room_members.user_id == user_id,
+                ),
+            )
+            .filter(models.Room.room_id == room_id, models.Room.date_deleted.is_(None))
             .first()
         )
-        room = g.db.query(models.Room).filter_by(room_id=room_id).first()
         if not room:
-            g.log.warning("room not found", token=token)
+            g.log.warning("room not found")
             return jsonify({"error": "room not found"}), 404
-        if not member or member.member_role != MemberRole.OWNER:
-            g.log.warning("unauthorized room deletion", token=token, room_id=room_id)
+        if room.member_role != MemberRole.OWNER:
+            g.log.warning("unauthorized room deletion", room_id=room_id)
             return jsonify({"error": "unauthorized room deletion"}), 403
 
-        g.db.delete(room)
-        g.db.commit()
+        # only the tombstone is written here; members and messages are purged
+        # in batches in the background
+        tombstone_room(g.db, room_id)
+        member_ids = room_member_ids(g.db, room_id)
     except SQLAlchemyError as e:
         g.db.rollback()
         g.log.error("Room deletion failed", error=str(e))
         return jsonify({"error": "Room deletion failed"}), 500
 
+    bump_user_rooms(redis_client, *member_ids)
+    bump_room_members(redis_client, room_id)
+    socketio.emit("room_deleted", {"room": room_id}, room=room_id)
+    socketio.close_room(room_id)
+    unindex_room(redis_client, room_id)
+    try:
+        enqueue(
+            redis_client,
+            "purge_room",
+            {"room_id": room_id},
+            idempotency_key=job_key(room_id),
+        )
+    except RedisError as e:
+        # the room is already tombstoned; the hourly purge_tombstoned_rooms
+        # sweep picks it up
+        g.log.warning("Purge enqueue failed", room_id=room_id, error=str(e))
+    g.log.info("Room tombstoned", room_id=room_id)
     return jsonify({"message": "Room deleted"}), 200
 
 
@@ -373,48 +656,55 @@ def update_room(room_id):
     try:
         payload = verify_access_token(token)
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
     try:
+        # one round trip for the room and the caller's role in it
         result = (
-            g.db.query(models.User, models.Room_members)
-            .join(
-                models.Room_members, models.User.user_id == models.Room_members.user_id
-            )
-            .filter(
-                models.User.user_id == payload["sub"],
-                models.Room_members.room_id == room_id,
+            g.db.query(models.Room, models.Room_members.member_role)
+            .outerjoin(
+                models.Room_members,
+                and_(
+                    models.Room_members.room_id == models.Room.room_id,
+                    models.Room_members.user_id == payload["sub"],
+                ),
             )
+            .filter(models.Room.room_id == room_id)
             .first()
         )
-        if not result:
-            g.log.warning("unauthorized room update", token=token, room_id=room_id)
-            return jsonify({"error": "unauthorized room update"}), 403
-
-        user_obj, membership = result
-
-        if membership.member_role not in [MemberRole.ADMIN, MemberRole.OWNER]:
-            g.log.warning("unauthorized room update", token=token, room_id=room_id)
+        if not result or result.member_role not in [
+            MemberRole.ADMIN,
+            MemberRole.OWNER,
+        ]:
+            g.log.warning("unauthorized room update", room_id=room_id)
             return jsonify({"error": "unauthorized room update"}), 403
 
-        room = g.db.query(models.Room).filter(models.Room.room_id == room_id).first()
-        if not room:
-            g.log.warning("room not found", token=token, room_id=room_id)
+        room = result.Room
+        if room.date_deleted is not None:
+            g.log.warning("room not found", room_id=room_id)
             return jsonify({"error": "room not found"}), 404
         room_name = data.get("room_name")
         room_description = data.get("room_description", "A room")
+        is_public = data.get("is_public")
+        if is_public is not None and not isinstance(is_public, bool):
+            return jsonify({"error": "is_public must be a boolean"}), 400
         if room_name:
             room.room_name = room_name
         if room_description:
             room.room_description = room_description
+        if is_public is not None:
+            room.is_public = is_public
         g.db.commit()
+        index_room(redis_client, room_id, room.room_name, room.is_public)
+        # name and description are part of every member's room list
+        bump_user_rooms(redis_client, *room_member_ids(g.db, room_id))
         return jsonify({"message": "room updated"}), 200
     except SQLAlchemyError as e:
         g.db.rollback()
-        g.log.error("Integrity error", token=token, room_id=room_id, error=str(e))
+        g.log.error("Integrity error", room_id=room_id, error=str(e))
         return jsonify({"error": "Integrity error"}), 400
 
 
@@ -429,34 +719,167 @@ def my_rooms():
     try:
         payload = verify_access_token(token)
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
 
     user_id = payload["sub"]
+
+    def build():
+        rooms = user_rooms(g.db, user_id)
+        g.log.info("Fetched user rooms", user_id=user_id, count=len(rooms["rooms"]))
+        return rooms
+
     try:
-        rooms = (
-            g.db.query(
-                models.Room.room_id, models.Room.room_name, models.Room.room_description
-            )
-            .join(
-                models.Room_members, models.Room.room_id == models.Room_members.room_id
-            )
-            .filter(
-                models.Room_members.user_id == user_id,
-                models.Room_members.member_role != MemberRole.BANNED,
-            )
-            .all()
-        )
-        rooms_list = [{"id": r, "name": n, "description": d} for r, n, d in rooms]
-        g.log.info("Fetched user rooms", user_id=user_id, count=len(rooms_list))
+        # 304 or the cached body unless the room list changed
+        return conditional_json(redis_client, user_rooms_key(user_id), build)
     except Exception as e:
         g.log.error("Failed to fetch rooms", error=str(e))
         return jsonify({"error": "Failed to fetch rooms"}), 500
 
-    return jsonify({"rooms": rooms_list}), 200
+
+@app.route("/bootstrap", methods=["GET"])
+def bootstrap():
+    token = get_token_from_header()
+    try:
+        payload = verify_access_token(str(token))
+    except jwt.ExpiredSignatureError:
+        g.log.error("Token expired")
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        g.log.error("Invalid token")
+        return jsonify({"error": "Invalid token"}), 401
+
+    user_id = payload["sub"]
+    try:
+        data = build_bootstrap(g.db, redis_client, user_id, request.args.get("room_id"))
+    except SQLAlchemyError as e:
+        g.log.error("Failed to bootstrap", error=str(e))
+        return jsonify({"error": "Failed to bootstrap"}), 500
+    if data is None:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify(data)
+
+
+@app.route("/search", methods=["GET"])
+def search():
+    token = get_token_from_header()
+    try:
+        payload = verify_access_token(str(token))
+    except jwt.ExpiredSignatureError:
+        g.log.error("Token expired")
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        g.log.error("Invalid token")
+        return jsonify({"error": "Invalid token"}), 401
+
+    user_id = payload["sub"]
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Missing query"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "Invalid limit or offset"}), 400
+    if not 0 <= offset < MAX_OFFSET:
+        return jsonify({"error": "Invalid limit or offset"}), 400
+
+    try:
+        # only rooms the caller is currently in and not banned from
+        rooms = cached_json(
+            redis_client, user_rooms_key(user_id), lambda: user_rooms(g.db, user_id)
+        )
+        room_ids = [room["id"] for room in rooms["rooms"]]
+        room_id = request.args.get("room_id")
+        if room_id:
+            if room_id not in room_ids:
+                return jsonify({"error": "Not a member of this room"}), 403
+            room_ids = [room_id]
+        results, next_offset = search_messages(g.db, query, room_ids, limit, offset)
+    except SearchUnavailable as e:
+        g.log.warning("Search unavailable", error=str(e))
+        return jsonify({"error": "Search unavailable"}), 503
+    except SQLAlchemyError as e:
+        g.log.error("Search failed", error=str(e))
+        return jsonify({"error": "Search failed"}), 500
+
+    return jsonify(
+        {
+            "results": results,
+            "next_offset": next_offset,
+            "index": index_status(redis_client),
+        }
+    )
+
+
+@app.route("/directory/rooms", methods=["GET"])
+def directory_rooms():
+    token = get_token_from_header()
+    try:
+        payload = verify_access_token(str(token))
+    except jwt.ExpiredSignatureError:
+        g.log.error("Token expired")
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        g.log.error("Invalid token")
+        return jsonify({"error": "Invalid token"}), 401
+
+    user_id = payload["sub"]
+    try:
+        rooms = cached_json(
+            redis_client, user_rooms_key(user_id), lambda: user_rooms(g.db, user_id)
+        )
+        return jsonify(
+            search_rooms(g.db, redis_client, user_id, rooms["rooms"], request.args)
+        )
+    except InvalidQuery as e:
+        return jsonify({"error": str(e)}), 400
+    except RedisError as e:
+        g.log.warning("Directory unavailable", error=str(e))
+        return jsonify({"error": "Directory unavailable"}), 503
+    except SQLAlchemyError as e:
+        g.log.error("Room directory search failed", error=str(e))
+        return jsonify({"error": "Room directory search failed"}), 500
+
+
+@app.route("/directory/users", methods=["GET"])
+def directory_users():
+    token = get_token_from_header()
+    try:
+        payload = verify_access_token(str(token))
+    except jwt.ExpiredSignatureError:
+        g.log.error("Token expired")
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        g.log.error("Invalid token")
+        return jsonify({"error": "Invalid token"}), 401
+
+    user_id = payload["sub"]
+    room_id = request.args.get("room_id")
+    try:
+        # roles in a room are only shown to its members
+        if room_id:
+            rooms = cached_json(
+                redis_client,
+                user_rooms_key(user_id),
+                lambda: user_rooms(g.db, user_id),
+            )
+            if room_id not in [room["id"] for room in rooms["rooms"]]:
+                return jsonify({"error": "Not a member of this room"}), 403
+        return jsonify(
+            search_users(g.db, redis_client, request.args, room_id=room_id or None)
+        )
+    except InvalidQuery as e:
+        return jsonify({"error": str(e)}), 400
+    except RedisError as e:
+        g.log.warning("Directory unavailable", error=str(e))
+        return jsonify({"error": "Directory unavailable"}), 503
+    except SQLAlchemyError as e:
+        g.log.error("User directory search failed", error=str(e))
+        return jsonify({"error": "User directory search failed"}), 500
 
 
 # -------------------------
@@ -475,12 +898,15 @@ def manage_member(room_id, user_id):
     try:
         payload = verify_access_token(token)
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
 
+    if missing := room_not_found(room_id):
+        return missing
+
     requesting_user_id = payload["sub"]
 
     # Query the requester once
@@ -523,6 +949,8 @@ def manage_member(room_id, user_id):
                 try:
                     g.db.delete(member)
                     g.db.commit()
+                    bump_user_rooms(redis_client, user_id)
+                    bump_room_members(redis_client, room_id)
                     return jsonify({"message": "Member deleted"}), 200
                 except Exception as e:
                     g.log.error("Failed to delete member", error=str(e))
@@ -541,6 +969,8 @@ def manage_member(room_id, user_id):
 
             g.db.delete(member)
             g.db.commit()
+            bump_user_rooms(redis_client, user_id)
+            bump_room_members(redis_client, room_id)
             return jsonify({"message": "Member deleted"}), 200
         except Exception as e:
             g.log.error("Failed to delete member", error=str(e))
@@ -606,6 +1036,9 @@ def manage_member(room_id, user_id):
                 return jsonify({"error": "Cannot assign owner role"}), 403
 
             g.db.commit()
+            # BANNED hides the room from the member's own list too
+            bump_user_rooms(redis_client, user_id)
+            bump_room_members(redis_client, room_id)
             return jsonify(
                 {"message": "Member updated", "role": member.member_role.name}
             ), 200
@@ -636,11 +1069,15 @@ def transfer_owner(room_id, new_owner_id):
     try:
         payload = verify_access_token(token)
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
+
+    if missing := room_not_found(room_id):
+        return missing
+
     current_owner_id = payload["sub"]
 
     try:
@@ -672,6 +1109,7 @@ def transfer_owner(room_id, new_owner_id):
         new_owner.member_role = MemberRole.OWNER
         current_owner.member_role = MemberRole.MEMBER
         g.db.commit()
+        bump_room_members(redis_client, room_id)
         g.log.info("Ownership transferred", room_id=room_id, new_owner_id=new_owner_id)
         return jsonify({"message": "Ownership transferred"}), 200
     except NoResultFound:
@@ -685,14 +1123,18 @@ def join_room_rest(room_id):
     try:
         payload = verify_access_token(str(token))
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
     user_id = payload["sub"]
     try:
-        room = g.db.query(models.Room).filter_by(room_id=room_id).first()
+        room = (
+            g.db.query(models.Room.room_id)
+            .filter(models.Room.room_id == room_id, models.Room.date_deleted.is_(None))
+            .first()
+        )
         if not room:
             return jsonify({"error": "Room not found"}), 404
     except SQLAlchemyError as e:
@@ -720,6 +1162,8 @@ def join_room_rest(room_id):
     try:
         g.db.add(new_member)
         g.db.commit()
+        bump_user_rooms(redis_client, user_id)
+        bump_room_members(redis_client, room_id)
         g.log.info("Member added", user_id=user_id, room_id=room_id)
         return jsonify({"message": "Member added"}), 201
     except SQLAlchemyError as e:
@@ -734,10 +1178,10 @@ def leave_room(room_id):
     try:
         payload = verify_access_token(str(token))
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
 
     user_id = payload["sub"]
@@ -757,6 +1201,8 @@ def leave_room(room_id):
             return jsonify({"error": "You are the owner"}), 403
         g.db.delete(requester)
         g.db.commit()
+        bump_user_rooms(redis_client, user_id)
+        bump_room_members(redis_client, room_id)
         g.log.info("User removed from room", user_id=user_id, room_id=room_id)
         return jsonify({"message": "User removed from room"}), 200
     except SQLAlchemyError as e:
@@ -770,35 +1216,140 @@ def list_members(room_id):
     try:
         verify_access_token(str(token))
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
-    try:
+
+    if missing := room_not_found(room_id):
+        return missing
+
+    if wants_page(request.args):
+        # paginated mode: ?limit=&cursor=&role=&q=, banned members excluded
+        try:
+            variant = page_variant(request.args)
+            return conditional_json(
+                redis_client,
+                room_members_key(room_id),
+                lambda: list_members_page(g.db, room_id, request.args),
+                variant=variant,
+            )
+        except InvalidQuery as e:
+            return jsonify({"error": str(e)}), 400
+        except SQLAlchemyError as e:
+            g.log.error("Failed to retrieve members", error=str(e))
+            return jsonify({"error": "Failed to retrieve members"}), 500
+
+    def build():
         members = (
-            g.db.query(models.Room_members, models.User.username)
-            .join(models.User, models.Room_members.user_id == models.User.user_id)
-            .filter(models.Room_members.room_id == room_id)
+            g.db.query(Room_members.user_id, Room_members.member_role)
+            .filter(Room_members.room_id == room_id)
             .all()
         )
-
+        names = users.usernames(g.db, (member.user_id for member in members))
         g.log.info("Members retrieved", room_id=room_id)
-        return jsonify(
-            [
-                {
-                    "username": username,
-                    "id": member.user_id,
-                    "role": member.member_role.name,
-                }
-                for member, username in members
-            ]
-        ), 200
+        return [
+            {
+                "username": names[member.user_id],
+                "id": member.user_id,
+                "role": member.member_role.name,
+            }
+            for member in members
+            if member.user_id in names
+        ]
+
+    try:
+        return conditional_json(redis_client, room_members_key(room_id), build)
     except SQLAlchemyError as e:
         g.log.error("Failed to retrieve members", error=str(e))
         return jsonify({"error": "Failed to retrieve members"}), 500
 
 
+@app.route("/room/<string:room_id>/members/count", methods=["GET"])
+def count_room_members(room_id):
+    token = get_token_from_header()
+    try:
+        verify_access_token(str(token))
+    except jwt.ExpiredSignatureError:
+        g.log.error("Token expired")
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        g.log.error("Invalid token")
+        return jsonify({"error": "Invalid token"}), 401
+
+    if missing := room_not_found(room_id):
+        return missing
+
+    try:
+        return conditional_json(
+            redis_client,
+            room_members_key(room_id),
+            lambda: count_members(g.db, room_id),
+            variant="count",
+        )
+    except SQLAlchemyError as e:
+        g.log.error("Failed to count members", error=str(e))
+        return jsonify({"error": "Failed to count members"}), 500
+
+
+@app.route("/room/<string:room_id>/export", methods=["GET"])
+def export_room(room_id):
+    token = get_token_from_header()
+    try:
+        payload = verify_access_token(str(token))
+    except jwt.ExpiredSignatureError:
+        g.log.error("Token expired")
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        g.log.error("Invalid token")
+        return jsonify({"error": "Invalid token"}), 401
+
+    try:
+        after_id = int(request.args.get("after_id", 0))
+    except ValueError:
+        return jsonify({"error": "Invalid after_id"}), 400
+
+    try:
+        result = (
+            g.db.query(models.Room.date_deleted, models.Room_members.member_role)
+            .join(
+                models.Room_members,
+                models.Room_members.room_id == models.Room.room_id,
+            )
+            .filter(
+                models.Room.room_id == room_id,
+                models.Room_members.user_id == payload["sub"],
+            )
+            .first()
+        )
+    except SQLAlchemyError as e:
+        g.log.error("Failed to check export permission", error=str(e))
+        return jsonify({"error": "Failed to export room"}), 500
+    if not result or result.member_role not in [MemberRole.ADMIN, MemberRole.OWNER]:
+        g.log.warning("unauthorized room export", room_id=room_id)
+        return jsonify({"error": "unauthorized room export"}), 403
+    if result.date_deleted is not None:
+        return jsonify({"error": "room not found"}), 404
+
+    g.log.info("Room export started", room_id=room_id, after_id=after_id)
+    # the generator runs after this request's session is closed; it opens
+    # its own, one per cursor chunk
+    body = gzip_members(export_batches(session_local, room_id, after_id))
+    return Response(
+        body,
+        mimetype="application/gzip",
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="room-{room_id}-after-{after_id}.ndjson.gz"'
+            ),
+            "Cache-Control": "no-store",
+            # let reverse proxies pass chunks through as they are produced
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
 @app.route("/room/<string:room_id>/ban/<string:user_id>", methods=["POST"])
 def ban_member(room_id, user_id):
     token = get_token_from_header()
@@ -806,12 +1357,15 @@ def ban_member(room_id, user_id):
         payload = verify_access_token(str(token))
         requester_user_id = payload["sub"]
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
 
+    if missing := room_not_found(room_id):
+        return missing
+
     try:
         is_admin_or_owner = (
             g.db.query(models.Room_members)
@@ -882,6 +1436,8 @@ def ban_member(room_id, user_id):
 
         banned_member.member_role = MemberRole.BANNED
         g.db.commit()
+        bump_user_rooms(redis_client, user_id)
+        bump_room_members(redis_client, room_id)
         return jsonify({"message": "User banned successfully"}), 200
 
     except SQLAlchemyError as e:
@@ -901,11 +1457,14 @@ def unban_member(room_id, user_id):
         payload = verify_access_token(str(token))
         requester_user_id = payload["sub"]
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
+
+    if missing := room_not_found(room_id):
+        return missing
     if requester_user_id == user_id:
         g.log.error(
             "Cannot unban yourself",
@@ -976,6 +1535,8 @@ def unban_member(room_id, user_id):
         unbanned_member.member_role = MemberRole.MEMBER
 
         g.db.commit()
+        bump_user_rooms(redis_client, user_id)
+        bump_room_members(redis_client, room_id)
         g.log.info(
             "User unbanned successfully",
             user_id=requester_user_id,
@@ -999,11 +1560,14 @@ def promote_user(room_id, user_id):
         payload = verify_access_token(str(token))
         requester_user_id = payload["sub"]
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
+
+    if missing := room_not_found(room_id):
+        return missing
     if requester_user_id == user_id:
         g.log.error(
             "Cannot unban yourself",
@@ -1074,6 +1638,7 @@ def promote_user(room_id, user_id):
             return jsonify({"error": "User is already an owner"}), 400
         promote_member.member_role = MemberRole.ADMIN
         g.db.commit()
+        bump_room_members(redis_client, room_id)
         g.log.info(
             "User promoted to admin",
             user_id=user_id,
@@ -1097,11 +1662,14 @@ def demote_user(room_id, user_id):
         payload = verify_access_token(str(token))
         requester_user_id = payload["sub"]
     except jwt.ExpiredSignatureError:
-        g.log.error("Token expired", token=token)
+        g.log.error("Token expired")
         return jsonify({"error": "Token expired"}), 401
     except jwt.InvalidTokenError:
-        g.log.error("Invalid token", token=token)
+        g.log.error("Invalid token")
         return jsonify({"error": "Invalid token"}), 401
+
+    if missing := room_not_found(room_id):
+        return missing
     if requester_user_id == user_id:
         g.log.error(
             "Cannot unban yourself",
@@ -1172,6 +1740,7 @@ def demote_user(room_id, user_id):
             return jsonify({"error": "User is already an owner"}), 400
         demote_member.member_role = MemberRole.MEMBER
         g.db.commit()
+        bump_room_members(redis_client, room_id)
         g.log.info(
             "User demoted to member",
             user_id=user_id,
@@ -1195,8 +1764,23 @@ def demote_user(room_id, user_id):
 socket_state: dict[str, dict] = {}
 
 
+def instrumented(event: str):
+    # metrics, profiling, log policy, query stats and tracing for one
+    # socket handler
+    def decorator(handler):
+        handler = traced_event(event)(handler)
+        handler = tracked_event(event)(handler)
+        handler = log_event(event)(handler)
+        handler = profiler.profiled_event(event)(handler)
+        return timed_event(event)(handler)
+
+    return decorator
+
+
 @socketio.on("connect")
+@instrumented("connect")
 def socket_connect(auth):
+    lifecycle.start()
     request_id = request.sid
     token = None
     log = logger.bind(request_id=request_id)
@@ -1213,7 +1797,8 @@ def socket_connect(auth):
         return False
 
     try:
-        payload = verify_access_token(token)
+        with span("auth.verify_token"):
+            payload = verify_access_token(token)
     except jwt.ExpiredSignatureError:
         log.warning("Token expired")
         return False
@@ -1237,12 +1822,85 @@ def socket_connect(auth):
         "user_id": user_id,
         "username": username,
         "rooms": set(),
+        "expires_at": payload["exp"],
     }
+    SOCKETS_CONNECTED.inc()
+    emit("auth_expiry", expiry_hint(payload["exp"]))
 
     log.info("Socket connected", user_id=user_id)
 
 
+@socketio.on("refresh_auth")
+@instrumented("refresh_auth")
+def refresh_auth(data):
+    # renews the socket's session in place with a new access token, or a
+    # refresh token (the ack then carries a new access token); the ack is
+    # {"ok": True, "expires_at", "expires_in", "refresh_in"} or
+    # {"ok": False, "error"}
+    state = socket_state.get(request.sid)
+    if not state:
+        return {"ok": False, "error": "Not connected"}
+    if not isinstance(data, dict):
+        return {"ok": False, "error": "Invalid refresh payload"}
+
+    kind = "refresh" if data.get("refresh_token") else "access"
+    try:
+        if kind == "refresh":
+            payload = verify_refresh_token(data["refresh_token"])
+        else:
+            payload = verify_access_token(data.get("token") or "")
+    except jwt.ExpiredSignatureError:
+        SOCKET_AUTH_REFRESHES.labels(kind, "expired").inc()
+        return {"ok": False, "error": "Token expired"}
+    except jwt.InvalidTokenError:
+        SOCKET_AUTH_REFRESHES.labels(kind, "invalid").inc()
+        return {"ok": False, "error": "Invalid token"}
+
+    if payload["sub"] != state["user_id"]:
+        SOCKET_AUTH_REFRESHES.labels(kind, "invalid").inc()
+        logger.warning("refresh_auth for another user", sid=request.sid)
+        return {"ok": False, "error": "Token is for another user"}
+
+    response = {"ok": True}
+    if kind == "refresh":
+        token = create_access_token(state["user_id"])
+        payload = verify_access_token(token)
+        response["access_token"] = token
+    state["expires_at"] = payload["exp"]
+    SOCKET_AUTH_REFRESHES.labels(kind, "ok").inc()
+    return {**response, **expiry_hint(payload["exp"])}
+
+
+def forget_socket(sid):
+    # the only way a socket leaves socket_state, so the gauges follow it;
+    # None when it is already gone
+    state = socket_state.pop(sid, None)
+    if state:
+        SOCKETS_CONNECTED.dec()
+        ROOMS_JOINED.dec(len(state["rooms"]))
+    return state
+
+
+def sweep_expired_sockets():
+    # one per process: socket_state only holds this process's sockets
+    while True:
+        time.sleep(SOCKET_AUTH_SWEEP_INTERVAL)
+        for sid in expired_sids(socket_state):
+            logger.info("Socket session expired", sid=sid)
+            SOCKETS_EXPIRED.inc()
+            try:
+                socketio.emit("auth_expired", {}, to=sid)
+                socketio.server.disconnect(sid, namespace="/")
+            except Exception as e:
+                logger.warning("Expired socket disconnect failed", error=str(e))
+                forget_socket(sid)
+
+
+lifecycle.run_in_background("socket-auth-sweeper", sweep_expired_sockets)
+
+
 @socketio.on("join_rooms")
+@instrumented("join_rooms")
 def socket_join_rooms(data):
     log = logger.bind(request_id=request.sid)
     state = socket_state.get(request.sid)
@@ -1265,16 +1923,20 @@ def socket_join_rooms(data):
     try:
         allowed_rooms = (
             db.query(models.Room_members.room_id)
+            .join(models.Room, models.Room.room_id == models.Room_members.room_id)
             .filter(
                 models.Room_members.user_id == state["user_id"],
                 models.Room_members.room_id.in_(room_ids),
                 models.Room_members.member_role != MemberRole.BANNED,
+                models.Room.date_deleted.is_(None),
             )
             .all()
         )
         for (room_id,) in allowed_rooms:
             socket_join_room(room_id)
-            state["rooms"].add(room_id)
+            if room_id not in state["rooms"]:
+                state["rooms"].add(room_id)
+                ROOMS_JOINED.inc()
 
         emit("joined_rooms", {"rooms": list(state["rooms"])})
     except Exception as e:
@@ -1284,41 +1946,40 @@ def socket_join_rooms(data):
         db.close()
 
 
+def in_room(state, room_id) -> bool:
+    # delete_room's close_room() reaches every worker through the message
+    # queue and takes the sockets out of the Socket.IO room. socket_state
+    # follows it here, so a socket that joined before the room was
+    # tombstoned cannot keep reading or writing in it.
+    if not state or room_id not in state["rooms"]:
+        return False
+    if room_id not in rooms():
+        state["rooms"].discard(room_id)
+        ROOMS_JOINED.dec()
+        return False
+    return True
+
+
 @socketio.on("fetch_history")
+@instrumented("fetch_history")
 def fetch_history(data):
-    print("Fetching history", data)
     state = socket_state.get(request.sid)
     room_id = data.get("room")
     log = logger.bind(room_id=room_id, request_id=request.sid)
+    log.trace("Fetching history")
 
-    if not state or room_id not in state["rooms"]:
+    if not in_room(state, room_id):
         emit("error", {"error": "Not in room"})
         return
 
     db = session_local()
 
     try:
-        msgs_query = (
-            db.query(models.Message, models.User.username)
-            .join(models.User, models.Message.sender == models.User.user_id)
-            .filter(models.Message.room_id == room_id)
-            .order_by(models.Message.id.desc())
-            .limit(100)
-            .all()
-        )
-
-        msgs = [
-            {
-                "sender": sender,
-                "sender_id": msg.sender,
-                "message_id": msg.id,
-                "message": msg.message,
-                "timestamp": msg.date_created.astimezone(timezone.utc).isoformat(),
-            }
-            for msg, sender in reversed(msgs_query)
-        ]
-
+        msgs = recent_messages(db, room_id)
+        overlay(redis_client, msgs)
         emit("old_messages", {"room": room_id, "messages": msgs})
+        if msgs:
+            mark_read(redis_client, state["user_id"], room_id, msgs[-1]["message_id"])
     except Exception as e:
         db.rollback()
         log.error("Failed to fetch history", error=str(e))
@@ -1327,56 +1988,196 @@ def fetch_history(data):
         db.close()
 
 
+@socketio.on("mark_read")
+@instrumented("mark_read")
+def socket_mark_read(data):
+    state = socket_state.get(request.sid)
+    if not state or not isinstance(data, dict):
+        emit("error", {"error": "Invalid mark_read payload"})
+        return
+    room_id = data.get("room")
+    message_id = data.get("message_id")
+    if not in_room(state, room_id) or not isinstance(message_id, int):
+        emit("error", {"error": "Invalid mark_read payload"})
+        return
+    mark_read(redis_client, state["user_id"], room_id, message_id)
+
+
+def _react(data, add: bool):
+    # add_reaction and remove_reaction; the ack carries the count after it
+    state = socket_state.get(request.sid)
+    if not state or not isinstance(data, dict):
+        emit("error", {"error": "Invalid reaction payload"})
+        return {"ok": False, "error": "Invalid reaction payload"}
+    room_id = data.get("room")
+    message_id = data.get("message_id")
+    emoji = data.get("emoji")
+    if not in_room(state, room_id):
+        emit("error", {"error": "Not in room"})
+        return {"ok": False, "error": "Not in room"}
+    if not isinstance(message_id, int) or not valid_emoji(emoji):
+        emit("error", {"error": "Invalid reaction"})
+        return {"ok": False, "error": "Invalid reaction"}
+
+    db = session_local()
+    try:
+        if message_room(db, redis_client, message_id) != room_id:
+            emit("error", {"error": "Message not found"})
+            return {"ok": False, "error": "Message not found"}
+        changed, count = react(redis_client, state["user_id"], message_id, emoji, add)
+    except (RedisError, SQLAlchemyError) as e:
+        logger.error("Reaction failed", message_id=message_id, error=str(e))
+        emit("error", {"error": "Reactions unavailable"})
+        return {"ok": False, "error": "Reactions unavailable"}
+    finally:
+        db.close()
+
+    REACTIONS.labels("add" if add else "remove", "changed" if changed else "noop").inc()
+    if changed:
+        broadcasts.mark(room_id, message_id)
+    return {
+        "ok": True,
+        "message_id": message_id,
+        "emoji": emoji,
+        "changed": changed,
+        "count": count,
+    }
+
+
+@socketio.on("add_reaction")
+@instrumented("add_reaction")
+def add_reaction(data):
+    return _react(data, add=True)
+
+
+@socketio.on("remove_reaction")
+@instrumented("remove_reaction")
+def remove_reaction(data):
+    return _react(data, add=False)
+
+
+def broadcast_reactions():
+    # one "reactions" event per room per interval with the current counts of
+    # the messages that changed, however many clicks there were
+    while True:
+        time.sleep(REACTION_BROADCAST_INTERVAL)
+        pending = broadcasts.drain()
+        if not pending:
+            continue
+        try:
+            live = fetch_counts(
+                redis_client, {mid for mids in pending.values() for mid in mids}
+            )
+        except RedisError as e:
+            logger.warning("Reaction broadcast failed", error=str(e))
+            continue
+        for room_id, message_ids in pending.items():
+            socketio.emit(
+                "reactions",
+                {
+                    "room": room_id,
+                    "messages": [
+                        {"message_id": mid, "reactions": live.get(mid, {})}
+                        for mid in sorted(message_ids)
+                    ],
+                },
+                to=room_id,
+            )
+
+
+lifecycle.run_in_background("reaction-broadcaster", broadcast_reactions)
+
+
 @socketio.on("send_message")
+@instrumented("send_message")
 def send_message(data):
+    # the return value is the Socket.IO ack: {"ok": True, "message_id",
+    # "timestamp", "client_id", "duplicate"} or {"ok": False, "error"}
     state = socket_state.get(request.sid)
     room_id = data.get("room")
     message = data.get("message")
+    client_id = data.get("client_id")
 
-    if not state or room_id not in state["rooms"]:
+    if not in_room(state, room_id):
         emit("error", {"error": "Not in room"})
-        return
+        return {"ok": False, "error": "Not in room"}
 
     if not message:
         emit("error", {"error": "Empty message"})
-        return
+        return {"ok": False, "error": "Empty message"}
 
     if len(message) > MAX_MESSAGE_LENGTH:
         emit("error", {"error": "Message too long"})
-        return
+        return {"ok": False, "error": "Message too long"}
+
+    if client_id is not None:
+        if not valid_client_id(client_id):
+            emit("error", {"error": "Invalid client_id"})
+            return {"ok": False, "error": "Invalid client_id"}
+        earlier = claim(redis_client, state["user_id"], client_id)
+        if earlier is not None:
+            # a resend: answer with the first send's result, no second write
+            MESSAGES_DEDUPED.inc()
+            if earlier.get("pending"):
+                return {
+                    "ok": False,
+                    "error": "Send in progress",
+                    "client_id": client_id,
+                }
+            return {"ok": True, "client_id": client_id, "duplicate": True, **earlier}
+
     message = message.replace("```", "")
-    message = render_message(message)
+    with span("render"), observe(RENDER_DURATION):
+        message = render_message(message)
     db = session_local()
 
     try:
-        msg = models.Message(
-            sender=state["user_id"],
-            room_id=room_id,
-            message=message,
-        )
-        db.add(msg)
-        db.commit()
-        db.refresh(msg)
+        with span("db.insert_message"):
+            inserted = insert_message(db, state["user_id"], room_id, message)
+        if inserted is None:
+            # tombstoned since this socket joined
+            state["rooms"].discard(room_id)
+            ROOMS_JOINED.dec()
+            if client_id is not None:
+                release(redis_client, state["user_id"], client_id)
+            emit("error", {"error": "Not in room"})
+            return {"ok": False, "error": "Not in room", "client_id": client_id}
+        message_id, date_created = inserted
+        sent = {"message_id": message_id, "timestamp": date_created.isoformat()}
+        if client_id is not None:
+            record(redis_client, state["user_id"], client_id, sent)
 
         payload = {
             "room": room_id,
             "sender": state["username"],
             "sender_id": state["user_id"],
-            "message_id": msg.id,
             "message": message,
-            "timestamp": msg.date_created.astimezone(timezone.utc).isoformat(),
+            # lets the sender's other sockets swap in their pending copy
+            "client_id": client_id,
+            **sent,
         }
 
-        emit("new_message", payload, room=room_id)
+        enqueue_message(redis_client, message_id, room_id, message)
+        # with a message queue this is a Redis publish, delivery is async
+        with span("socketio.emit", room=room_id):
+            emit("new_message", payload, room=room_id)
+        # other workers fan out to their own sockets through the message queue
+        participants = socketio.server.manager.rooms.get("/", {}).get(room_id, {})
+        BROADCAST_FANOUT.observe(len(participants))
+        return {"ok": True, "client_id": client_id, "duplicate": False, **sent}
 
     except SQLAlchemyError:
         db.rollback()
+        if client_id is not None:
+            release(redis_client, state["user_id"], client_id)
         emit("error", {"error": "DB error"})
+        return {"ok": False, "error": "DB error", "client_id": client_id}
     finally:
         db.close()
 
 
 @socketio.on("leave_room")
+@instrumented("leave_room")
 def leave_room_handler(data):
     state = socket_state.get(request.sid)
     if not state:
@@ -1406,11 +2207,13 @@ def leave_room_handler(data):
         )
 
     state["rooms"].discard(room_id)
+    ROOMS_JOINED.dec()
 
 
 @socketio.on("disconnect")
+@instrumented("disconnect")
 def socket_disconnect(reason):
-    state = socket_state.pop(request.sid, None)
+    state = forget_socket(request.sid)
     if not state:
         return
 
@@ -1425,7 +2228,10 @@ def socket_error_handler(error):
 # -------------------------
 # Run
 # -------------------------
-init_db()
 if __name__ == "__main__":
+    # a local run is its own deployment step
+    init_db()
+    create_app()
+    lifecycle.start()
     logger.info("Server started")
     socketio.run(app, host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,47 @@
+# This work is licensed under the terms of the MIT license
+# bench/corpus.py
+#
+# Message bodies used by the micro-benchmarks. They mirror what users send:
+# short plain text, links, markdown, code blocks and inputs right at
+# MAX_MESSAGE_LENGTH.
+from config import MAX_MESSAGE_LENGTH
+
+
+def _fill(unit: str) -> str:
+    return (unit * (MAX_MESSAGE_LENGTH // len(unit) + 1))[:MAX_MESSAGE_LENGTH]
+
+
+CORPUS = {
+    "plain_short": "hey, are we still on for tonight?",
+    "plain_long": (
+        "So I looked into the deploy issue from yesterday and it turns out the "
+        "worker was restarting because the health check hit the database before "
+        "the connection pool was warm. I moved the check behind the readiness "
+        "endpoint and it has been stable since."
+    ),
+    "links": (
+        "docs are at https://example.com/docs/getting-started and the issue is "
+        "https://github.com/example/project/issues/1234, also see www.example.org"
+    ),
+    "markdown": (
+        "**Release notes**\n\n"
+        "- *faster* history loading\n"
+        "- fixed `send_message` acks\n"
+        "- > quoted text\n\n"
+        "1. first\n2. second\n"
+    ),
+    "code_block": (
+        "try this:\n\n"
+        "    def handler(data):\n"
+        "        room = data.get('room')\n"
+        "        return {'room': room, 'ok': True}\n\n"
+        "and `inline()` code"
+    ),
+    "html_injection": (
+        "<script>alert(1)</script><img src=x onerror=alert(1)> "
+        '<a href="javascript:alert(1)">x</a>'
+    ),
+    "max_plain": _fill("lorem ipsum dolor sit amet "),
+    "max_links": _fill("https://example.com/a/b?c=d "),
+    "max_markdown": _fill("**bold** _em_ `code` [link](https://example.com) "),
+}
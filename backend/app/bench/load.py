@@ -0,0 +1,333 @@
+# This work is licensed under the terms of the MIT license
+# bench/load.py
+#
+# Socket.IO load harness. Simulated clients sign up, log in, connect, join
+# rooms, fetch history and send messages at a fixed rate; every receiver
+# records send -> receive latency from the timestamp embedded in the message.
+# Prints a JSON report and exits non-zero when it regresses against a
+# baseline report.
+#
+#   # against a running server
+#   python -m bench.load --url http://localhost:5000 --clients 50
+#   # spawn a single local-mode gunicorn worker (SQLite + fakeredis)
+#   python -m bench.load --spawn-local --clients 20 --duration 30
+#   # compare with a stored report
+#   python -m bench.load --spawn-local --baseline bench/baselines/load.json
+#
+# Needs the socket.io client extras: pip install "python-socketio[client]".
+# The server's CORS_ORIGINS must include --url, Socket.IO refuses websocket
+# handshakes from other origins.
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+import socketio
+
+MESSAGE_PATTERN = re.compile(r"bench (\w+) (\d+)")
+
+
+# -------------------------
+# local server
+# -------------------------
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_local_server() -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="bench-load-")
+    env = {
+        **os.environ,
+        "STORAGE_BACKEND": "sqlite",
+        "SQLITE_PATH": os.path.join(workdir, "bench.db"),
+        "PUBSUB_BACKEND": "local",
+        "LOG_FILE": "",
+        "WEB_CONCURRENCY": "1",
+        "BIND": f"127.0.0.1:{port}",
+        # Socket.IO rejects websocket handshakes from unknown origins
+        "CORS_ORIGINS": f"http://127.0.0.1:{port}",
+    }
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "gunicorn.conf.py",
+            "app:create_app()",
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+def wait_ready(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/ready", timeout=1).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+# -------------------------
+# simulated client
+# -------------------------
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies_ms: list[float] = []
+        self.sent = 0
+        self.received = 0
+        self.errors: dict[str, int] = {}
+
+    def error(self, kind: str):
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class BenchClient:
+    def __init__(self, url: str, run_id: str, index: int, stats: Stats):
+        self.url = url
+        self.run_id = run_id
+        self.username = f"bench_{run_id}_{index}"
+        self.stats = stats
+        self.token = None
+        self.joined = threading.Event()
+        self.history = threading.Event()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on("joined_rooms", lambda data: self.joined.set())
+        self.sio.on("old_messages", lambda data: self.history.set())
+        self.sio.on("new_message", self.on_message)
+        self.sio.on("error", lambda data: stats.error(f"socket:{data.get('error')}"))
+
+    def login(self):
+        credentials = {"username": self.username, "password": "bench-password"}
+        requests.post(f"{self.url}/signup", json=credentials, timeout=10)
+        response = requests.post(f"{self.url}/login", json=credentials, timeout=10)
+        response.raise_for_status()
+        self.token = response.json()["access_token"]
+
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def create_room(self) -> str:
+        response = requests.post(
+            f"{self.url}/room",
+            json={"room_name": f"bench {self.run_id}"},
+            headers=self.headers(),
+            timeout=10,
+        )
+        response.raise_for_status()
+        return response.json()["room_id"]
+
+    def join(self, room_id: str):
+        requests.post(
+            f"{self.url}/join_room/{room_id}", headers=self.headers(), timeout=10
+        )
+        self.room_id = room_id
+        self.sio.connect(self.url, auth={"token": self.token}, transports=["websocket"])
+        self.sio.emit("join_rooms", {"room_ids": [room_id]})
+        if not self.joined.wait(10):
+            raise RuntimeError(f"{self.username} never joined {room_id}")
+
+    def fetch_history(self):
+        self.history.clear()
+        self.sio.emit("fetch_history", {"room": self.room_id})
+        if not self.history.wait(10):
+            self.stats.error("history_timeout")
+
+    def on_message(self, data):
+        now = time.time_ns()
+        match = MESSAGE_PATTERN.search(data.get("message", ""))
+        if not match or match.group(1) != self.run_id:
+            return
+        with self.stats.lock:
+            self.stats.received += 1
+            self.stats.latencies_ms.append((now - int(match.group(2))) / 1e6)
+
+    def send_loop(self, rate: float, deadline: float, history_every: int):
+        interval = 1 / rate
+        # spread clients out so they don't all send on the same tick
+        time.sleep(random.random() * interval)
+        sent = 0
+        while time.time() < deadline:
+            started = time.time()
+            try:
+                self.sio.emit(
+                    "send_message",
+                    {
+                        "room": self.room_id,
+                        "message": f"bench {self.run_id} {time.time_ns()}",
+                    },
+                )
+                sent += 1
+                with self.stats.lock:
+                    self.stats.sent += 1
+                if history_every and sent % history_every == 0:
+                    self.fetch_history()
+            except Exception as e:
+                self.stats.error(type(e).__name__)
+            time.sleep(max(0.0, interval - (time.time() - started)))
+
+    def close(self):
+        self.sio.disconnect()
+
+
+# -------------------------
+# report
+# -------------------------
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def build_report(args, stats: Stats, fanout: list[int], elapsed: float) -> dict:
+    latencies = stats.latencies_ms
+    # every message is fanned out to each member of its room, sender included
+    expected = stats.sent * statistics.fmean(fanout) if fanout else 0
+    return {
+        "config": {
+            "clients": args.clients,
+            "rooms": args.rooms,
+            "rate": args.rate,
+            "duration": args.duration,
+        },
+        "sent": stats.sent,
+        "received": stats.received,
+        "expected_deliveries": int(expected),
+        "delivery_ratio": round(stats.received / expected, 4) if expected else 0,
+        "send_throughput": round(stats.sent / elapsed, 2),
+        "delivery_throughput": round(stats.received / elapsed, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p90": round(percentile(latencies, 90), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies, default=0), 2),
+            "mean": round(statistics.fmean(latencies), 2) if latencies else 0,
+        },
+        "errors": stats.errors,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list[str]:
+    failures = []
+    for pct in ("p50", "p99"):
+        current = report["latency_ms"][pct]
+        previous = baseline["latency_ms"][pct]
+        if previous and current > previous * (1 + threshold):
+            failures.append(f"latency {pct} {current}ms > {previous}ms")
+    for key in ("send_throughput", "delivery_throughput", "delivery_ratio"):
+        if report[key] < baseline[key] * (1 - threshold):
+            failures.append(f"{key} {report[key]} < {baseline[key]}")
+    if sum(report["errors"].values()) > sum(baseline["errors"].values()):
+        failures.append(f"errors {report['errors']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--spawn-local", action="store_true")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--rooms", type=int, default=2)
+    parser.add_argument(
+        "--rate", type=float, default=1.0, help="messages per second per client"
+    )
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument(
+        "--history-every",
+        type=int,
+        default=10,
+        help="fetch_history after every N sends (0 disables)",
+    )
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed relative regression"
+    )
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if args.spawn_local:
+        server, url = spawn_local_server()
+    try:
+        wait_ready(url)
+        run_id = uuid.uuid4().hex[:8]
+        stats = Stats()
+        clients = [BenchClient(url, run_id, i, stats) for i in range(args.clients)]
+        for client in clients:
+            client.login()
+
+        room_ids = [clients[i].create_room() for i in range(args.rooms)]
+        room_sizes = [0] * args.rooms
+        for i, client in enumerate(clients):
+            client.join(room_ids[i % args.rooms])
+            room_sizes[i % args.rooms] += 1
+            client.fetch_history()
+
+        started = time.time()
+        deadline = started + args.duration
+        threads = [
+            threading.Thread(
+                target=client.send_loop,
+                args=(args.rate, deadline, args.history_every),
+            )
+            for client in clients
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # let in-flight fan-out drain before counting
+        time.sleep(2)
+        elapsed = time.time() - started
+
+        # sends are spread evenly over rooms, so weigh room sizes by senders
+        sizes_per_sender = [room_sizes[i % args.rooms] for i in range(args.clients)]
+        report = build_report(args, stats, sizes_per_sender, elapsed)
+        for client in clients:
+            client.close()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(report, json.load(f), args.threshold)
+        if failures:
+            print("REGRESSION: " + "; ".join(failures), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# This work is licensed under the terms of the MIT license
+# bench/message_insert.py
+#
+# Compares the old send_message write path (add + commit + refresh) with
+# lib.helper.insert_message. Runs against in-memory SQLite so it needs no
+# services; the statement counts are what carry over to MySQL.
+#
+#   python -m bench.message_insert -n 2000
+import argparse
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models
+from db import Base
+from lib.helper import insert_message
+
+
+def make_session():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    counter = {"statements": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        counter["statements"] += 1
+
+    session = sessionmaker(bind=engine)
+    db = session()
+    user = models.User(username="bench", password_hash="x")
+    room = models.Room(room_name="bench")
+    db.add_all([user, room])
+    db.commit()
+    ids = (user.user_id, room.room_id)
+    db.close()
+    return session, counter, ids
+
+
+def old_path(db, sender, room_id, message):
+    msg = models.Message(sender=sender, room_id=room_id, message=message)
+    db.add(msg)
+    db.commit()
+    db.refresh(msg)
+    return msg.id, msg.date_created
+
+
+def run(name, write, n):
+    session, counter, (sender, room_id) = make_session()
+    counter["statements"] = 0
+    start = time.perf_counter()
+    for i in range(n):
+        db = session()
+        try:
+            write(db, sender, room_id, f"<p>message {i}</p>")
+        finally:
+            db.close()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<16} statements/msg={counter['statements'] / n:.2f} "
+        f"us/msg={elapsed / n * 1e6:.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=2000)
+    args = parser.parse_args()
+
+    run("add+refresh", old_path, args.n)
+    run("insert_message", insert_message, args.n)
+
+
+if __name__ == "__main__":
+    main()
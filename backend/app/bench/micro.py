@@ -0,0 +1,200 @@
+# This work is licensed under the terms of the MIT license
+# bench/micro.py
+#
+# Micro-benchmarks for each stage of the per-message hot path, measured in
+# isolation over bench/corpus.py:
+#
+#   render/<case>      message.replace + render_message (markdown + bleach)
+#   verify_token       verify_access_token
+#   insert/<case>      insert_message against in-memory SQLite
+#   encode/<case>      Socket.IO packet encoding of the new_message payload
+#
+#   python -m bench.micro                       # compare with the baseline
+#   python -m bench.micro --save                # overwrite the baseline
+#   python -m bench.micro --filter render --threshold 0.15
+#
+# Exits non-zero when any case is slower than baseline * (1 + threshold).
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from socketio import packet
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models
+from bench.corpus import CORPUS
+from db import Base
+from lib.helper import insert_message, render_message
+from lib.jwt_helper import create_access_token, verify_access_token
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "micro.json")
+
+
+# -------------------------
+# cases
+# -------------------------
+def render_case(text: str):
+    def run():
+        render_message(text.replace("```", ""))
+
+    return run
+
+
+def verify_token_case():
+    token = create_access_token("370381782461829120")
+
+    def run():
+        verify_access_token(token)
+
+    return run
+
+
+def insert_case(text: str):
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)
+    db = session()
+    user = models.User(username="bench", password_hash="x")
+    room = models.Room(room_name="bench")
+    db.add_all([user, room])
+    db.commit()
+    sender, room_id = user.user_id, room.room_id
+    html = render_message(text)
+
+    def run():
+        insert_message(db, sender, room_id, html)
+
+    return run
+
+
+def encode_case(text: str):
+    payload = {
+        "room": "370381782461829120",
+        "sender": "bench-user",
+        "sender_id": "370381782461829121",
+        "message_id": 123456789,
+        "message": render_message(text),
+        "timestamp": "2026-01-01T00:00:00.000000+00:00",
+    }
+
+    def run():
+        packet.Packet(packet.EVENT, data=["new_message", payload]).encode()
+
+    return run
+
+
+def build_cases() -> dict:
+    cases = {"verify_token": verify_token_case}
+    for name, text in CORPUS.items():
+        cases[f"render/{name}"] = lambda text=text: render_case(text)
+        cases[f"encode/{name}"] = lambda text=text: encode_case(text)
+    for name in ("plain_short", "max_markdown"):
+        cases[f"insert/{name}"] = lambda text=CORPUS[name]: insert_case(text)
+    return cases
+
+
+# -------------------------
+# runner
+# -------------------------
+def measure(run, min_time: float, repeat: int) -> dict:
+    # calibrate the loop count so one sample takes about min_time
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            run()
+        if time.perf_counter() - started >= min_time:
+            break
+        number *= 2
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            run()
+        samples.append((time.perf_counter() - started) / number * 1e6)
+    return {
+        "median_us": round(statistics.median(samples), 3),
+        "min_us": round(min(samples), 3),
+        "loops": number,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    lines = []
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            lines.append(f"{name:<28} {result['min_us']:>12.2f}us   (new)")
+            continue
+        # min is the least noisy estimate of the true cost on a busy machine
+        ratio = result["min_us"] / previous["min_us"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        lines.append(
+            f"{name:<28} {result['min_us']:>12.2f}us "
+            f"vs {previous['min_us']:>10.2f}us  {ratio:>6.2f}x{flag}"
+        )
+    print("\n".join(lines))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filter", default="", help="only run cases containing this")
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="write the baseline")
+    args = parser.parse_args()
+
+    results = {}
+    for name, factory in build_cases().items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(factory(), args.min_time, args.repeat)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+        print(f"saved {len(results)} cases to {args.baseline}")
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"REGRESSION in {len(regressions)} cases", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
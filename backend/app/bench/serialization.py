@@ -0,0 +1,109 @@
+# This work is licensed under the terms of the MIT license
+# bench/serialization.py
+#
+# Encode time and wire size of the two heaviest payloads, old_messages (100
+# rendered messages) and a list_members response, for each JSON backend and
+# HTTP compression.
+#
+#   python -m bench.serialization
+#   python -m bench.serialization --members 2000 --json out.json
+import argparse
+import json
+from itertools import cycle, islice
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from bench.corpus import CORPUS
+from bench.micro import measure
+from lib.helper import render_message
+from lib.serialization import OrjsonModule, OrjsonProvider, brotli, compress, orjson
+
+
+def old_messages_payload(count: int) -> dict:
+    texts = islice(cycle(CORPUS.values()), count)
+    return {
+        "room": "370381782461829120",
+        "messages": [
+            {
+                "sender": f"user{i % 7}",
+                "sender_id": str(370381782461829121 + i % 7),
+                "message_id": 1000 + i,
+                "message": render_message(text.replace("```", "")),
+                "timestamp": "2026-01-01T00:00:00.000000+00:00",
+            }
+            for i, text in enumerate(texts)
+        ],
+    }
+
+
+def members_payload(count: int) -> list:
+    roles = ["OWNER"] + ["ADMIN"] * 3 + ["MEMBER"] * 96
+    return [
+        {
+            "username": f"member_{i}",
+            "id": str(370381782461829121 + i),
+            "role": roles[i % len(roles)],
+        }
+        for i in range(count)
+    ]
+
+
+def encoders() -> dict:
+    app = Flask(__name__)
+    encoders = {
+        # what Socket.IO uses by default
+        "stdlib": lambda data: json.dumps(data, separators=(",", ":")),
+        "flask": DefaultJSONProvider(app).dumps,
+    }
+    if orjson is not None:
+        encoders["orjson"] = OrjsonModule.dumps
+        encoders["orjson-flask"] = OrjsonProvider(app).dumps
+    return encoders
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="also write the results here")
+    args = parser.parse_args()
+
+    payloads = {
+        "old_messages": old_messages_payload(args.messages),
+        "list_members": members_payload(args.members),
+    }
+    results = {}
+    for payload_name, payload in payloads.items():
+        for encoder_name, encode in encoders().items():
+            timing = measure(lambda: encode(payload), args.min_time, args.repeat)
+            results[f"encode/{payload_name}/{encoder_name}"] = timing
+            print(
+                f"encode/{payload_name}/{encoder_name:<13} {timing['min_us']:>10.1f}us"
+            )
+
+        body = encoders()["stdlib"](payload).encode()
+        encodings = ["gzip"] + (["br"] if brotli is not None else [])
+        sizes = {"identity": len(body)}
+        print(f"bytes/{payload_name}/identity      {len(body):>10}")
+        for encoding in encodings:
+            compressed = compress(body, encoding)
+            timing = measure(lambda: compress(body, encoding), args.min_time, 3)
+            sizes[encoding] = len(compressed)
+            results[f"compress/{payload_name}/{encoding}"] = timing
+            print(
+                f"bytes/{payload_name}/{encoding:<13} {len(compressed):>10}"
+                f"  ({len(compressed) / len(body):.1%}, {timing['min_us']:.1f}us)"
+            )
+        results[f"bytes/{payload_name}"] = sizes
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 # This work is licensed under the terms of the MIT license
+import json
 import os
 
 from dotenv import load_dotenv
@@ -22,6 +23,20 @@ database = os.getenv("MYSQL_DATABASE", "main")
 # -------------------------
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_URL = os.getenv("REDIS_URL", f"redis://{REDIS_HOST}:{REDIS_PORT}/0")
+
+# -------------------------
+# backend config
+# -------------------------
+# STORAGE_BACKEND: "mysql" or "sqlite" (file at SQLITE_PATH)
+# PUBSUB_BACKEND: "redis" or "local" (in-process fakeredis, no Socket.IO
+# message queue, so a single process only)
+# STORAGE_BACKEND=sqlite PUBSUB_BACKEND=local runs without MySQL and Redis
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mysql")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "local.db")
+# full SQLAlchemy URL, overrides STORAGE_BACKEND when set
+DATABASE_URL = os.getenv("DATABASE_URL")
+PUBSUB_BACKEND = os.getenv("PUBSUB_BACKEND", "redis")
 
 # -------------------------
 # jwt config
@@ -60,4 +75,216 @@ ALLOWED_PROTOCOLS = [
 # -------------------------
 # application config
 # -------------------------
+CORS_ORIGINS = os.getenv(
+    "CORS_ORIGINS",
+    "http://localhost:3000,"
+    "http://localhost:5173,"
+    "http://localhost:6767,"
+    "https://crossing-watches-isle-fonts.trycloudflare.com",
+).split(",")
 MAX_MESSAGE_LENGTH = int(os.getenv("MAX_MESSAGE_LENGTH", 1000))
+# empty disables the serialized log file
+LOG_FILE = os.getenv("LOG_FILE", "/log/app.log")
+# seconds between dependency re-checks once the app is ready
+READY_CHECK_INTERVAL = float(os.getenv("READY_CHECK_INTERVAL", 5))
+
+# -------------------------
+# room purge config
+# -------------------------
+ROOM_PURGE_BATCH_SIZE = int(os.getenv("ROOM_PURGE_BATCH_SIZE", 1000))
+# seconds to sleep between batches so a purge never monopolises the database
+ROOM_PURGE_PAUSE = float(os.getenv("ROOM_PURGE_PAUSE", 0.05))
+
+# -------------------------
+# metrics config
+# -------------------------
+# when set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# -------------------------
+# profiling config
+# -------------------------
+# folded stacks (flamegraph.pl / speedscope input) are written here
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# seconds of CPU time between samples
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.001))
+# seconds the Redis toggle is cached per worker
+PROFILE_FLAG_TTL = float(os.getenv("PROFILE_FLAG_TTL", 5))
+# HMAC key for POST /admin/profiling; the endpoint is disabled when unset
+PROFILING_SECRET = os.getenv("PROFILING_SECRET")
+
+# -------------------------
+# logging config
+# -------------------------
+# default level; per-route/event policies below can lower or raise it
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# lines buffered per sink before new ones are dropped (and counted)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", 50 * 1024 * 1024))
+LOG_FILE_BACKUPS = int(os.getenv("LOG_FILE_BACKUPS", 5))
+# JSON object keyed by "<METHOD> <route rule>" or socket event name, e.g.
+# {"send_message": {"level": "DEBUG", "sample": 0.01}}. "sample" is the
+# fraction of requests/events whose lines below WARNING are kept.
+LOG_POLICIES = json.loads(
+    os.getenv(
+        "LOG_POLICIES",
+        '{"GET /ping": {"level": "WARNING"},'
+        ' "GET /ready": {"level": "WARNING"},'
+        ' "GET /metrics": {"level": "WARNING"}}',
+    )
+)
+
+# -------------------------
+# tracing config
+# -------------------------
+# fraction of HTTP requests and socket events traced; 0 disables tracing
+# unless a caller sends a sampled W3C traceparent header
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+# OTLP/JSON lines, one trace per line (rotated like LOG_FILE)
+TRACE_FILE = os.getenv("TRACE_FILE", "traces/spans.jsonl")
+# spans kept per trace, so a runaway loop of queries cannot grow it forever
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 1000))
+
+# -------------------------
+# query instrumentation config
+# -------------------------
+# statements slower than this are logged with their parameter shape
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 100))
+# statements allowed per request/socket event before it is flagged
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", 10))
+# the same statement this many times in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+# raise QueryBudgetExceeded instead of logging (for tests and CI)
+QUERY_STRICT = os.getenv("QUERY_STRICT", "").lower() in ("1", "true", "yes")
+
+# -------------------------
+# list cache config
+# -------------------------
+# seconds a serialized /my-rooms or /members body stays in Redis
+LIST_CACHE_TTL = int(os.getenv("LIST_CACHE_TTL", 300))
+
+# -------------------------
+# user directory config
+# -------------------------
+# user_id -> username cache in front of the users table: entries kept in
+# each process's LRU, seconds one is trusted there before Redis is asked
+# again, and seconds an entry stays in Redis
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_LOCAL_TTL = float(os.getenv("USER_CACHE_LOCAL_TTL", 60))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 24 * 3600))
+
+# -------------------------
+# serialization config
+# -------------------------
+# "auto" uses orjson when it is installed, "orjson" requires it, "stdlib"
+# keeps Flask's and Socket.IO's default json
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+# HTTP bodies at least this large are compressed when the client accepts it
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+# brotli quality 0-11; above ~5 it costs more CPU than it saves bytes here
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 4))
+
+# -------------------------
+# search config
+# -------------------------
+# FTS5 index file; app workers read it, tools.search_indexer writes it, so
+# they must share the file (same host or volume)
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "search/messages.db")
+# messages waiting in search:queue beyond this are dropped; the indexer's
+# primary-key tail indexes them later
+SEARCH_QUEUE_MAX = int(os.getenv("SEARCH_QUEUE_MAX", 100000))
+SEARCH_BATCH_SIZE = int(os.getenv("SEARCH_BATCH_SIZE", 500))
+# seconds the indexer sleeps when both the queue and the tail are empty
+SEARCH_POLL_INTERVAL = float(os.getenv("SEARCH_POLL_INTERVAL", 1.0))
+# the indexer's tail reads from here when set (e.g. a replica), otherwise
+# from the app database
+SEARCH_DATABASE_URL = os.getenv("SEARCH_DATABASE_URL")
+
+# -------------------------
+# export config
+# -------------------------
+# rows per gzip member (the unit of a resumable export)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# rows read per server-side cursor before it is closed and reopened after
+# the last id, so no cursor stays open for a whole slow download
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 50000))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", 6))
+
+# -------------------------
+# retention config
+# -------------------------
+# messages older than this many days are deleted; 0 keeps them forever
+MESSAGE_RETENTION_DAYS = int(os.getenv("MESSAGE_RETENTION_DAYS", 0))
+# per-room overrides as a JSON object {"<room_id>": days}; 0 keeps a room's
+# messages forever even when MESSAGE_RETENTION_DAYS is set
+ROOM_RETENTION_DAYS = {
+    str(room_id): int(days)
+    for room_id, days in json.loads(os.getenv("ROOM_RETENTION_DAYS", "{}")).items()
+}
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 1000))
+# minimum seconds between batches; the purger also rests at least as long
+# as each batch took, so it never holds the database more than half the time
+RETENTION_PAUSE = float(os.getenv("RETENTION_PAUSE", 0.05))
+# MySQL Threads_running above this pauses the purge until the load drops
+RETENTION_MAX_THREADS_RUNNING = int(os.getenv("RETENTION_MAX_THREADS_RUNNING", 32))
+# seconds between runs of python -m tools.retention
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", 3600))
+
+# -------------------------
+# jobs config
+# -------------------------
+# run a job worker inside each app process instead of worker.py; the
+# default with PUBSUB_BACKEND=local, whose fakeredis queue no other process
+# can see
+JOBS_IN_PROCESS = os.getenv(
+    "JOBS_IN_PROCESS", "1" if PUBSUB_BACKEND == "local" else ""
+).lower() in ("1", "true", "yes")
+# attempts after the first before a job is moved to jobs:dead
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", 5))
+# retry n waits JOB_BACKOFF * 2**(n-1) seconds (with jitter), at most
+# JOB_BACKOFF_MAX
+JOB_BACKOFF = float(os.getenv("JOB_BACKOFF", 2.0))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", 300))
+# seconds an idempotency key blocks duplicates of a job
+JOB_IDEMPOTENCY_TTL = int(os.getenv("JOB_IDEMPOTENCY_TTL", 24 * 3600))
+# port worker.py serves /metrics on; 0 disables it
+JOBS_METRICS_PORT = int(os.getenv("JOBS_METRICS_PORT", 9101))
+
+# -------------------------
+# message dedupe config
+# -------------------------
+# seconds a send_message client_id is remembered; a resend within it gets
+# the original ack instead of a second message
+MESSAGE_DEDUPE_TTL = int(os.getenv("MESSAGE_DEDUPE_TTL", 3600))
+
+# -------------------------
+# socket auth config
+# -------------------------
+# seconds a socket may stay connected past its token's expiry before it is
+# disconnected; refresh_auth extends the expiry in place
+SOCKET_AUTH_GRACE = int(os.getenv("SOCKET_AUTH_GRACE", 60))
+# clients are told to refresh a random 30..SOCKET_AUTH_REFRESH_WINDOW
+# seconds before expiry, so sockets opened together do not refresh together
+SOCKET_AUTH_REFRESH_WINDOW = int(os.getenv("SOCKET_AUTH_REFRESH_WINDOW", 180))
+# seconds between sweeps for expired sockets
+SOCKET_AUTH_SWEEP_INTERVAL = float(os.getenv("SOCKET_AUTH_SWEEP_INTERVAL", 15))
+
+# -------------------------
+# reactions config
+# -------------------------
+# the emoji a message can be reacted with, comma separated
+REACTION_EMOJI = [
+    emoji.strip()
+    for emoji in os.getenv("REACTION_EMOJI", "👍,❤️,😂,😮,😢,🎉,🙏,👀").split(",")
+    if emoji.strip()
+]
+# seconds between flushes of Redis reaction state to the database
+REACTION_FLUSH_INTERVAL = float(os.getenv("REACTION_FLUSH_INTERVAL", 2))
+# reaction changes and dirty messages written per flush transaction
+REACTION_FLUSH_BATCH = int(os.getenv("REACTION_FLUSH_BATCH", 1000))
+# seconds a message's reaction keys stay in Redis after its last reaction;
+# must be far longer than a flush takes
+REACTION_KEY_TTL = int(os.getenv("REACTION_KEY_TTL", 7 * 24 * 3600))
+# seconds reaction changes are collected before one update per room is sent
+REACTION_BROADCAST_INTERVAL = float(os.getenv("REACTION_BROADCAST_INTERVAL", 0.25))
@@ -1,31 +1,61 @@
 # This work is licensed under the terms of the MIT license
 # db.py
-import time
-
-from config import database, host, password, port, user
-from sqlalchemy import create_engine
+from config import (
+    DATABASE_URL,
+    SQLITE_PATH,
+    STORAGE_BACKEND,
+    database,
+    host,
+    password,
+    port,
+    user,
+)
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import declarative_base, sessionmaker
 
-engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}")
+
+def get_database_url() -> str:
+    if DATABASE_URL:
+        return DATABASE_URL
+    if STORAGE_BACKEND == "sqlite":
+        return f"sqlite:///{SQLITE_PATH}"
+    if STORAGE_BACKEND == "mysql":
+        return f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
+    raise RuntimeError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+
+def make_engine(url: str):
+    if not url.startswith("sqlite"):
+        return create_engine(url)
+
+    # sessions are shared across greenlets, and WAL lets readers run while a
+    # write is in progress
+    sqlite_engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    @event.listens_for(sqlite_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    return sqlite_engine
+
+
+engine = make_engine(get_database_url())
 Base = declarative_base()
 session_local = sessionmaker(bind=engine)
 
 
-# i hate this function
-# note: just a temporary function for local developtment never actually use in prod
+def ping_db():
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+# creates missing tables; run once per deployment by tools/init_db.py (and
+# by python app.py for local runs), never by every app process
 def init_db():
     import models
 
-    attempts = 0
-    try:
-        Base.metadata.create_all(engine)
-    except Exception as e:
-        while attempts < 50:
-            try:
-                Base.metadata.create_all(engine)
-                break
-            except Exception:
-                attempts += 1
-                time.sleep(1)
-        else:
-            raise e
+    Base.metadata.create_all(engine)
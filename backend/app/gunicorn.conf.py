@@ -0,0 +1,61 @@
+# This work is licensed under the terms of the MIT license
+# gunicorn.conf.py
+#
+#   gunicorn -c gunicorn.conf.py "app:create_app()"
+#
+# The app is imported once in the master (--preload) and forked; importing it
+# does no network I/O, and each worker connects its own dependencies. The
+# master is monkey-patched before anything else is imported, so redis, ssl
+# and threading in the preloaded app are the gevent versions the workers
+# expect. The schema is not created here: run python -m tools.init_db once
+# per deployment.
+#
+# Metrics are kept per process in PROMETHEUS_MULTIPROC_DIR and summed when
+# /metrics is scraped. It has to be set before prometheus_client is imported,
+# which is why it is set here rather than in config.py.
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
+import tempfile
+
+worker_class = "geventwebsocket.gunicorn.workers.GeventWebSocketWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+bind = os.getenv("BIND", "0.0.0.0:5000")
+preload_app = True
+
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "chat-metrics"),
+)
+# must exist before the preloaded app creates its metrics
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def on_starting(server):
+    # samples from a previous run would otherwise be summed into this one
+    for name in os.listdir(metrics_dir):
+        os.remove(os.path.join(metrics_dir, name))
+
+
+def post_fork(server, worker):
+    from db import engine
+
+    # never reuse a pooled connection that might have been opened pre-fork
+    engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    # runs after the gevent worker has monkey-patched, so the lifecycle
+    # thread is a greenlet like everything else in the worker
+    from lib.lifecycle import lifecycle
+
+    lifecycle.start()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # drop the dead worker's livesum gauges (connected sockets, rooms, pool)
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,127 @@
+# -------------------------
+# Bootstrap
+# -------------------------
+# Everything the client needs for its first screen in one response, instead
+# of /my-rooms, join_rooms, fetch_history and /members one after another.
+# The room list and the member page come from the same cached bodies as
+# /my-rooms and /room/<id>/members; the rest is three indexed queries
+# (profile, last message per room, unread counts) plus the history page of
+# the chosen room.
+import html
+
+from sqlalchemy import func, select
+from werkzeug.datastructures import MultiDict
+
+import models
+from lib.helper import (
+    get_username,
+    html_to_text,
+    recent_messages,
+    serialize_message,
+    user_rooms,
+)
+from lib.list_cache import cached_json, room_members_key, user_rooms_key
+from lib.members import list_members_page, page_variant
+from lib.reactions import overlay
+from lib.read_markers import get_markers, init_markers, unread_counts
+from lib.user_directory import users
+
+PREVIEW_LENGTH = 120
+
+
+def preview(message_html: str) -> str:
+    # plain text, still escaped: clients insert it as HTML like messages
+    text = html_to_text(message_html)
+    if len(text) > PREVIEW_LENGTH:
+        text = text[: PREVIEW_LENGTH - 1] + "…"
+    return html.escape(text)
+
+
+def last_messages(db, room_ids: list[str]) -> dict[str, dict]:
+    if not room_ids:
+        return {}
+    latest = (
+        select(func.max(models.Message.id))
+        .where(models.Message.room_id.in_(room_ids))
+        .group_by(models.Message.room_id)
+    )
+    rows = db.execute(
+        select(
+            models.Message.room_id,
+            models.Message.id,
+            models.Message.sender,
+            models.Message.message,
+            models.Message.date_created,
+        ).where(models.Message.id.in_(latest))
+    ).all()
+    names = users.usernames(db, (row.sender for row in rows))
+    result = {}
+    for room_id, message_id, sender_id, message, date_created in rows:
+        if sender_id not in names:
+            continue
+        last = serialize_message(
+            message_id, names[sender_id], sender_id, preview(message), date_created
+        )
+        last["preview"] = last.pop("message")
+        result[room_id] = last
+    return result
+
+
+def build_bootstrap(db, kv, user_id: str, room_id: str | None = None) -> dict | None:
+    # None when the user no longer exists
+    username = get_username(db, user_id)
+    if username is None:
+        return None
+
+    rooms = cached_json(kv, user_rooms_key(user_id), lambda: user_rooms(db, user_id))
+    rooms = rooms["rooms"]
+    room_ids = [room["id"] for room in rooms]
+    last = last_messages(db, room_ids)
+
+    markers = get_markers(kv, user_id)
+    missing = {
+        rid: last[rid]["message_id"] if rid in last else 0
+        for rid in room_ids
+        if rid not in markers
+    }
+    init_markers(kv, user_id, missing)
+    markers = {rid: markers.get(rid, missing.get(rid)) for rid in room_ids}
+    unread = unread_counts(db, user_id, markers)
+
+    rooms = [
+        {
+            **room,
+            "unread": unread.get(room["id"], 0),
+            "last_message": last.get(room["id"]),
+        }
+        for room in rooms
+    ]
+    # most recently active first, rooms without messages last
+    rooms.sort(
+        key=lambda room: (
+            room["last_message"]["message_id"] if room["last_message"] else 0
+        ),
+        reverse=True,
+    )
+
+    selected = None
+    if room_id is not None and room_id in room_ids:
+        members_args = MultiDict()
+        messages = recent_messages(db, room_id)
+        overlay(kv, messages)
+        selected = {
+            "id": room_id,
+            "messages": messages,
+            "members": cached_json(
+                kv,
+                room_members_key(room_id),
+                lambda: list_members_page(db, room_id, members_args),
+                variant=page_variant(members_args),
+            ),
+        }
+
+    return {
+        "user": {"id": user_id, "username": username},
+        "rooms": rooms,
+        "room": selected,
+    }
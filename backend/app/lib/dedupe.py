@@ -0,0 +1,65 @@
+# -------------------------
+# send_message dedupe
+# -------------------------
+# Clients tag each message with their own client_id and resend it, same id,
+# when a socket drops before the ack. The first send claims
+# msg:client:<user_id>:<client_id> (SET NX) for PENDING_TTL seconds; once the
+# row is stored the key holds the server message_id and timestamp for
+# MESSAGE_DEDUPE_TTL, so a resend gets the original ack and is neither
+# inserted nor broadcast again. If Redis fails, the message is sent
+# without dedupe rather than refused.
+import json
+import re
+
+from loguru import logger
+from redis import RedisError
+
+from config import MESSAGE_DEDUPE_TTL
+
+CLIENT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# long enough for one insert; a claim left by a crashed worker expires and
+# the next resend goes through
+PENDING_TTL = 30
+PENDING = "pending"
+
+
+def client_key(user_id: str, client_id: str) -> str:
+    return f"msg:client:{user_id}:{client_id}"
+
+
+def valid_client_id(client_id) -> bool:
+    return isinstance(client_id, str) and bool(CLIENT_ID_PATTERN.match(client_id))
+
+
+def claim(kv, user_id: str, client_id: str) -> dict | None:
+    # None when this send owns the client_id and should go ahead; otherwise
+    # the earlier send: {"pending": True} or {"message_id", "timestamp", ...}
+    key = client_key(user_id, client_id)
+    try:
+        if kv.set(key, PENDING, nx=True, ex=PENDING_TTL):
+            return None
+        stored = kv.get(key)
+    except RedisError as e:
+        logger.warning("Message dedupe unavailable", error=str(e))
+        return None
+    if stored is None:
+        # expired between the two commands; try once more
+        return claim(kv, user_id, client_id)
+    if stored.decode() == PENDING:
+        return {"pending": True}
+    return json.loads(stored)
+
+
+def record(kv, user_id: str, client_id: str, sent: dict):
+    try:
+        kv.set(client_key(user_id, client_id), json.dumps(sent), ex=MESSAGE_DEDUPE_TTL)
+    except RedisError as e:
+        logger.warning("Message dedupe record failed", error=str(e))
+
+
+def release(kv, user_id: str, client_id: str):
+    # the send failed; let the client retry with the same id
+    try:
+        kv.delete(client_key(user_id, client_id))
+    except RedisError as e:
+        logger.warning("Message dedupe release failed", error=str(e))
@@ -0,0 +1,238 @@
+# -------------------------
+# Room and user directory
+# -------------------------
+# Prefix search on room and user names for autocomplete, served from Redis
+# sorted sets instead of a LIKE 'abc%' per keystroke. Every member has score
+# 0, so ZRANGEBYLEX walks them in byte order:
+#
+#   dir:rooms      "<folded name>\0<room_id>\0<room_name>"   public rooms only
+#   dir:users      "<folded name>\0<user_id>\0<username>"
+#   dir:rooms:ids  hash room_id -> its member, to replace it on rename
+#   dir:users:ids  hash user_id -> its member
+#
+# A lookup is O(log N + limit) whatever the table size. Entries are updated
+# by the handlers that create, rename, publish or delete rooms and sign up
+# users; python -m tools.build_directory rebuilds both from the database.
+#
+# Private rooms are not in the index. A room search adds the caller's own
+# rooms, filtered from their cached room list, and leaves out public rooms
+# they are banned from.
+import unicodedata
+
+from loguru import logger
+from redis import RedisError
+from sqlalchemy import select
+
+import models
+from lib.members import InvalidQuery
+from models import MemberRole
+
+ROOMS_KEY = "dir:rooms"
+USERS_KEY = "dir:users"
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+MAX_PREFIX = 64
+# at most this many ZRANGEBYLEX pages per search when results get filtered
+MAX_SCANS = 4
+
+
+def fold(name: str) -> str:
+    # case-, accent- and width-insensitive; NUL separates the parts of a member
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return unicodedata.normalize("NFKC", stripped).replace("\0", "").strip()
+
+
+def _entry(name: str, entity_id: str) -> str:
+    return f"{fold(name)}\0{entity_id}\0{name}"
+
+
+def _parse(member: bytes) -> tuple[str, str]:
+    _, entity_id, name = member.decode().split("\0", 2)
+    return entity_id, name
+
+
+def parse_query(args) -> tuple[str, int]:
+    # (folded prefix, limit) from request.args; raises InvalidQuery
+    prefix = fold(args.get("q") or "")
+    if not prefix:
+        raise InvalidQuery("Missing q")
+    if len(prefix) > MAX_PREFIX:
+        raise InvalidQuery("q too long")
+    try:
+        limit = int(args.get("limit", DEFAULT_LIMIT))
+    except ValueError as e:
+        raise InvalidQuery("Invalid limit") from e
+    if limit < 1:
+        raise InvalidQuery("Invalid limit")
+    return prefix, min(limit, MAX_LIMIT)
+
+
+# -------------------------
+# index updates
+# -------------------------
+def _put(kv, key: str, entity_id: str, name: str):
+    ids_key = f"{key}:ids"
+    old = kv.hget(ids_key, entity_id)
+    new = _entry(name, entity_id)
+    pipe = kv.pipeline()
+    if old is not None:
+        pipe.zrem(key, old)
+    pipe.zadd(key, {new: 0})
+    pipe.hset(ids_key, entity_id, new)
+    pipe.execute()
+
+
+def _remove(kv, key: str, entity_id: str):
+    ids_key = f"{key}:ids"
+    old = kv.hget(ids_key, entity_id)
+    if old is None:
+        return
+    pipe = kv.pipeline()
+    pipe.zrem(key, old)
+    pipe.hdel(ids_key, entity_id)
+    pipe.execute()
+
+
+def index_room(kv, room_id: str, room_name: str, is_public: bool):
+    # after creating or updating a room; a room made private is dropped
+    try:
+        if is_public:
+            _put(kv, ROOMS_KEY, room_id, room_name)
+        else:
+            _remove(kv, ROOMS_KEY, room_id)
+    except RedisError as e:
+        # tools.build_directory repairs what is missed here
+        logger.warning("Room directory update failed", room_id=room_id, error=str(e))
+
+
+def unindex_room(kv, room_id: str):
+    try:
+        _remove(kv, ROOMS_KEY, room_id)
+    except RedisError as e:
+        logger.warning("Room directory update failed", room_id=room_id, error=str(e))
+
+
+def index_user(kv, user_id: str, username: str):
+    try:
+        _put(kv, USERS_KEY, user_id, username)
+    except RedisError as e:
+        logger.warning("User directory update failed", user_id=user_id, error=str(e))
+
+
+# -------------------------
+# searching
+# -------------------------
+def _scan(kv, key: str, prefix: str, limit: int, keep) -> list[tuple[str, str]]:
+    # up to <limit> (id, name) pairs starting with prefix for which keep(ids)
+    # holds; keep gets a page of ids and returns the set to keep
+    low = b"[" + prefix.encode()
+    high = b"(" + prefix.encode() + b"\xff"
+    found = []
+    for _ in range(MAX_SCANS):
+        page = kv.zrangebylex(key, low, high, start=0, num=limit + 1)
+        entries = [_parse(member) for member in page[:limit]]
+        kept = keep([entity_id for entity_id, _ in entries])
+        found.extend(entry for entry in entries if entry[0] in kept)
+        if len(found) >= limit or len(page) <= limit:
+            break
+        # continue after the last member read
+        low = b"(" + page[limit - 1]
+    return found[:limit]
+
+
+def search_rooms(db, kv, user_id: str, my_rooms: list[dict], args) -> dict:
+    # my_rooms: the caller's /my-rooms list, which already leaves out rooms
+    # they are banned from
+    prefix, limit = parse_query(args)
+    mine = [room for room in my_rooms if fold(room["name"]).startswith(prefix)]
+    mine.sort(key=lambda room: fold(room["name"]))
+    results = [
+        {"id": room["id"], "name": room["name"], "member": True}
+        for room in mine[:limit]
+    ]
+    member_of = {room["id"] for room in my_rooms}
+
+    def keep(room_ids):
+        candidates = [room_id for room_id in room_ids if room_id not in member_of]
+        if not candidates:
+            return set()
+        banned = db.scalars(
+            select(models.Room_members.room_id).where(
+                models.Room_members.user_id == user_id,
+                models.Room_members.room_id.in_(candidates),
+                models.Room_members.member_role == MemberRole.BANNED,
+            )
+        ).all()
+        return set(candidates) - set(banned)
+
+    if len(results) < limit:
+        public = _scan(kv, ROOMS_KEY, prefix, limit - len(results), keep)
+        results.extend(
+            {"id": room_id, "name": name, "member": False} for room_id, name in public
+        )
+    return {"rooms": results}
+
+
+def search_users(db, kv, args, room_id: str | None = None) -> dict:
+    # with room_id, each user carries their role in that room (or None)
+    prefix, limit = parse_query(args)
+    users = _scan(kv, USERS_KEY, prefix, limit, set)
+    roles = {}
+    if room_id is not None and users:
+        roles = dict(
+            db.execute(
+                select(
+                    models.Room_members.user_id, models.Room_members.member_role
+                ).where(
+                    models.Room_members.room_id == room_id,
+                    models.Room_members.user_id.in_([uid for uid, _ in users]),
+                )
+            ).all()
+        )
+    results = []
+    for uid, username in users:
+        result = {"id": uid, "username": username}
+        if room_id is not None:
+            role = roles.get(uid)
+            result["role"] = role.name if role else None
+        results.append(result)
+    return {"users": results}
+
+
+# -------------------------
+# rebuild
+# -------------------------
+def rebuild(db, kv, batch_size: int = 5000) -> dict:
+    # fills fresh keys from the database and swaps them in with RENAME, so
+    # searches see either the old index or the new one, never a partial one
+    counts = {}
+    sources = {
+        ROOMS_KEY: select(models.Room.room_id, models.Room.room_name).where(
+            models.Room.is_public.is_(True), models.Room.date_deleted.is_(None)
+        ),
+        USERS_KEY: select(models.User.user_id, models.User.username),
+    }
+    for key, query in sources.items():
+        tmp, ids_tmp = f"{key}:rebuild", f"{key}:ids:rebuild"
+        kv.delete(tmp, ids_tmp)
+        count = 0
+        result = db.execute(query.execution_options(yield_per=batch_size))
+        for batch in result.partitions():
+            entries = {
+                str(entity_id): _entry(name, entity_id) for entity_id, name in batch
+            }
+            pipe = kv.pipeline(transaction=False)
+            pipe.zadd(tmp, {entry: 0 for entry in entries.values()})
+            pipe.hset(ids_tmp, mapping=entries)
+            pipe.execute()
+            count += len(entries)
+        pipe = kv.pipeline()
+        if count:
+            pipe.rename(tmp, key)
+            pipe.rename(ids_tmp, f"{key}:ids")
+        else:
+            pipe.delete(key, f"{key}:ids")
+        pipe.execute()
+        counts[key] = count
+    return counts
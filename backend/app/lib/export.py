@@ -0,0 +1,108 @@
+# -------------------------
+# Room export
+# -------------------------
+# A room's messages as gzip-compressed NDJSON, one JSON object per message
+# (the fetch_history shape) in id order, ending with a {"export_complete": true, ...} line. Shared by
+# GET /room/<id>/export and tools.export_room.
+#
+# Rows are read through a server-side cursor (yield_per) and encoded batch
+# by batch, so memory stays constant whatever the room size. The cursor is
+# reopened after the last id every EXPORT_CHUNK_ROWS rows, and each
+# connection goes back to the pool between chunks.
+#
+# Every batch is its own gzip member. Concatenated members are still one
+# valid .gz file, and a cut-off download can be trimmed back to its last
+# complete member (scan_export) and resumed with after_id.
+import gzip
+import json
+import zlib
+
+from sqlalchemy import select
+
+import models
+from config import EXPORT_BATCH_SIZE, EXPORT_CHUNK_ROWS, EXPORT_GZIP_LEVEL
+from lib.helper import serialize_message
+from lib.serialization import socketio_json
+
+
+def export_batches(
+    session_factory,
+    room_id: str,
+    after_id: int = 0,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    chunk_rows: int = EXPORT_CHUNK_ROWS,
+):
+    # yields uncompressed NDJSON, one batch of lines at a time
+    dumps = socketio_json().dumps
+    last_id = after_id
+    exported = 0
+    while True:
+        db = session_factory()
+        try:
+            result = db.execute(
+                select(
+                    models.Message.id,
+                    models.User.username,
+                    models.Message.sender,
+                    models.Message.message,
+                    models.Message.date_created,
+                )
+                .join(models.User, models.Message.sender == models.User.user_id)
+                .where(models.Message.room_id == room_id, models.Message.id > last_id)
+                .order_by(models.Message.id)
+                .limit(chunk_rows)
+                .execution_options(yield_per=batch_size)
+            )
+            read = 0
+            for batch in result.partitions():
+                read += len(batch)
+                last_id = batch[-1][0]
+                lines = (dumps(serialize_message(*row)) + "\n" for row in batch)
+                yield "".join(lines).encode()
+        finally:
+            db.close()
+        exported += read
+        if read < chunk_rows:
+            break
+
+    trailer = {
+        "export_complete": True,
+        "room": room_id,
+        "after_id": after_id,
+        "last_id": last_id,
+        "messages": exported,
+    }
+    yield (dumps(trailer) + "\n").encode()
+
+
+def gzip_members(batches, level: int = EXPORT_GZIP_LEVEL):
+    for batch in batches:
+        yield gzip.compress(batch, compresslevel=level, mtime=0)
+
+
+def scan_export(f) -> tuple[int, int | None, bool]:
+    # (bytes up to the end of the last complete gzip member, last message id
+    # in those bytes, whether the trailer was reached). Reads one member at a
+    # time, so it also runs in constant memory.
+    offset = position = 0
+    last_id = None
+    complete = False
+    decompressor = zlib.decompressobj(31)
+    lines = b""
+    while chunk := f.read(1 << 16):
+        while chunk:
+            lines += decompressor.decompress(chunk)
+            if not decompressor.eof:
+                position += len(chunk)
+                break
+            position += len(chunk) - len(decompressor.unused_data)
+            offset = position
+            last = json.loads(lines.rstrip(b"\n").rsplit(b"\n", 1)[-1])
+            if last.get("export_complete"):
+                complete = True
+            else:
+                last_id = last["message_id"]
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(31)
+            lines = b""
+    return offset, last_id, complete
@@ -1,17 +1,124 @@
 # -------------------------
 # Helper functions
 # -------------------------
+import html
+import json
+import re
+from datetime import datetime, timezone
+
 from bleach import clean, linkifier, linkify
 from markdown import markdown
+from sqlalchemy import insert, literal, select
 
 import models
 from config import ALLOWED_ATTRIBUTES, ALLOWED_PROTOCOLS, ALLOWED_TAGS
+from lib.tracing import span
+from lib.user_directory import users
+from models import MemberRole
+
+TAG = re.compile(r"<[^>]+>")
+WHITESPACE = re.compile(r"\s+")
 
 
 def get_username(db, user_id: str) -> str | None:
-    return (
-        db.query(models.User.username).filter(models.User.user_id == user_id).scalar()
+    return users.username(db, user_id)
+
+
+def room_member_ids(db, room_id: str) -> list[str]:
+    return db.scalars(
+        select(models.Room_members.user_id).where(
+            models.Room_members.room_id == room_id
+        )
+    ).all()
+
+
+def user_rooms(db, user_id: str) -> dict:
+    # the /my-rooms body: rooms the user is in and not banned from
+    rows = db.execute(
+        select(models.Room.room_id, models.Room.room_name, models.Room.room_description)
+        .join(models.Room_members, models.Room.room_id == models.Room_members.room_id)
+        .where(
+            models.Room_members.user_id == user_id,
+            models.Room_members.member_role != MemberRole.BANNED,
+            models.Room.date_deleted.is_(None),
+        )
+    ).all()
+    return {"rooms": [{"id": r, "name": n, "description": d} for r, n, d in rows]}
+
+
+def serialize_message(message_id, sender, sender_id, message, date_created) -> dict:
+    return {
+        "sender": sender,
+        "sender_id": sender_id,
+        "message_id": message_id,
+        "message": message,
+        "timestamp": date_created.astimezone(timezone.utc).isoformat(),
+    }
+
+
+def with_senders(db, rows) -> list[dict]:
+    # rows of (message_id, sender_id, message, date_created); names come from
+    # the user directory instead of a users join, and messages whose sender
+    # no longer exists are left out, as the join did
+    names = users.usernames(db, (row[1] for row in rows))
+    return [
+        serialize_message(message_id, names[sender_id], sender_id, *rest)
+        for message_id, sender_id, *rest in rows
+        if sender_id in names
+    ]
+
+
+def recent_messages(db, room_id: str, limit: int = 100) -> list[dict]:
+    # the newest page of history, oldest first. Reaction counts come from the
+    # same rows as flushed; lib.reactions.overlay() brings them up to date.
+    rows = db.execute(
+        select(
+            models.Message.id,
+            models.Message.sender,
+            models.Message.message,
+            models.Message.date_created,
+            models.Message.reaction_counts,
+        )
+        .where(models.Message.room_id == room_id)
+        .order_by(models.Message.id.desc())
+        .limit(limit)
+    ).all()
+    rows.reverse()
+    counts = {row[0]: row[4] for row in rows}
+    messages = with_senders(db, [row[:4] for row in rows])
+    for message in messages:
+        raw = counts[message["message_id"]]
+        message["reactions"] = json.loads(raw) if raw else {}
+    return messages
+
+
+def insert_message(
+    db, sender: str, room_id: str, message: str
+) -> tuple[int, datetime] | None:
+    # single INSERT: the id comes back as lastrowid and the timestamp is
+    # generated here, so no refresh SELECT is needed after the commit. It is
+    # an INSERT ... SELECT from the room row, so nothing is written once the
+    # room is tombstoned (None), even by a socket that joined before.
+    date_created = models.utcnow()
+    table = models.Message.__table__
+    result = db.execute(
+        insert(table).from_select(
+            ["room_id", "sender", "message", "date_created", "date_updated"],
+            select(
+                models.Room.room_id,
+                literal(sender, table.c.sender.type),
+                literal(message, table.c.message.type),
+                literal(date_created, table.c.date_created.type),
+                literal(date_created, table.c.date_updated.type),
+            ).where(models.Room.room_id == room_id, models.Room.date_deleted.is_(None)),
+        )
     )
+    if result.rowcount != 1:
+        db.rollback()
+        return None
+    with span("db.commit"):
+        db.commit()
+    return result.lastrowid, date_created
 
 
 def sanitize_message(message: str) -> str:
@@ -41,3 +148,11 @@ def render_message(message: str) -> str:
     html = markdown(message, extensions=["extra"])
     sanitized_html = sanitize_message(html)
     return sanitized_html
+
+
+def html_to_text(message_html: str) -> str:
+    # plain, unescaped text of a render_message() result. The html was
+    # sanitized by bleach, so dropping tags is safe; they become spaces so
+    # "<p>a</p><p>b</p>" stays two words.
+    text = html.unescape(TAG.sub(" ", message_html))
+    return WHITESPACE.sub(" ", text).strip()
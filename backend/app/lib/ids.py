@@ -0,0 +1,183 @@
+# -------------------------
+# ID helpers
+# -------------------------
+# Snowflake-style 64-bit ids: 41 bits of milliseconds since ID_EPOCH_MS,
+# 10 bits of worker id and 12 bits of per-millisecond sequence. Ids sort by
+# creation time, so inserts land at the right edge of the InnoDB clustered
+# index instead of at random pages like cuid2 strings did.
+#
+# Two processes must never share a worker id, or they hand out the same ids
+# in the same millisecond. Each process leases one from Redis
+# (ids:worker:<n>, LEASE_TTL seconds, renewed as ids are generated); forked
+# gunicorn workers and container replicas each get their own. Worker id
+# MIGRATION_WORKER_ID is never leased: tools/migrate_compact_ids.py uses it.
+#
+# The database stores BIGINT; the app and the public API keep seeing strings.
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import BigInteger
+from sqlalchemy.types import TypeDecorator
+
+from lib.kv import create_kv
+
+ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+MAX_ID = (1 << 63) - 1
+# reserved for the id migration; leases hand out 0..MAX_WORKER_ID - 1
+MIGRATION_WORKER_ID = MAX_WORKER_ID
+
+LEASE_COUNTER_KEY = "ids:worker:next"
+LEASE_TTL = 60
+# an unused lease is checked and extended after this many seconds, and
+# replaced by a new one after LEASE_STALE, well before it could expire
+LEASE_RENEW = LEASE_TTL / 3
+LEASE_STALE = LEASE_TTL / 2
+
+
+def _now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def compose_id(timestamp_ms: int, worker_id: int, sequence: int) -> int:
+    if timestamp_ms < ID_EPOCH_MS:
+        # a negative id binds as NULL (see CompactId) and is never found again
+        raise ValueError("Timestamp before ID_EPOCH_MS")
+    return (
+        ((timestamp_ms - ID_EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS))
+        | (worker_id << SEQUENCE_BITS)
+        | sequence
+    )
+
+
+def id_timestamp_ms(value: int | str) -> int:
+    return (int(value) >> (WORKER_BITS + SEQUENCE_BITS)) + ID_EPOCH_MS
+
+
+class WorkerLease:
+    # this process's worker id, leased from Redis. A fork leases its own.
+    def __init__(self, kv):
+        self.kv = kv
+        self._pid = None
+        self._worker_id = None
+        self._token = None
+        self._renewed = 0.0
+        self._lock = threading.Lock()
+
+    def _key(self) -> str:
+        return f"ids:worker:{self._worker_id}"
+
+    def _acquire(self):
+        self._token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        for _ in range(MAX_WORKER_ID):
+            worker_id = self.kv.incr(LEASE_COUNTER_KEY) % MAX_WORKER_ID
+            if self.kv.set(
+                f"ids:worker:{worker_id}", self._token, nx=True, ex=LEASE_TTL
+            ):
+                self._worker_id = worker_id
+                self._pid = os.getpid()
+                self._renewed = time.monotonic()
+                return
+        raise RuntimeError("No free id worker slot")
+
+    def _renew(self):
+        # still ours: extend it. Lost (expired and taken): lease another.
+        if self.kv.get(self._key()) == self._token.encode():
+            self.kv.expire(self._key(), LEASE_TTL)
+            self._renewed = time.monotonic()
+        else:
+            self._acquire()
+
+    def get(self) -> int:
+        with self._lock:
+            idle = time.monotonic() - self._renewed
+            if self._pid != os.getpid() or idle > LEASE_STALE:
+                self._acquire()
+            elif idle > LEASE_RENEW:
+                self._renew()
+            return self._worker_id
+
+
+class SnowflakeGenerator:
+    def __init__(self, worker_id: int | None = None, lease: WorkerLease | None = None):
+        # a fixed worker_id (tools) or a lease (app processes)
+        self._worker_id = worker_id
+        self._lease = lease
+        self._pid = None
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @property
+    def worker_id(self) -> int:
+        if self._worker_id is not None:
+            return self._worker_id & MAX_WORKER_ID
+        return self._lease.get()
+
+    def next_for(self, timestamp_ms: int) -> int:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._last_ms = -1
+            if timestamp_ms <= self._last_ms:
+                # same millisecond or the clock went backwards: stay monotonic
+                timestamp_ms = self._last_ms
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # sequence exhausted, borrow the next millisecond
+                    timestamp_ms += 1
+            else:
+                self._sequence = 0
+            self._last_ms = timestamp_ms
+            return compose_id(timestamp_ms, self.worker_id, self._sequence)
+
+    def generate(self) -> int:
+        return self.next_for(_now_ms())
+
+    def generate_at(self, dt: datetime | None) -> int:
+        # for rows that already have a creation time. Naive datetimes are UTC,
+        # as stored by the app; rows older than ID_EPOCH_MS or without a time
+        # all start at the epoch, ordered by the sequence.
+        if dt is None:
+            return self.next_for(ID_EPOCH_MS)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return self.next_for(max(int(dt.timestamp() * 1000), ID_EPOCH_MS))
+
+
+_generator = SnowflakeGenerator(lease=WorkerLease(create_kv()))
+
+
+def new_id() -> str:
+    return str(_generator.generate())
+
+
+class CompactId(TypeDecorator):
+    """BIGINT column that the application reads and writes as a decimal string."""
+
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, int):
+            return value
+        value = str(value)
+        # ids come straight from URLs and socket payloads; anything that is
+        # not a valid id binds as NULL and simply matches no rows
+        if not (value.isascii() and value.isdigit()) or int(value) > MAX_ID:
+            return None
+        return int(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return str(value)
@@ -0,0 +1,290 @@
+# -------------------------
+# Background jobs
+# -------------------------
+# Deferred and periodic work that should not run on a gevent web worker.
+# Handlers enqueue a job by name; worker.py (or, with JOBS_IN_PROCESS, a
+# thread in each app process) runs it. Everything lives in Redis:
+#
+#   jobs:queue:<queue>          ready jobs (LPUSH in, LMOVE out)
+#   jobs:processing:<worker>    jobs a worker has taken, put back if it dies
+#   jobs:delayed                zset of delayed jobs and retries, by due time
+#   jobs:dead                   jobs that ran out of retries (capped)
+#   jobs:idem:<key>             idempotency keys (SET NX EX)
+#   jobs:periodic:<name>        one enqueue per interval across all workers
+#   jobs:worker:<worker>        heartbeat
+#
+# A job is JSON: {"id", "name", "args", "queue", "attempts", "enqueued_at",
+# "idempotency_key"}. Tasks are plain functions registered with @task and
+# take the args as keyword arguments; a task that raises is retried with
+# exponential backoff.
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+from loguru import logger
+
+from config import (
+    JOB_BACKOFF,
+    JOB_BACKOFF_MAX,
+    JOB_IDEMPOTENCY_TTL,
+    JOB_MAX_RETRIES,
+)
+from lib.ids import new_id
+from lib.metrics import JOB_DURATION, JOBS_PROCESSED, JOBS_QUEUED
+
+DELAYED_KEY = "jobs:delayed"
+DEAD_KEY = "jobs:dead"
+DEAD_MAX = 1000
+HEARTBEAT_TTL = 30
+# how often a worker moves due jobs, enqueues periodic jobs, looks for dead
+# workers and refreshes the queue depth gauges
+TICK = 1.0
+
+TASKS = {}
+PERIODIC = {}
+
+
+def queue_key(queue: str) -> str:
+    return f"jobs:queue:{queue}"
+
+
+def processing_key(worker: str) -> str:
+    return f"jobs:processing:{worker}"
+
+
+# -------------------------
+# registry
+# -------------------------
+class Task:
+    def __init__(self, name, func, queue, retries, backoff):
+        self.name = name
+        self.func = func
+        self.queue = queue
+        self.retries = retries
+        self.backoff = backoff
+
+    def retry_delay(self, attempts: int) -> float:
+        delay = min(self.backoff * 2 ** (attempts - 1), JOB_BACKOFF_MAX)
+        # jitter, so jobs that failed together do not retry together
+        return delay * random.uniform(0.5, 1.0)
+
+
+def task(
+    name: str,
+    queue: str = "default",
+    retries: int = JOB_MAX_RETRIES,
+    backoff: float = JOB_BACKOFF,
+):
+    def decorator(func):
+        TASKS[name] = Task(name, func, queue, retries, backoff)
+        return func
+
+    return decorator
+
+
+def periodic(name: str, interval: float, args: dict | None = None):
+    # enqueue the task <name> every <interval> seconds on whichever worker
+    # serving its queue gets there first
+    PERIODIC[name] = (interval, args or {})
+
+
+# -------------------------
+# producing
+# -------------------------
+def enqueue(
+    kv,
+    name: str,
+    args: dict | None = None,
+    delay: float = 0,
+    idempotency_key: str | None = None,
+    queue: str = "default",
+) -> str | None:
+    # the job id, or None when the idempotency key was already used
+    if idempotency_key and not kv.set(
+        f"jobs:idem:{idempotency_key}", "1", nx=True, ex=JOB_IDEMPOTENCY_TTL
+    ):
+        logger.info("Duplicate job skipped", job=name, key=idempotency_key)
+        return None
+    job = {
+        "id": new_id(),
+        "name": name,
+        "args": args or {},
+        "queue": queue,
+        "attempts": 0,
+        "enqueued_at": time.time(),
+        "idempotency_key": idempotency_key,
+    }
+    raw = json.dumps(job)
+    if delay > 0:
+        kv.zadd(DELAYED_KEY, {raw: time.time() + delay})
+    else:
+        kv.lpush(queue_key(queue), raw)
+    return job["id"]
+
+
+def release(kv, idempotency_key: str):
+    # lets the key be enqueued again before JOB_IDEMPOTENCY_TTL runs out
+    kv.delete(f"jobs:idem:{idempotency_key}")
+
+
+# -------------------------
+# consuming
+# -------------------------
+class Worker:
+    def __init__(
+        self,
+        kv,
+        queues: list[str] | None = None,
+        name: str | None = None,
+        blocking: bool = True,
+    ):
+        self.kv = kv
+        self.queues = queues or ["default"]
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        # fakeredis blocks the whole process on BLMOVE; poll it instead
+        self.blocking = blocking
+        self.last_tick = 0.0
+        self.stopped = False
+
+    # -- scheduling --------------------------------------------------------
+    def move_due(self, now: float) -> int:
+        moved = 0
+        for raw in self.kv.zrangebyscore(DELAYED_KEY, 0, now, start=0, num=100):
+            # only the worker whose ZREM wins moves the job
+            if self.kv.zrem(DELAYED_KEY, raw):
+                job = json.loads(raw)
+                self.kv.lpush(queue_key(job["queue"]), raw)
+                moved += 1
+        return moved
+
+    def enqueue_periodic(self):
+        for name, (interval, args) in PERIODIC.items():
+            # only workers that consume a task's queue schedule it, so a queue
+            # nobody serves does not fill up
+            if TASKS[name].queue not in self.queues:
+                continue
+            if self.kv.set(
+                f"jobs:periodic:{name}", "1", nx=True, px=int(interval * 1000)
+            ):
+                # at most one run waiting at a time, so a run that takes longer
+                # than the interval does not pile up more behind it
+                enqueue(
+                    self.kv,
+                    name,
+                    args,
+                    idempotency_key=f"periodic:{name}",
+                    queue=TASKS[name].queue,
+                )
+
+    def requeue(self, worker: str):
+        key = processing_key(worker)
+        while raw := self.kv.rpop(key):
+            job = json.loads(raw)
+            logger.warning("Requeued orphaned job", job=job["name"], worker=worker)
+            self.kv.lpush(queue_key(job["queue"]), raw)
+
+    def recover_orphans(self):
+        # jobs held by workers whose heartbeat expired go back to their queue
+        for key in self.kv.scan_iter(match=processing_key("*"), count=100):
+            worker = key.decode().split(":", 2)[2]
+            if worker != self.name and not self.kv.exists(f"jobs:worker:{worker}"):
+                self.requeue(worker)
+
+    def observe_depth(self):
+        for queue in self.queues:
+            JOBS_QUEUED.labels(queue, "ready").set(self.kv.llen(queue_key(queue)))
+        JOBS_QUEUED.labels("*", "delayed").set(self.kv.zcard(DELAYED_KEY))
+        JOBS_QUEUED.labels("*", "dead").set(self.kv.llen(DEAD_KEY))
+
+    def tick(self):
+        now = time.time()
+        if now - self.last_tick < TICK:
+            return
+        self.last_tick = now
+        self.move_due(now)
+        self.enqueue_periodic()
+        self.recover_orphans()
+        self.observe_depth()
+
+    # -- running -----------------------------------------------------------
+    def fetch(self) -> bytes | None:
+        processing = processing_key(self.name)
+        for queue in self.queues:
+            raw = self.kv.lmove(queue_key(queue), processing, "RIGHT", "LEFT")
+            if raw is not None:
+                return raw
+        if self.blocking:
+            return self.kv.blmove(
+                queue_key(self.queues[0]), processing, TICK, "RIGHT", "LEFT"
+            )
+        time.sleep(0.1)
+        return None
+
+    def run_job(self, raw: bytes):
+        job = json.loads(raw)
+        task = TASKS.get(job["name"])
+        log = logger.bind(job=job["name"], job_id=job["id"], attempt=job["attempts"])
+        try:
+            if task is None:
+                raise LookupError(f"Unknown job: {job['name']}")
+            started = time.perf_counter()
+            try:
+                task.func(**job["args"])
+            finally:
+                JOB_DURATION.labels(job["name"]).observe(time.perf_counter() - started)
+            JOBS_PROCESSED.labels(job["name"], "success").inc()
+            if job.get("idempotency_key") == f"periodic:{job['name']}":
+                self.kv.delete(f"jobs:idem:{job['idempotency_key']}")
+        except Exception as e:
+            job["attempts"] += 1
+            job["error"] = str(e)
+            if task is not None and job["attempts"] <= task.retries:
+                delay = task.retry_delay(job["attempts"])
+                log.warning("Job failed, retrying", error=str(e), delay=round(delay, 2))
+                self.kv.zadd(DELAYED_KEY, {json.dumps(job): time.time() + delay})
+                JOBS_PROCESSED.labels(job["name"], "retry").inc()
+            else:
+                log.error("Job failed for good", error=str(e))
+                pipe = self.kv.pipeline()
+                pipe.lpush(DEAD_KEY, json.dumps(job))
+                pipe.ltrim(DEAD_KEY, 0, DEAD_MAX - 1)
+                # a dead job may be submitted again (and a periodic one
+                # scheduled again)
+                if job.get("idempotency_key"):
+                    pipe.delete(f"jobs:idem:{job['idempotency_key']}")
+                pipe.execute()
+                JOBS_PROCESSED.labels(job["name"], "dead").inc()
+        finally:
+            self.kv.lrem(processing_key(self.name), 1, raw)
+
+    def heartbeat(self):
+        # its own thread, so a job that runs for an hour is not mistaken for
+        # a dead worker and requeued
+        while not self.stopped:
+            try:
+                self.kv.set(f"jobs:worker:{self.name}", "1", ex=HEARTBEAT_TTL)
+            except Exception as e:
+                logger.warning("Job worker heartbeat failed", error=str(e))
+            time.sleep(HEARTBEAT_TTL / 3)
+
+    def run(self):
+        logger.info("Job worker started", worker=self.name, queues=self.queues)
+        threading.Thread(
+            target=self.heartbeat, name="jobs-heartbeat", daemon=True
+        ).start()
+        # anything left from a previous run under the same name
+        self.requeue(self.name)
+        while not self.stopped:
+            try:
+                self.tick()
+                raw = self.fetch()
+                if raw is not None:
+                    self.run_job(raw)
+            except Exception as e:
+                # Redis down: keep trying rather than exiting
+                logger.error("Job worker error", error=str(e))
+                time.sleep(TICK)
+        self.kv.delete(f"jobs:worker:{self.name}")
@@ -0,0 +1,105 @@
+# -------------------------
+# Key-value / pub-sub backend
+# -------------------------
+# Everything that talks to Redis goes through create_kv() so the backend can
+# be swapped by config. PUBSUB_BACKEND=local uses an in-process fakeredis
+# server, which is enough for one process (local runs, tests, benchmarks).
+import time
+
+import redis
+from loguru import logger
+
+from config import PUBSUB_BACKEND, REDIS_URL
+
+_local_server = None
+_command_hooks = []
+
+
+# -------------------------
+# command hooks
+# -------------------------
+# hook(command, seconds) runs after every command sent by a create_kv()
+# client; a pipeline is reported once, as PIPELINE. Used by lib.metrics.
+def add_command_hook(hook):
+    _command_hooks.append(hook)
+
+
+def _run_hooks(command, started: float):
+    elapsed = time.perf_counter() - started
+    if isinstance(command, bytes):
+        command = command.decode()
+    command = str(command).upper()
+    for hook in _command_hooks:
+        hook(command, elapsed)
+
+
+class HookedMixin:
+    def execute_command(self, *args, **options):
+        if not _command_hooks:
+            return super().execute_command(*args, **options)
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            _run_hooks(args[0], started)
+
+    def pipeline(self, *args, **kwargs):
+        pipe = super().pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def timed_execute(*a, **kw):
+            started = time.perf_counter()
+            try:
+                return execute(*a, **kw)
+            finally:
+                _run_hooks("PIPELINE", started)
+
+        pipe.execute = timed_execute
+        return pipe
+
+
+class HookedRedis(HookedMixin, redis.Redis):
+    pass
+
+
+def create_kv() -> redis.Redis:
+    global _local_server
+
+    if PUBSUB_BACKEND == "redis":
+        return HookedRedis.from_url(REDIS_URL)
+    if PUBSUB_BACKEND == "local":
+        try:
+            import fakeredis
+        except ImportError as e:
+            raise RuntimeError(
+                "PUBSUB_BACKEND=local needs fakeredis (pip install fakeredis)"
+            ) from e
+        # clients created in the same process share one fake server
+        if _local_server is None:
+            _local_server = fakeredis.FakeServer()
+
+        class HookedFakeRedis(HookedMixin, fakeredis.FakeRedis):
+            pass
+
+        return HookedFakeRedis(server=_local_server)
+    raise RuntimeError(f"Unknown PUBSUB_BACKEND: {PUBSUB_BACKEND}")
+
+
+def connect_kv(attempts: int = 50, delay: float = 1.0) -> redis.Redis:
+    client = create_kv()
+    for _ in range(attempts):
+        try:
+            client.ping()
+            return client
+        except redis.ConnectionError:
+            logger.warning("Waiting for Redis...")
+            time.sleep(delay)
+    raise RuntimeError("Cannot connect to Redis")
+
+
+def message_queue_url() -> str | None:
+    # the local backend has no cross-process queue; Socket.IO then keeps its
+    # rooms in memory
+    if PUBSUB_BACKEND == "local":
+        return None
+    return REDIS_URL
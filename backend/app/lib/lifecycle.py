@@ -0,0 +1,102 @@
+# -------------------------
+# Application lifecycle
+# -------------------------
+# Nothing here touches the network at import time. Dependencies are
+# registered up front and connected by a background thread once per process
+# (after gunicorn forks the worker), so startup never blocks on MySQL or
+# Redis and /ready can report what is still missing.
+import os
+import threading
+import time
+
+from loguru import logger
+
+from config import READY_CHECK_INTERVAL
+
+
+class Dependency:
+    def __init__(self, name: str, check, setup=None):
+        self.name = name
+        self.check = check
+        # optional one-time work (e.g. create_all) done before the first check
+        self.setup = setup
+        self.state = "pending"
+        self.error = None
+        self.attempts = 0
+        self.since = time.time()
+
+    def _set(self, state: str, error: str | None = None):
+        if state != self.state:
+            self.since = time.time()
+        self.state = state
+        self.error = error
+
+    def probe(self):
+        self.attempts += 1
+        try:
+            if self.setup:
+                self.setup()
+                self.setup = None
+            self.check()
+        except Exception as e:
+            if self.state != "failed":
+                logger.warning("Dependency unavailable", name=self.name, error=str(e))
+            self._set("failed", str(e))
+            return False
+        if self.state != "ready":
+            logger.info("Dependency ready", name=self.name, attempts=self.attempts)
+        self._set("ready")
+        return True
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "attempts": self.attempts,
+            "since": self.since,
+        }
+
+
+class Lifecycle:
+    def __init__(self):
+        self.dependencies: dict[str, Dependency] = {}
+        self.background: dict[str, object] = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def register(self, name: str, check, setup=None):
+        self.dependencies[name] = Dependency(name, check, setup)
+
+    def run_in_background(self, name: str, target):
+        # started with the dependency thread, once per process
+        self.background[name] = target
+
+    def start(self):
+        # idempotent per process: a preloaded master never starts, each forked
+        # worker starts exactly once
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="lifecycle", daemon=True).start()
+            for name, target in self.background.items():
+                threading.Thread(target=target, name=name, daemon=True).start()
+
+    def _run(self):
+        while True:
+            for dependency in self.dependencies.values():
+                dependency.probe()
+            # retry quickly until everything is up, then only re-check
+            delay = 1 if not self.ready() else READY_CHECK_INTERVAL
+            time.sleep(delay)
+
+    def ready(self) -> bool:
+        return all(d.state == "ready" for d in self.dependencies.values())
+
+    def status(self) -> dict:
+        return {name: d.status() for name, d in self.dependencies.items()}
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,126 @@
+# -------------------------
+# Versioned list cache
+# -------------------------
+# /my-rooms and /room/<id>/members are served with an ETag taken from a
+# version kept in Redis: ver:user_rooms:<user_id> and
+# ver:room_members:<room_id>. Handlers that change either list call the
+# bump_* helpers after their commit. A version is a fresh snowflake id
+# rather than a counter, so a flushed Redis can never hand out an ETag that
+# a client already holds for different data.
+#
+# The serialized body of the current version is cached next to it for
+# LIST_CACHE_TTL, so an unchanged list is neither queried nor re-encoded,
+# and an If-None-Match hit is a 304 with no body at all. The version is read
+# before the database, so a write racing with a read can only attach newer
+# data to an older version, never the reverse. Redis errors fall back to
+# serving straight from the database.
+from flask import Response, current_app, request
+from loguru import logger
+from redis import RedisError
+
+from config import LIST_CACHE_TTL
+from lib.ids import new_id
+
+VERSION_TTL = 7 * 24 * 3600
+
+
+def user_rooms_key(user_id: str) -> str:
+    return f"ver:user_rooms:{user_id}"
+
+
+def room_members_key(room_id: str) -> str:
+    return f"ver:room_members:{room_id}"
+
+
+def _bump(kv, keys: list[str]):
+    if not keys:
+        return
+    try:
+        pipe = kv.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(key, new_id(), ex=VERSION_TTL)
+        pipe.execute()
+    except RedisError as e:
+        # the cached bodies expire on their own after LIST_CACHE_TTL
+        logger.warning("Failed to bump list versions", keys=keys, error=str(e))
+
+
+def bump_user_rooms(kv, *user_ids: str):
+    _bump(kv, [user_rooms_key(user_id) for user_id in user_ids])
+
+
+def bump_room_members(kv, *room_ids: str):
+    _bump(kv, [room_members_key(room_id) for room_id in room_ids])
+
+
+def get_version(kv, key: str) -> str | None:
+    try:
+        version = kv.get(key)
+        if version is None:
+            kv.set(key, new_id(), nx=True, ex=VERSION_TTL)
+            version = kv.get(key)
+    except RedisError as e:
+        logger.warning("List version unavailable", key=key, error=str(e))
+        return None
+    return version.decode() if version else None
+
+
+def _body_key(key: str, version: str, variant: str) -> str:
+    body_key = f"{key}:body:{version}"
+    return f"{body_key}:{variant}" if variant else body_key
+
+
+def cached_json(kv, key: str, build, variant: str = ""):
+    # the data behind conditional_json, for callers that embed a list in a
+    # larger response (/bootstrap); reads and fills the same cached body
+    version = get_version(kv, key)
+    if version is None:
+        return build()
+    body_key = _body_key(key, version, variant)
+    try:
+        body = kv.get(body_key)
+    except RedisError:
+        body = None
+    if body is not None:
+        return current_app.json.loads(body)
+
+    data = build()
+    try:
+        kv.set(body_key, current_app.json.dumps(data), ex=LIST_CACHE_TTL)
+    except RedisError as e:
+        logger.warning("Failed to cache list body", key=key, error=str(e))
+    return data
+
+
+def conditional_json(kv, key: str, build, variant: str = "") -> Response:
+    # build() returns the JSON-serializable list body; it only runs when the
+    # client's copy is stale and the cached body is missing. variant tells
+    # apart different views of the same list (a page, a filter, a count);
+    # they share the version, so one bump invalidates all of them.
+    version = get_version(kv, key)
+    if version is None:
+        return current_app.json.response(build())
+
+    # weak comparison: compressed responses carry a weak tag
+    if request.if_none_match.contains_weak(version):
+        response = Response(status=304)
+    else:
+        body_key = _body_key(key, version, variant)
+        try:
+            body = kv.get(body_key)
+        except RedisError:
+            body = None
+        if body is None:
+            response = current_app.json.response(build())
+            try:
+                kv.set(body_key, response.get_data(), ex=LIST_CACHE_TTL)
+            except RedisError as e:
+                logger.warning("Failed to cache list body", key=key, error=str(e))
+        else:
+            response = Response(body, mimetype="application/json")
+
+    response.set_etag(version)
+    # the same URL is a different list for every user; always revalidate
+    response.headers["Vary"] = "Authorization"
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
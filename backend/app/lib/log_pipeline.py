@@ -0,0 +1,183 @@
+# -------------------------
+# Logging pipeline
+# -------------------------
+# Loguru formats each record on the calling greenlet, then hands the line to
+# an AsyncSink: a bounded buffer drained by a real OS thread that does the
+# writes, so request handlers never wait on stderr or the log file. When the
+# buffer is full new lines are dropped and counted instead of blocking.
+#
+# Which lines are kept is decided by policies keyed by the "route" (HTTP,
+# "<METHOD> <rule>") or "event" (Socket.IO) bound in the record's extra:
+# a minimum level, and a sample fraction for lines below WARNING. Sampling
+# hashes the request id (the sid for sockets), so a request keeps all of its
+# lines or none.
+import atexit
+import os
+import sys
+import zlib
+from collections import deque
+from functools import wraps
+
+from gevent import monkey
+from loguru import logger
+
+from lib.metrics import LOG_LINES_DROPPED
+
+# the writer must be a real thread even after gevent has patched threading
+_start_thread = monkey.get_original("_thread", "start_new_thread")
+_allocate_lock = monkey.get_original("_thread", "allocate_lock")
+_sleep = monkey.get_original("time", "sleep")
+
+FLUSH_INTERVAL = 0.05
+BATCH_SIZE = 512
+ALWAYS_KEPT = logger.level("WARNING").no
+
+
+# -------------------------
+# writers
+# -------------------------
+class StreamWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text: str):
+        self.stream.write(text)
+        self.stream.flush()
+
+
+class RotatingFileWriter:
+    # path -> path.1 -> ... -> path.<backups>, oldest discarded
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = None
+        self.size = 0
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+
+    def _rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def write(self, text: str):
+        # opened on first write, i.e. in the worker, not the preloading master
+        if self.file is None:
+            self._open()
+        if self.size and self.size + len(text) > self.max_bytes:
+            self._rotate()
+        self.file.write(text)
+        self.file.flush()
+        self.size += len(text)
+
+
+# -------------------------
+# sink
+# -------------------------
+class AsyncSink:
+    def __init__(self, name: str, writer, max_queue: int):
+        self.name = name
+        self.writer = writer
+        self.max_queue = max_queue
+        self.buffer = deque()
+        self.dropped = 0
+        self._lock = _allocate_lock()
+        self._running = False
+        # a forked worker inherits the buffer but not the thread
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.drain)
+
+    def _after_fork(self):
+        self.buffer.clear()
+        self._lock = _allocate_lock()
+        self._running = False
+
+    def __call__(self, message):
+        if not self._running:
+            self._running = True
+            _start_thread(self._run, ())
+        # deque appends are atomic; the length check may overshoot by a few
+        # lines under contention, which is fine for a soft bound
+        if len(self.buffer) >= self.max_queue:
+            self.dropped += 1
+            LOG_LINES_DROPPED.labels(self.name).inc()
+            return
+        self.buffer.append(str(message))
+
+    def _run(self):
+        while True:
+            if not self.drain():
+                _sleep(FLUSH_INTERVAL)
+
+    def drain(self) -> int:
+        written = 0
+        with self._lock:
+            while self.buffer:
+                batch = []
+                while self.buffer and len(batch) < BATCH_SIZE:
+                    batch.append(self.buffer.popleft())
+                try:
+                    self.writer.write("".join(batch))
+                except Exception as e:
+                    # never let a full disk kill the writer thread
+                    sys.__stderr__.write(f"log sink {self.name} failed: {e}\n")
+                written += len(batch)
+        return written
+
+
+# -------------------------
+# policies
+# -------------------------
+class LogPolicies:
+    def __init__(self, default_level: str, policies: dict):
+        self.default_level = logger.level(default_level).no
+        self.policies = {
+            key: (
+                logger.level(policy.get("level", default_level)).no,
+                float(policy.get("sample", 1.0)),
+            )
+            for key, policy in policies.items()
+        }
+
+    @property
+    def min_level(self) -> int:
+        # handlers must let through the lowest level any policy asks for
+        return min([self.default_level, *(p[0] for p in self.policies.values())])
+
+    def __call__(self, record) -> bool:
+        extra = record["extra"]
+        key = extra.get("route") or extra.get("event")
+        level, sample = self.policies.get(key, (self.default_level, 1.0))
+        levelno = record["level"].no
+        if levelno < level:
+            return False
+        if sample >= 1.0 or levelno >= ALWAYS_KEPT:
+            return True
+        request_id = str(extra.get("request_id", ""))
+        return zlib.crc32(request_id.encode()) % 10000 < sample * 10000
+
+
+def log_event(event: str):
+    # wraps a Socket.IO handler so its lines carry the event for LogPolicies
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            with logger.contextualize(event=event):
+                return handler(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
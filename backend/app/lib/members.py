@@ -0,0 +1,204 @@
+# -------------------------
+# Member listing
+# -------------------------
+# Keyset pagination over a room's members. Without a search the list is
+# ordered by role segment (owners, admins, then members) and by user_id
+# inside each segment. Each segment is an index-only range scan of
+# ix_room_members_room_role_user, so a page never scans the rows before it;
+# usernames come from the user directory, not a users join.
+# With a username prefix (q) the list is ordered by username instead and
+# driven by the unique username index. Banned members are only listed when
+# asked for explicitly (role=banned), after everyone else.
+#
+# Cursors are opaque to clients: urlsafe base64 of a small JSON array,
+# ["r", role, user_id] or ["u", username].
+import base64
+import binascii
+import hashlib
+import json
+
+from sqlalchemy import func, select
+
+import models
+from lib.user_directory import users
+from models import MemberRole
+
+ROLE_ORDER = [MemberRole.OWNER, MemberRole.ADMIN, MemberRole.MEMBER, MemberRole.BANNED]
+DEFAULT_ROLES = ROLE_ORDER[:3]
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# the query parameters that ask for a page; any other (a cache buster, a
+# tracking parameter) leaves the whole list
+PAGE_PARAMS = ("limit", "cursor", "role", "q")
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidQuery("Invalid cursor") from e
+    if not isinstance(values, list) or not values:
+        raise InvalidQuery("Invalid cursor")
+    return values
+
+
+def parse_roles(value: str | None) -> list[MemberRole]:
+    # "owner,admin" or names ("OWNER"); order is always owners first
+    if not value:
+        return DEFAULT_ROLES
+    wanted = set()
+    for part in value.split(","):
+        part = part.strip()
+        role = MemberRole.__members__.get(part.upper())
+        if role is None:
+            raise InvalidQuery(f"Invalid role: {part}")
+        wanted.add(role)
+    return [role for role in ROLE_ORDER if role in wanted]
+
+
+def parse_limit(value: str | None) -> int:
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError as e:
+        raise InvalidQuery("Invalid limit") from e
+    if limit < 1:
+        raise InvalidQuery("Invalid limit")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def _member_rows():
+    return select(models.Room_members.user_id, models.Room_members.member_role)
+
+
+def _serialize(rows, names: dict[str, str]) -> list[dict]:
+    return [
+        {
+            "username": names[row.user_id],
+            "id": row.user_id,
+            "role": row.member_role.name,
+        }
+        for row in rows
+        if row.user_id in names
+    ]
+
+
+def _page_by_role(db, room_id, roles, limit, cursor):
+    start, after_id = 0, None
+    if cursor:
+        values = decode_cursor(cursor)
+        if (
+            len(values) != 3
+            or values[0] != "r"
+            or not isinstance(values[1], str)
+            or not str(values[2]).isdigit()
+        ):
+            raise InvalidQuery("Invalid cursor")
+        role = MemberRole.__members__.get(values[1])
+        if role not in roles:
+            raise InvalidQuery("Invalid cursor")
+        start, after_id = roles.index(role), str(values[2])
+
+    rows = []
+    # one extra row tells whether there is a next page
+    for index, role in enumerate(roles[start:], start):
+        query = _member_rows().where(
+            models.Room_members.room_id == room_id,
+            models.Room_members.member_role == role,
+        )
+        if after_id and index == start:
+            query = query.where(models.Room_members.user_id > after_id)
+        query = query.order_by(models.Room_members.user_id).limit(limit + 1 - len(rows))
+        rows.extend(db.execute(query).all())
+        if len(rows) > limit:
+            break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor("r", last.member_role.name, last.user_id)
+    return rows, next_cursor
+
+
+def _page_by_username(db, room_id, roles, limit, cursor, prefix):
+    # the one listing that filters and sorts on username, so it keeps the join
+    query = (
+        _member_rows()
+        .add_columns(models.User.username)
+        .join(models.User, models.User.user_id == models.Room_members.user_id)
+    ).where(
+        models.Room_members.room_id == room_id,
+        models.Room_members.member_role.in_(roles),
+        models.User.username.startswith(prefix, autoescape=True),
+    )
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 2 or values[0] != "u" or not isinstance(values[1], str):
+            raise InvalidQuery("Invalid cursor")
+        query = query.where(models.User.username > values[1])
+    rows = db.execute(query.order_by(models.User.username).limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor("u", rows[-1].username)
+    return rows, next_cursor
+
+
+def list_members_page(db, room_id: str, args) -> dict:
+    # args: request.args (limit, cursor, role, q); raises InvalidQuery
+    roles = parse_roles(args.get("role"))
+    limit = parse_limit(args.get("limit"))
+    cursor = args.get("cursor")
+    prefix = (args.get("q") or "").strip()
+    if prefix:
+        rows, next_cursor = _page_by_username(db, room_id, roles, limit, cursor, prefix)
+        names = {row.user_id: row.username for row in rows}
+    else:
+        rows, next_cursor = _page_by_role(db, room_id, roles, limit, cursor)
+        names = users.usernames(db, (row.user_id for row in rows))
+    return {"members": _serialize(rows, names), "next_cursor": next_cursor}
+
+
+def count_members(db, room_id: str) -> dict:
+    # index-only: GROUP BY over ix_room_members_room_role_user
+    rows = db.execute(
+        select(models.Room_members.member_role, func.count())
+        .where(models.Room_members.room_id == room_id)
+        .group_by(models.Room_members.member_role)
+    ).all()
+    roles = {role.name: 0 for role in MemberRole}
+    for role, count in rows:
+        roles[role.name] = count
+    total = sum(count for name, count in roles.items() if name != "BANNED")
+    return {"total": total, "roles": roles}
+
+
+def wants_page(args) -> bool:
+    return any(param in args for param in PAGE_PARAMS)
+
+
+def page_variant(args) -> str:
+    # body cache key suffix for one page. Built from the parsed query, so
+    # equivalent query strings (and /bootstrap's default page) share a body,
+    # and bounded whatever the client sends.
+    key = [
+        [role.name for role in parse_roles(args.get("role"))],
+        parse_limit(args.get("limit")),
+        args.get("cursor"),
+        (args.get("q") or "").strip(),
+    ]
+    raw = json.dumps(key, separators=(",", ":"))
+    return "page:" + hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
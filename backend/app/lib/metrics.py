@@ -0,0 +1,221 @@
+# -------------------------
+# Metrics
+# -------------------------
+# Prometheus metrics for HTTP, Socket.IO, the database pool and Redis,
+# exposed by /metrics. Under gunicorn every worker writes its samples to
+# PROMETHEUS_MULTIPROC_DIR (set up in gunicorn.conf.py) and the scrape
+# aggregates them, so whichever worker answers reports the whole server.
+# Without that directory the default in-process registry is used.
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from lib.kv import add_command_hook
+
+# latencies in seconds; the chat is interactive, so resolve the low end
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+)
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+SOCKET_EVENT_DURATION = Histogram(
+    "socketio_event_duration_seconds",
+    "Socket.IO event handler latency",
+    ["event"],
+    buckets=LATENCY_BUCKETS,
+)
+SOCKET_EVENT_ERRORS = Counter(
+    "socketio_event_errors_total",
+    "Socket.IO event handlers that raised",
+    ["event"],
+)
+# livesum: summed over live workers, a dead worker's value is dropped
+SOCKETS_CONNECTED = Gauge(
+    "socketio_connected_sockets",
+    "Authenticated sockets",
+    multiprocess_mode="livesum",
+)
+ROOMS_JOINED = Gauge(
+    "socketio_joined_rooms",
+    "Socket room memberships (one per socket per room)",
+    multiprocess_mode="livesum",
+)
+BROADCAST_FANOUT = Histogram(
+    "socketio_broadcast_local_recipients",
+    "Recipients of a room broadcast connected to the emitting worker",
+    buckets=FANOUT_BUCKETS,
+)
+SOCKET_AUTH_REFRESHES = Counter(
+    "socketio_auth_refreshes_total",
+    "refresh_auth calls by token kind (access, refresh) and outcome",
+    ["kind", "outcome"],
+)
+SOCKETS_EXPIRED = Counter(
+    "socketio_auth_expired_total",
+    "Sockets disconnected because their token expired without a refresh",
+)
+USER_CACHE_LOOKUPS = Counter(
+    "user_directory_lookups_total",
+    "User directory entries by the tier that answered (local, redis, db)",
+    ["tier"],
+)
+MESSAGES_DEDUPED = Counter(
+    "send_message_duplicates_total",
+    "send_message calls answered from an earlier send with the same client_id",
+)
+REACTIONS = Counter(
+    "reactions_total",
+    "add_reaction and remove_reaction calls by op and outcome (changed, noop)",
+    ["op", "outcome"],
+)
+REACTIONS_FLUSHED = Counter(
+    "reactions_flushed_total",
+    "Reaction rows and message counts written to the database by the flush",
+    ["kind"],
+)
+RENDER_DURATION = Histogram(
+    "message_render_duration_seconds",
+    "Markdown rendering and sanitizing of one message",
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "SQLAlchemy pool connections by state",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds",
+    "Redis command latency (pipelines count as one PIPELINE call)",
+    ["command"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_STATEMENTS_PER_SCOPE = Histogram(
+    "db_statements_per_scope",
+    "SQL statements run by one HTTP request or socket event",
+    ["scope"],
+    buckets=(0, 1, 2, 3, 4, 5, 7, 10, 15, 25, 50, 100),
+)
+RETENTION_MESSAGES_DELETED = Counter(
+    "retention_messages_deleted_total",
+    "Messages deleted by the retention purge",
+    ["scope"],
+)
+RETENTION_BATCH_DURATION = Histogram(
+    "retention_batch_duration_seconds",
+    "One retention select + delete batch",
+    buckets=LATENCY_BUCKETS,
+)
+RETENTION_THROTTLED = Counter(
+    "retention_throttled_seconds_total",
+    "Seconds the retention purge waited for database load to drop",
+)
+JOBS_QUEUED = Gauge(
+    "jobs_queued",
+    "Background jobs waiting, by queue and state (ready, delayed, dead)",
+    ["queue", "state"],
+    multiprocess_mode="max",
+)
+JOBS_PROCESSED = Counter(
+    "jobs_processed_total",
+    "Background job runs by outcome (success, retry, dead)",
+    ["job", "outcome"],
+)
+JOB_DURATION = Histogram(
+    "job_duration_seconds",
+    "Background job run time",
+    ["job"],
+    buckets=LATENCY_BUCKETS + (10, 30, 60, 300),
+)
+LOG_LINES_DROPPED = Counter(
+    "log_lines_dropped_total",
+    "Log lines dropped because a sink's buffer was full",
+    ["sink"],
+)
+
+
+@contextmanager
+def observe(histogram, *labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric = histogram.labels(*labels) if labels else histogram
+        metric.observe(time.perf_counter() - started)
+
+
+def timed_event(event: str):
+    # wraps a Socket.IO handler; goes under @socketio.on so the wrapper is
+    # what gets registered
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                SOCKET_EVENT_ERRORS.labels(event).inc()
+                raise
+            finally:
+                SOCKET_EVENT_DURATION.labels(event).observe(
+                    time.perf_counter() - started
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def observe_pool(engine):
+    # QueuePool only; SQLite memory engines use pools without these counters
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return
+    DB_POOL_CONNECTIONS.labels("checked_out").set(pool.checkedout())
+    DB_POOL_CONNECTIONS.labels("idle").set(pool.checkedin())
+    DB_POOL_CONNECTIONS.labels("overflow").set(max(pool.overflow(), 0))
+
+
+def _observe_redis(command: str, seconds: float):
+    REDIS_COMMAND_DURATION.labels(command).observe(seconds)
+
+
+add_command_hook(_observe_redis)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,184 @@
+# -------------------------
+# Sampled profiling
+# -------------------------
+# A statistical CPU profiler for single requests and socket events, switched
+# on at runtime. The Redis hash "profiling" holds the sampled fraction and
+# an expiry; every worker reads it at most once per PROFILE_FLAG_TTL, so
+# while it is off a request costs one float comparison.
+#
+# A sampled request installs a SIGPROF interval timer. The handler records
+# the stack of the running greenlet if that greenlet is being profiled, and
+# the counts are written as folded stacks to PROFILE_DIR/<key>.folded.
+# Signals are delivered to the main thread, where all greenlets of a gevent
+# worker run; handlers running in real threads are never sampled.
+import hashlib
+import hmac
+import os
+import random
+import signal
+import time
+from functools import wraps
+
+from flask import request
+from greenlet import getcurrent
+from loguru import logger
+
+from config import PROFILE_DIR, PROFILE_FLAG_TTL, PROFILE_INTERVAL
+
+FLAG_KEY = "profiling"
+SIGNATURE_MAX_AGE = 60
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    message = timestamp.encode() + b"." + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret: str, timestamp, body: bytes, signature) -> bool:
+    if not timestamp or not signature:
+        return False
+    try:
+        age = abs(time.time() - float(timestamp))
+    except ValueError:
+        return False
+    if age > SIGNATURE_MAX_AGE:
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), signature)
+
+
+class Profile:
+    def __init__(self, key: str, label: str):
+        self.key = key
+        self.label = label
+        self.greenlet = getcurrent()
+        self.samples: dict[str, int] = {}
+        self.started = time.perf_counter()
+
+    def sample(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        stack.append(self.label)
+        folded = ";".join(reversed(stack))
+        self.samples[folded] = self.samples.get(folded, 0) + 1
+
+
+_labels = {}
+
+
+def _frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        filename = os.path.basename(code.co_filename)
+        label = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+        _labels[code] = label
+    return label
+
+
+class Profiler:
+    def __init__(self, kv):
+        self.kv = kv
+        self.fraction = 0.0
+        self.until = 0.0
+        self._checked = 0.0
+        self._active: dict = {}
+        self._installed = False
+
+    # -------------------------
+    # toggle
+    # -------------------------
+    def enable(self, fraction: float, duration: float) -> dict:
+        if fraction > 0:
+            until = time.time() + duration
+            self.kv.hset(FLAG_KEY, mapping={"fraction": fraction, "until": until})
+            self.kv.expireat(FLAG_KEY, int(until) + 1)
+        else:
+            until = 0.0
+            self.kv.delete(FLAG_KEY)
+        # apply locally right away; other workers pick it up within the TTL
+        self.fraction, self.until = fraction, until
+        self._checked = time.monotonic()
+        return {"fraction": fraction, "until": until}
+
+    def _refresh(self):
+        self._checked = time.monotonic()
+        try:
+            flag = self.kv.hgetall(FLAG_KEY)
+        except Exception as e:
+            logger.debug("Profiling flag unavailable", error=str(e))
+            flag = {}
+        self.fraction = float(flag.get(b"fraction", 0))
+        self.until = float(flag.get(b"until", 0))
+
+    def should_sample(self) -> bool:
+        if time.monotonic() - self._checked > PROFILE_FLAG_TTL:
+            self._refresh()
+        if self.fraction <= 0 or time.time() > self.until:
+            return False
+        return random.random() < self.fraction
+
+    # -------------------------
+    # sampling
+    # -------------------------
+    def maybe_start(self, key: str, label: str) -> Profile | None:
+        if not self.should_sample():
+            return None
+        if not self._installed:
+            try:
+                signal.signal(signal.SIGPROF, self._on_signal)
+            except ValueError:
+                # not the main thread; nothing here could be sampled
+                logger.warning("Profiling needs the main thread, disabled")
+                self.fraction = 0.0
+                return None
+            self._installed = True
+        profile = Profile(key, label)
+        self._active[profile.greenlet] = profile
+        if len(self._active) == 1:
+            signal.setitimer(signal.ITIMER_PROF, PROFILE_INTERVAL, PROFILE_INTERVAL)
+        return profile
+
+    def _on_signal(self, signum, frame):
+        profile = self._active.get(getcurrent())
+        if profile is not None:
+            profile.sample(frame)
+
+    def stop(self, profile: Profile | None):
+        if profile is None:
+            return
+        self._active.pop(profile.greenlet, None)
+        if not self._active:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+        self._write(profile)
+
+    def profiled_event(self, event: str):
+        # wraps a Socket.IO handler, like lib.metrics.timed_event
+        def decorator(handler):
+            @wraps(handler)
+            def wrapper(*args, **kwargs):
+                profile = self.maybe_start(
+                    f"socket-{request.sid}-{event}-{time.time_ns()}",
+                    f"socket {event}",
+                )
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    self.stop(profile)
+
+            return wrapper
+
+        return decorator
+
+    def _write(self, profile: Profile):
+        elapsed_ms = round((time.perf_counter() - profile.started) * 1000, 2)
+        log = logger.bind(key=profile.key, label=profile.label, elapsed_ms=elapsed_ms)
+        if not profile.samples:
+            log.debug("Profile has no samples")
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{profile.key}.folded")
+        with open(path, "w") as f:
+            for stack, count in profile.samples.items():
+                f.write(f"{stack} {count}\n")
+        log.info("Profile written", path=path, samples=sum(profile.samples.values()))
@@ -0,0 +1,145 @@
+# -------------------------
+# Query instrumentation
+# -------------------------
+# Counts and times every SQL statement through SQLAlchemy engine events.
+# Statements slower than SLOW_QUERY_MS are logged with the shape of their
+# parameters (types, never values). Each request or socket event is a
+# scope (start_query_scope/end_query_scope); ending one logs a warning when
+# it ran more than QUERY_BUDGET statements or repeated one statement
+# N_PLUS_ONE_THRESHOLD times, and with QUERY_STRICT raises
+# QueryBudgetExceeded so tests fail instead.
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+
+from loguru import logger
+from sqlalchemy import event
+
+from config import N_PLUS_ONE_THRESHOLD, QUERY_BUDGET, QUERY_STRICT, SLOW_QUERY_MS
+from lib.metrics import DB_STATEMENTS_PER_SCOPE
+
+_current: ContextVar = ContextVar("query_stats", default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    def __init__(self, label: str):
+        self.label = label
+        self.count = 0
+        self.total_ms = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.statements[statement] += 1
+
+    def repeated(self) -> list[tuple[str, int]]:
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= N_PLUS_ONE_THRESHOLD
+        ]
+
+
+def parameter_shape(parameters):
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        # executemany passes a sequence of parameter sets
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"{len(parameters)} x {parameter_shape(parameters[0])}"
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+# -------------------------
+# scopes
+# -------------------------
+def start_query_scope(label: str) -> QueryStats:
+    stats = QueryStats(label)
+    _current.set(stats)
+    return stats
+
+
+def end_query_scope(stats: QueryStats | None, **log_context):
+    _current.set(None)
+    if stats is None:
+        return
+    DB_STATEMENTS_PER_SCOPE.labels(stats.label).observe(stats.count)
+    repeated = stats.repeated()
+    if stats.count <= QUERY_BUDGET and not repeated:
+        return
+
+    log = logger.bind(
+        scope=stats.label,
+        statements=stats.count,
+        budget=QUERY_BUDGET,
+        db_ms=round(stats.total_ms, 2),
+        **log_context,
+    )
+    for statement, count in repeated:
+        log.warning("Possible N+1 query", repeated=count, statement=statement[:500])
+    if stats.count > QUERY_BUDGET:
+        log.warning("Query budget exceeded")
+    if QUERY_STRICT:
+        raise QueryBudgetExceeded(
+            f"{stats.label}: {stats.count} statements (budget {QUERY_BUDGET}), "
+            f"{len(repeated)} repeated"
+        )
+
+
+def current() -> QueryStats | None:
+    return _current.get()
+
+
+def tracked_event(event_name: str):
+    # wraps a Socket.IO handler in a query scope
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            stats = start_query_scope(f"socket {event_name}")
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                end_query_scope(stats)
+
+        return wrapper
+
+    return decorator
+
+
+# -------------------------
+# engine hooks
+# -------------------------
+def track_queries(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+        stats = _current.get()
+        if stats is not None:
+            stats.record(statement, elapsed_ms)
+        if elapsed_ms >= SLOW_QUERY_MS:
+            logger.warning(
+                "Slow query",
+                elapsed_ms=round(elapsed_ms, 2),
+                statement=statement[:1000],
+                parameters=parameter_shape(parameters),
+                scope=stats.label if stats else None,
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        started = (
+            context.connection.info.get("query_started") if context.connection else None
+        )
+        if started:
+            started.pop()
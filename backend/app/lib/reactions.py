@@ -0,0 +1,316 @@
+# -------------------------
+# Message reactions
+# -------------------------
+# Reactions are the most frequent write users make, so a click never touches
+# the database. It changes Redis only:
+#
+#   rx:<message_id>       hash emoji -> count, plus _room (the message's room)
+#   rx:who:<message_id>   set of "<user_id>:<emoji>", who reacted with what
+#   rx:ops                list of changes not yet in message_reactions
+#   rx:dirty              set of message ids whose counts changed
+#
+# SADD/SREM on the who set decide whether a click changes anything, so a
+# double click or a resend is counted once; only then is the count moved.
+# The flush job (flush_reactions in lib/tasks.py) writes the pending changes
+# to message_reactions and each dirty message's counts to
+# messages.reaction_counts, a batch per transaction, so a message clicked a
+# thousand times between flushes costs one UPDATE.
+#
+# A message's keys live REACTION_KEY_TTL seconds after its last reaction
+# and are dropped with the message. The next reaction seeds them again from
+# the database, so Redis only holds messages people are reacting to. The
+# who set outlives the hash by WHO_GRACE, so a seed never finds a stale one.
+import json
+import threading
+from collections import Counter
+
+from loguru import logger
+from redis import RedisError, WatchError
+from sqlalchemy import bindparam, delete, insert, select, tuple_, update
+
+import models
+from config import REACTION_EMOJI, REACTION_FLUSH_BATCH, REACTION_KEY_TTL
+from lib.metrics import REACTIONS_FLUSHED
+
+OPS_KEY = "rx:ops"
+DIRTY_KEY = "rx:dirty"
+# the dirty set being flushed; left behind by a crashed flush and finished
+# by the next one
+FLUSHING_KEY = "rx:dirty:flushing"
+ROOM_FIELD = "_room"
+# ops batches per flush run, so a backlog does not hold a worker forever
+MAX_FLUSH_BATCHES = 50
+WHO_GRACE = 60
+
+
+def counts_key(message_id: int) -> str:
+    return f"rx:{message_id}"
+
+
+def who_key(message_id: int) -> str:
+    return f"rx:who:{message_id}"
+
+
+def _expire(pipe, message_id: int):
+    pipe.expire(counts_key(message_id), REACTION_KEY_TTL)
+    pipe.expire(who_key(message_id), REACTION_KEY_TTL + WHO_GRACE)
+
+
+def valid_emoji(emoji) -> bool:
+    return isinstance(emoji, str) and emoji in REACTION_EMOJI
+
+
+def _counts(raw: dict) -> dict[str, int]:
+    # a count that dropped to 0 keeps its field; it is left out here
+    counts = {}
+    for field, value in raw.items():
+        field = field.decode()
+        if field != ROOM_FIELD and int(value) > 0:
+            counts[field] = int(value)
+    return counts
+
+
+def fetch_counts(kv, message_ids) -> dict[int, dict[str, int]]:
+    # {message_id: {emoji: count}} for the messages Redis has keys for
+    message_ids = list(message_ids)
+    pipe = kv.pipeline(transaction=False)
+    for message_id in message_ids:
+        pipe.hgetall(counts_key(message_id))
+    return {
+        message_id: _counts(raw)
+        for message_id, raw in zip(message_ids, pipe.execute())
+        if raw
+    }
+
+
+# -------------------------
+# clicks
+# -------------------------
+def _seed(db, kv, message_id: int) -> str | None:
+    # first reaction on this message since its keys were created (or lost):
+    # copy the flushed rows in. WATCH makes concurrent first clicks seed it
+    # once; nobody counts on the hash before _room is in it.
+    room_id = db.scalar(
+        select(models.Message.room_id).where(models.Message.id == message_id)
+    )
+    if room_id is None:
+        return None
+    rows = db.execute(
+        select(models.MessageReaction.user_id, models.MessageReaction.emoji).where(
+            models.MessageReaction.message_id == message_id
+        )
+    ).all()
+    key = counts_key(message_id)
+    with kv.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                seeded = pipe.hget(key, ROOM_FIELD)
+                if seeded is not None:
+                    return seeded.decode()
+                pipe.multi()
+                counts = Counter(emoji for _, emoji in rows)
+                pipe.hset(key, mapping={ROOM_FIELD: room_id, **counts})
+                pipe.delete(who_key(message_id))
+                if rows:
+                    pipe.sadd(
+                        who_key(message_id),
+                        *(f"{user_id}:{emoji}" for user_id, emoji in rows),
+                    )
+                _expire(pipe, message_id)
+                pipe.execute()
+                return room_id
+            except WatchError:
+                continue
+
+
+def message_room(db, kv, message_id: int) -> str | None:
+    # the room a message belongs to, None if it does not exist; only the
+    # first reaction on a message reads the database
+    room_id = kv.hget(counts_key(message_id), ROOM_FIELD)
+    if room_id is not None:
+        return room_id.decode()
+    return _seed(db, kv, message_id)
+
+
+def react(kv, user_id: str, message_id: int, emoji: str, add: bool) -> tuple[bool, int]:
+    # (changed, count now); call message_room() first so the keys are seeded
+    member = f"{user_id}:{emoji}"
+    if add:
+        changed = kv.sadd(who_key(message_id), member)
+    else:
+        changed = kv.srem(who_key(message_id), member)
+    pipe = kv.pipeline()
+    if not changed:
+        pipe.hget(counts_key(message_id), emoji)
+        _expire(pipe, message_id)
+        return False, int(pipe.execute()[0] or 0)
+    # the who set already changed, so this runs once per real change
+    pipe.hincrby(counts_key(message_id), emoji, 1 if add else -1)
+    pipe.sadd(DIRTY_KEY, message_id)
+    pipe.rpush(
+        OPS_KEY, json.dumps(["add" if add else "remove", message_id, user_id, emoji])
+    )
+    _expire(pipe, message_id)
+    count = pipe.execute()[0]
+    return True, max(count, 0)
+
+
+def overlay(kv, messages: list[dict]):
+    # history carries the counts last flushed to messages.reaction_counts;
+    # replace them with the live ones from Redis, one pipeline for the page
+    if not messages:
+        return
+    try:
+        live = fetch_counts(kv, (message["message_id"] for message in messages))
+    except RedisError as e:
+        logger.warning("Live reaction counts unavailable", error=str(e))
+        return
+    for message in messages:
+        if message["message_id"] in live:
+            message["reactions"] = live[message["message_id"]]
+
+
+def drop(kv, message_ids: list[int]):
+    # after deleting messages; their changes still in rx:ops are skipped by
+    # the flush
+    pipe = kv.pipeline(transaction=False)
+    for message_id in message_ids:
+        pipe.delete(counts_key(message_id), who_key(message_id))
+    pipe.execute()
+
+
+# -------------------------
+# broadcasts
+# -------------------------
+class BroadcastBuffer:
+    # room_id -> message ids changed since the last broadcast. The app sends
+    # one "reactions" event per room per REACTION_BROADCAST_INTERVAL with
+    # those messages' current counts, however many clicks there were.
+    def __init__(self):
+        self._pending: dict[str, set[int]] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, room_id: str, message_id: int):
+        with self._lock:
+            self._pending.setdefault(room_id, set()).add(message_id)
+
+    def drain(self) -> dict[str, set[int]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+
+# one per process; each process broadcasts the clicks it handled
+broadcasts = BroadcastBuffer()
+
+
+# -------------------------
+# flush
+# -------------------------
+def _flush_ops(db, kv, batch_size: int) -> int:
+    raw = kv.lrange(OPS_KEY, 0, batch_size - 1)
+    if not raw:
+        return 0
+    # only the last change per (message, emoji, user) matters
+    final = {}
+    for item in raw:
+        op, message_id, user_id, emoji = json.loads(item)
+        final[(message_id, emoji, user_id)] = op
+    existing = set(
+        db.scalars(
+            select(models.Message.id).where(
+                models.Message.id.in_({key[0] for key in final})
+            )
+        ).all()
+    )
+    keys = [key for key in final if key[0] in existing]
+    if keys:
+        # delete then insert, so a batch applied twice (the LTRIM below
+        # never ran) ends up the same
+        table = models.MessageReaction
+        db.execute(
+            delete(table).where(
+                tuple_(table.message_id, table.emoji, table.user_id).in_(keys)
+            )
+        )
+        now = models.utcnow()
+        added = [
+            {
+                "message_id": message_id,
+                "emoji": emoji,
+                "user_id": user_id,
+                "date_created": now,
+            }
+            for (message_id, emoji, user_id) in keys
+            if final[(message_id, emoji, user_id)] == "add"
+        ]
+        if added:
+            db.execute(insert(table), added)
+    db.commit()
+    kv.ltrim(OPS_KEY, len(raw), -1)
+    REACTIONS_FLUSHED.labels("rows").inc(len(keys))
+    return len(raw)
+
+
+def _flush_counts(db, kv, batch_size: int) -> int:
+    # the dirty set is renamed away first, so clicks during the flush mark
+    # a fresh set and are written next time
+    if not kv.exists(FLUSHING_KEY):
+        if not kv.exists(DIRTY_KEY):
+            return 0
+        kv.rename(DIRTY_KEY, FLUSHING_KEY)
+    table = models.Message.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        # not an edit: keep date_updated as it is
+        .values(
+            reaction_counts=bindparam("b_counts"), date_updated=table.c.date_updated
+        )
+    )
+    flushed = 0
+    while ids := kv.srandmember(FLUSHING_KEY, batch_size):
+        ids = [int(message_id) for message_id in ids]
+        live = fetch_counts(kv, ids)
+        # a message whose keys are gone (dropped, expired) keeps what the
+        # database has
+        if live:
+            db.execute(
+                statement,
+                [
+                    {
+                        "b_id": message_id,
+                        "b_counts": json.dumps(counts, ensure_ascii=False)
+                        if counts
+                        else None,
+                    }
+                    for message_id, counts in live.items()
+                ],
+            )
+            db.commit()
+        kv.srem(FLUSHING_KEY, *ids)
+        flushed += len(live)
+    REACTIONS_FLUSHED.labels("messages").inc(flushed)
+    return flushed
+
+
+def flush(session_factory, kv, batch_size: int = REACTION_FLUSH_BATCH) -> dict:
+    # runs on one worker at a time (a periodic job), never concurrently
+    db = session_factory()
+    try:
+        ops = 0
+        for _ in range(MAX_FLUSH_BATCHES):
+            done = _flush_ops(db, kv, batch_size)
+            ops += done
+            if done < batch_size:
+                break
+        messages = _flush_counts(db, kv, batch_size)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    if ops or messages:
+        logger.debug("Reactions flushed", ops=ops, messages=messages)
+    return {"ops": ops, "messages": messages}
@@ -0,0 +1,91 @@
+# -------------------------
+# Read markers
+# -------------------------
+# The id of the last message a user has seen in each room lives in the Redis
+# hash read:<user_id> (field: room_id). fetch_history moves it to the newest
+# message it sends, and clients report messages that arrive while a room is
+# open with mark_read. A room without a marker is initialised to its latest
+# message by /bootstrap, so unread counts start from the first load rather
+# than from the beginning of the room.
+from loguru import logger
+from redis import RedisError
+from sqlalchemy import func, select, union_all
+
+import models
+
+MARKER_TTL = 90 * 24 * 3600
+# unread counts are exact below this, UNREAD_OVERFLOW at it
+UNREAD_CAP = 100
+UNREAD_OVERFLOW = "99+"
+
+
+def read_key(user_id: str) -> str:
+    return f"read:{user_id}"
+
+
+def get_markers(kv, user_id: str) -> dict[str, int]:
+    try:
+        raw = kv.hgetall(read_key(user_id))
+    except RedisError as e:
+        logger.warning("Read markers unavailable", user_id=user_id, error=str(e))
+        return {}
+    return {room_id.decode(): int(value) for room_id, value in raw.items()}
+
+
+def mark_read(kv, user_id: str, room_id: str, message_id: int):
+    # markers only move forward; a late mark_read for an older message is a
+    # no-op
+    key = read_key(user_id)
+    try:
+        current = kv.hget(key, room_id)
+        if current is not None and int(current) >= message_id:
+            return
+        pipe = kv.pipeline(transaction=False)
+        pipe.hset(key, room_id, message_id)
+        pipe.expire(key, MARKER_TTL)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("Failed to store read marker", user_id=user_id, error=str(e))
+
+
+def init_markers(kv, user_id: str, markers: dict[str, int]):
+    # HSETNX: never moves a marker another request already set
+    if not markers:
+        return
+    key = read_key(user_id)
+    try:
+        pipe = kv.pipeline(transaction=False)
+        for room_id, message_id in markers.items():
+            pipe.hsetnx(key, room_id, message_id)
+        pipe.expire(key, MARKER_TTL)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("Failed to store read markers", user_id=user_id, error=str(e))
+
+
+def unread_counts(db, user_id: str, markers: dict[str, int]) -> dict[str, int | str]:
+    # counts stop at UNREAD_CAP rows per room, so a room with a long backlog
+    # costs no more than a small one; at the cap the count is "99+". The
+    # user's own messages never count as unread.
+    if not markers:
+        return {}
+    capped = [
+        select(models.Message.room_id)
+        .where(
+            models.Message.room_id == room_id,
+            models.Message.id > last,
+            models.Message.sender != user_id,
+        )
+        .limit(UNREAD_CAP)
+        .subquery()
+        for room_id, last in markers.items()
+    ]
+    # each capped select is wrapped, as SQLite takes no LIMIT inside a UNION
+    unread = union_all(*(select(sub.c.room_id) for sub in capped)).subquery()
+    rows = db.execute(
+        select(unread.c.room_id, func.count()).group_by(unread.c.room_id)
+    ).all()
+    return {
+        room_id: UNREAD_OVERFLOW if count >= UNREAD_CAP else count
+        for room_id, count in rows
+    }
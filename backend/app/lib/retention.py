@@ -0,0 +1,199 @@
+# -------------------------
+# Message retention
+# -------------------------
+# Deletes messages older than MESSAGE_RETENTION_DAYS, or their room's entry
+# in ROOM_RETENTION_DAYS, in small primary-key batches. Never a
+# "DELETE ... WHERE date_created < X": that would scan and lock the table
+# for minutes. Ids grow with time, so each scan stops at the first message
+# that is still inside its retention window.
+#
+#   rooms with an override   walked by (room_id, id) on ix_messages_room_id,
+#                            one room at a time, from the room's oldest row
+#   everything else          walked by id from a checkpoint kept in the
+#                            Redis hash retention:progress, skipping rooms
+#                            with an override
+#
+# After every batch the purger rests at least as long as the batch took,
+# and on MySQL it waits while Threads_running is above
+# RETENTION_MAX_THREADS_RUNNING. Deleted ids are queued for the search
+# indexer (lib/search.py).
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from loguru import logger
+from sqlalchemy import delete, select, text
+
+import models
+from config import (
+    MESSAGE_RETENTION_DAYS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_MAX_THREADS_RUNNING,
+    RETENTION_PAUSE,
+    ROOM_RETENTION_DAYS,
+)
+from lib.metrics import (
+    RETENTION_BATCH_DURATION,
+    RETENTION_MESSAGES_DELETED,
+    RETENTION_THROTTLED,
+)
+from lib.reactions import drop as drop_reactions
+from lib.search import enqueue_deletes
+
+PROGRESS_KEY = "retention:progress"
+LOCK_KEY = "retention:lock"
+LOCK_TTL = 120
+# longest single wait for the database load to drop before checking again
+LOAD_WAIT = 5.0
+
+
+class Throttle:
+    def __init__(self, db, kv, pause: float, max_threads_running: int):
+        self.db = db
+        self.kv = kv
+        self.pause = pause
+        self.max_threads_running = max_threads_running
+        self.mysql = db.get_bind().dialect.name == "mysql"
+
+    def threads_running(self) -> int | None:
+        if not self.mysql:
+            return None
+        row = self.db.execute(text("SHOW GLOBAL STATUS LIKE 'Threads_running'")).first()
+        self.db.commit()
+        return int(row[1]) if row else None
+
+    def after_batch(self, elapsed: float):
+        time.sleep(max(self.pause, elapsed))
+        while True:
+            running = self.threads_running()
+            if running is None or running <= self.max_threads_running:
+                break
+            logger.info("Retention throttled", threads_running=running)
+            RETENTION_THROTTLED.inc(LOAD_WAIT)
+            time.sleep(LOAD_WAIT)
+        # still alive: keep the lock
+        self.kv.expire(LOCK_KEY, LOCK_TTL)
+
+
+def _fingerprint(global_days: int, room_days: dict[str, int]) -> str:
+    # the checkpoint is only valid for the overrides it was made with
+    raw = json.dumps([global_days, sorted(room_days.items())])
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _delete_batch(db, kv, ids: list[int], scope: str):
+    db.execute(delete(models.Message).where(models.Message.id.in_(ids)))
+    db.commit()
+    enqueue_deletes(kv, ids)
+    drop_reactions(kv, ids)
+    RETENTION_MESSAGES_DELETED.labels(scope).inc(len(ids))
+
+
+def purge_room_messages(db, kv, room_id, days, now, batch_size, throttle) -> int:
+    cutoff = now - timedelta(days=days)
+    deleted = 0
+    while True:
+        started = time.perf_counter()
+        rows = db.execute(
+            select(models.Message.id, models.Message.date_created)
+            .where(models.Message.room_id == room_id)
+            .order_by(models.Message.id)
+            .limit(batch_size)
+        ).all()
+        expired = [mid for mid, created in rows if created < cutoff]
+        if expired:
+            _delete_batch(db, kv, expired, "room")
+            deleted += len(expired)
+        RETENTION_BATCH_DURATION.observe(time.perf_counter() - started)
+        if len(expired) < batch_size:
+            return deleted
+        throttle.after_batch(time.perf_counter() - started)
+
+
+def purge_global(db, kv, days, room_days, now, batch_size, throttle) -> int:
+    cutoff = now - timedelta(days=days)
+    fingerprint = _fingerprint(days, room_days)
+    progress = kv.hgetall(PROGRESS_KEY)
+    checkpoint = 0
+    if progress.get(b"fingerprint", b"").decode() == fingerprint:
+        checkpoint = int(progress.get(b"checkpoint", 0))
+
+    deleted = 0
+    while True:
+        started = time.perf_counter()
+        rows = db.execute(
+            select(
+                models.Message.id,
+                models.Message.room_id,
+                models.Message.date_created,
+            )
+            .where(models.Message.id > checkpoint)
+            .order_by(models.Message.id)
+            .limit(batch_size)
+        ).all()
+        expired = []
+        done = len(rows) < batch_size
+        for message_id, room_id, created in rows:
+            if created >= cutoff:
+                done = True
+                break
+            checkpoint = message_id
+            if room_id not in room_days:
+                expired.append(message_id)
+        if expired:
+            _delete_batch(db, kv, expired, "global")
+            deleted += len(expired)
+        kv.hset(
+            PROGRESS_KEY, mapping={"checkpoint": checkpoint, "fingerprint": fingerprint}
+        )
+        RETENTION_BATCH_DURATION.observe(time.perf_counter() - started)
+        if done:
+            return deleted
+        throttle.after_batch(time.perf_counter() - started)
+
+
+def run_retention(
+    session_factory,
+    kv,
+    days: int = MESSAGE_RETENTION_DAYS,
+    room_days: dict[str, int] = ROOM_RETENTION_DAYS,
+    batch_size: int = RETENTION_BATCH_SIZE,
+    pause: float = RETENTION_PAUSE,
+    max_threads_running: int = RETENTION_MAX_THREADS_RUNNING,
+) -> int | None:
+    # messages deleted, or None when another purger holds the lock
+    if not days and not any(room_days.values()):
+        return 0
+    if not kv.set(LOCK_KEY, "1", nx=True, ex=LOCK_TTL):
+        logger.info("Retention purge already running")
+        return None
+
+    # stored timestamps are naive UTC
+    now = models.utcnow().replace(tzinfo=None)
+    db = session_factory()
+    throttle = Throttle(db, kv, pause, max_threads_running)
+    deleted = 0
+    try:
+        kv.hset(PROGRESS_KEY, mapping={"status": "running", "started": time.time()})
+        for room_id, room_retention in room_days.items():
+            if room_retention:
+                deleted += purge_room_messages(
+                    db, kv, room_id, room_retention, now, batch_size, throttle
+                )
+        if days:
+            deleted += purge_global(db, kv, days, room_days, now, batch_size, throttle)
+        kv.hset(
+            PROGRESS_KEY,
+            mapping={"status": "done", "finished": time.time(), "deleted": deleted},
+        )
+        logger.info("Retention purge finished", deleted=deleted)
+        return deleted
+    except Exception as e:
+        db.rollback()
+        kv.hset(PROGRESS_KEY, "status", "failed")
+        logger.error("Retention purge failed", error=str(e), deleted=deleted)
+        raise
+    finally:
+        db.close()
+        kv.delete(LOCK_KEY)
@@ -0,0 +1,146 @@
+# -------------------------
+# Room purge
+# -------------------------
+# delete_room only tombstones the room (rooms.date_deleted). The rows are
+# removed here in bounded primary-key batches so no single statement holds
+# locks for long and no ORM objects are ever loaded. Progress lives in the
+# Redis hash room_purge:<room_id>; the tombstone itself is what makes a purge
+# resumable, since any tombstoned room still present has work left.
+import time
+
+from loguru import logger
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+from config import ROOM_PURGE_BATCH_SIZE, ROOM_PURGE_PAUSE
+from lib.reactions import drop as drop_reactions
+from lib.search import enqueue_deletes
+
+PROGRESS_TTL = 24 * 3600
+LOCK_TTL = 60
+
+
+def progress_key(room_id: str) -> str:
+    return f"room_purge:{room_id}"
+
+
+def job_key(room_id: str) -> str:
+    # idempotency key of the room's purge_room job
+    return f"purge_room:{room_id}"
+
+
+def tombstone_room(db, room_id: str) -> bool:
+    result = db.execute(
+        update(models.Room)
+        .where(models.Room.room_id == room_id, models.Room.date_deleted.is_(None))
+        .values(date_deleted=models.utcnow())
+    )
+    db.commit()
+    return result.rowcount > 0
+
+
+def get_purge_progress(kv, room_id: str) -> dict:
+    return {
+        key.decode(): value.decode()
+        for key, value in kv.hgetall(progress_key(room_id)).items()
+    }
+
+
+def _delete_in_batches(db, kv, room_id, table, counter, batch_size, pause):
+    key = progress_key(room_id)
+    lock = f"{key}:lock"
+    deleted = 0
+    last_id = 0
+    while True:
+        ids = db.scalars(
+            select(table.c.id)
+            .where(table.c.room_id == room_id, table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            return deleted
+        db.execute(delete(table).where(table.c.id.in_(ids)))
+        db.commit()
+        if table is models.Message.__table__:
+            enqueue_deletes(kv, ids)
+            drop_reactions(kv, ids)
+        deleted += len(ids)
+        last_id = ids[-1]
+        kv.hincrby(key, counter, len(ids))
+        kv.expire(lock, LOCK_TTL)
+        time.sleep(pause)
+
+
+def purge_room(
+    session_factory,
+    kv,
+    room_id: str,
+    batch_size: int = ROOM_PURGE_BATCH_SIZE,
+    pause: float = ROOM_PURGE_PAUSE,
+) -> bool:
+    key = progress_key(room_id)
+    log = logger.bind(room_id=room_id)
+
+    # one purge per room across all workers; the lock is refreshed per batch
+    # and expires on its own if the purging process dies
+    if not kv.set(f"{key}:lock", "1", nx=True, ex=LOCK_TTL):
+        log.info("Room purge already running")
+        return False
+
+    db = session_factory()
+    try:
+        tombstoned = db.scalar(
+            select(models.Room.room_id).where(
+                models.Room.room_id == room_id, models.Room.date_deleted.isnot(None)
+            )
+        )
+        if not tombstoned:
+            log.warning("Room not tombstoned, refusing to purge")
+            return False
+
+        kv.hset(key, mapping={"status": "running", "started": time.time()})
+        kv.expire(key, PROGRESS_TTL)
+        messages = models.Message.__table__
+        members = models.Room_members.__table__
+
+        while True:
+            _delete_in_batches(
+                db, kv, room_id, messages, "messages_deleted", batch_size, pause
+            )
+            _delete_in_batches(
+                db, kv, room_id, members, "members_deleted", batch_size, pause
+            )
+            try:
+                db.execute(delete(models.Room).where(models.Room.room_id == room_id))
+                db.commit()
+                break
+            except IntegrityError:
+                # a message raced in after the last batch; sweep again
+                db.rollback()
+
+        kv.hset(key, mapping={"status": "done", "finished": time.time()})
+        log.info("Room purged", **get_purge_progress(kv, room_id))
+        return True
+    except Exception as e:
+        db.rollback()
+        kv.hset(key, "status", "failed")
+        log.error("Room purge failed", error=str(e))
+        return False
+    finally:
+        db.close()
+        kv.delete(f"{key}:lock")
+
+
+def purge_tombstoned_rooms(session_factory, kv, **kwargs) -> int:
+    db = session_factory()
+    try:
+        room_ids = db.scalars(
+            select(models.Room.room_id).where(models.Room.date_deleted.isnot(None))
+        ).all()
+    finally:
+        db.close()
+    return sum(
+        purge_room(session_factory, kv, room_id, **kwargs) for room_id in room_ids
+    )
@@ -0,0 +1,314 @@
+# -------------------------
+# Message search
+# -------------------------
+# A local on-disk inverted index: an SQLite FTS5 table at SEARCH_INDEX_PATH,
+# keyed by message id, holding the plain text of each message and its room.
+# The database is never searched with LIKE.
+#
+# Writes never happen on the request path. send_message pushes the new
+# message onto the Redis list search:queue (one capped LPUSH). A separate
+# indexer process (python -m tools.search_indexer) drains that list in
+# batches, and also tails the messages table by primary key from a
+# watermark. The tail is the backfill for an empty index and the safety net
+# for anything the queue lost, so the queue only has to be fast.
+#
+# /search only reads the index (read-only connection, WAL). Results are
+# scoped to the caller's rooms with an FTS column filter, ranked by bm25 and
+# checked against the database, so purged messages never come back. Purges
+# also queue the ids they delete on search:deleted, which the indexer drops
+# from the index.
+import html
+import json
+import os
+import re
+import sqlite3
+import time
+
+from loguru import logger
+from redis import RedisError
+from sqlalchemy import select
+
+import models
+from config import SEARCH_INDEX_PATH, SEARCH_QUEUE_MAX
+from lib.helper import html_to_text, serialize_message
+from lib.user_directory import users
+
+QUEUE_KEY = "search:queue"
+# ids of purged messages (retention, room purge) for the indexer to drop
+DELETED_KEY = "search:deleted"
+MAX_OFFSET = 1000
+# same token rule as the unicode61 tokenizer: letters and digits only
+TOKEN = re.compile(r"[^\W_]+")
+MARK_START, MARK_END = "\x02", "\x03"
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5(
+    body,
+    room_id,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3',
+    detail = column
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+"""
+
+
+class SearchUnavailable(RuntimeError):
+    pass
+
+
+# -------------------------
+# feeding the index
+# -------------------------
+def enqueue_message(kv, message_id: int, room_id: str, message_html: str):
+    # called from send_message; stripping and tokenizing happen in the indexer
+    entry = json.dumps(
+        {"id": message_id, "room": room_id, "html": message_html, "ts": time.time()}
+    )
+    try:
+        pipe = kv.pipeline(transaction=False)
+        pipe.lpush(QUEUE_KEY, entry)
+        # the watermark tail picks up whatever a full queue drops
+        pipe.ltrim(QUEUE_KEY, 0, SEARCH_QUEUE_MAX - 1)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("Failed to queue message for search", error=str(e))
+
+
+def enqueue_deletes(kv, message_ids: list[int]):
+    # one list entry per purge batch; results are checked against the
+    # database anyway, this only keeps the index from growing forever
+    if not message_ids:
+        return
+    try:
+        kv.lpush(DELETED_KEY, json.dumps(message_ids))
+    except RedisError as e:
+        logger.warning("Failed to queue search deletes", error=str(e))
+
+
+class SearchIndex:
+    # the writer side; one indexer process owns the file
+    def __init__(self, path: str = SEARCH_INDEX_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # rank by the body only; the room column is just a filter
+        self.conn.execute(
+            "INSERT INTO message_index(message_index, rank) "
+            "VALUES ('rank', 'bm25(1.0, 0.0)')"
+        )
+        self.conn.commit()
+
+    def get_meta(self, key: str, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        row = row.fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def add(self, rows):
+        # rows of (message_id, room_id, message_html); re-adding is a no-op
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO message_index (rowid, body, room_id) "
+            "VALUES (?, ?, ?)",
+            [(mid, html_to_text(body), str(room)) for mid, room, body in rows],
+        )
+
+    def delete(self, message_ids):
+        self.conn.executemany(
+            "DELETE FROM message_index WHERE rowid = ?",
+            [(message_id,) for message_id in message_ids],
+        )
+
+    def commit(self):
+        self.set_meta("indexed_at", time.time())
+        self.conn.commit()
+
+    def drain_queue(self, kv, batch_size: int) -> int:
+        # oldest entries sit at the tail; one consumer, so read-then-trim is
+        # safe, and a crash in between only loses what the tail re-reads
+        pipe = kv.pipeline()
+        pipe.lrange(QUEUE_KEY, -batch_size, -1)
+        pipe.ltrim(QUEUE_KEY, 0, -batch_size - 1)
+        entries, _ = pipe.execute()
+        if not entries:
+            return 0
+        rows = []
+        for raw in entries:
+            entry = json.loads(raw)
+            rows.append((entry["id"], entry["room"], entry["html"]))
+        self.add(rows)
+        self.commit()
+        return len(rows)
+
+    def drain_deletes(self, kv, batch_size: int) -> int:
+        pipe = kv.pipeline()
+        pipe.lrange(DELETED_KEY, -batch_size, -1)
+        pipe.ltrim(DELETED_KEY, 0, -batch_size - 1)
+        entries, _ = pipe.execute()
+        message_ids = [mid for raw in entries for mid in json.loads(raw)]
+        if message_ids:
+            self.delete(message_ids)
+            self.commit()
+        return len(message_ids)
+
+    def tail(self, db, batch_size: int) -> int:
+        # one primary-key batch after the watermark
+        watermark = int(self.get_meta("watermark", 0))
+        rows = db.execute(
+            select(models.Message.id, models.Message.room_id, models.Message.message)
+            .where(models.Message.id > watermark)
+            .order_by(models.Message.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return 0
+        # most of them already came through the queue
+        placeholders = ",".join("?" * len(rows))
+        present = {
+            rowid
+            for (rowid,) in self.conn.execute(
+                f"SELECT rowid FROM message_index WHERE rowid IN ({placeholders})",
+                [row[0] for row in rows],
+            )
+        }
+        self.add([row for row in rows if row[0] not in present])
+        self.set_meta("watermark", rows[-1][0])
+        self.commit()
+        return len(rows)
+
+    def catch_up(
+        self, kv, session_factory, batch_size: int, deadline: float | None = None
+    ) -> int:
+        # messages indexed until nothing is left, or until <deadline>
+        # (time.monotonic()) so a job gives its worker back
+        indexed = 0
+        while deadline is None or time.monotonic() < deadline:
+            queued = self.drain_queue(kv, batch_size)
+            deleted = self.drain_deletes(kv, batch_size)
+            db = session_factory()
+            try:
+                tailed = self.tail(db, batch_size)
+            finally:
+                db.close()
+            indexed += queued + tailed
+            if not (queued or tailed or deleted):
+                break
+        return indexed
+
+
+# -------------------------
+# searching
+# -------------------------
+def build_match(query: str, room_ids: list[str]) -> str | None:
+    # every word must match; the last one also as a prefix, for
+    # search-as-you-type. Words are quoted, so FTS5 syntax in the user's
+    # query is never interpreted.
+    words = TOKEN.findall(query)[:16]
+    if not words or not room_ids:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    rooms = " OR ".join(f'"{room_id}"' for room_id in room_ids)
+    return f"room_id : ({rooms}) AND body : ({' AND '.join(terms)})"
+
+
+def _open_reader(path: str) -> sqlite3.Connection:
+    if not os.path.exists(path):
+        raise SearchUnavailable("Search index not built yet")
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def _highlight(snippet: str) -> str:
+    # escape the indexed text, then turn the snippet markers into <mark>
+    escaped = html.escape(snippet)
+    return escaped.replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+def index_status(kv, path: str = SEARCH_INDEX_PATH) -> dict:
+    # how far behind the index is: queued messages and the age of the oldest
+    status = {"queued": 0, "lag_seconds": 0.0, "indexed_at": None}
+    try:
+        pipe = kv.pipeline(transaction=False)
+        pipe.llen(QUEUE_KEY)
+        pipe.lindex(QUEUE_KEY, -1)
+        queued, oldest = pipe.execute()
+    except RedisError as e:
+        logger.warning("Search queue unavailable", error=str(e))
+        return status
+    status["queued"] = queued
+    if oldest:
+        status["lag_seconds"] = round(time.time() - json.loads(oldest)["ts"], 3)
+    try:
+        with _open_reader(path) as conn:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'indexed_at'"
+            ).fetchone()
+        if row:
+            status["indexed_at"] = row[0]
+    except (SearchUnavailable, sqlite3.Error):
+        pass
+    return status
+
+
+def search_messages(
+    db,
+    query: str,
+    room_ids: list[str],
+    limit: int,
+    offset: int,
+    path: str = SEARCH_INDEX_PATH,
+) -> tuple[list[dict], int | None]:
+    match = build_match(query, room_ids)
+    if match is None:
+        return [], None
+    conn = _open_reader(path)
+    try:
+        # one extra row tells whether there is a next page
+        hits = conn.execute(
+            "SELECT rowid, room_id, snippet(message_index, 0, ?, ?, '…', 12) "
+            "FROM message_index WHERE message_index MATCH ? "
+            "ORDER BY rank LIMIT ? OFFSET ?",
+            (MARK_START, MARK_END, match, limit + 1, offset),
+        ).fetchall()
+    except sqlite3.OperationalError as e:
+        raise SearchUnavailable(str(e)) from e
+    finally:
+        conn.close()
+
+    next_offset = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        if offset + limit < MAX_OFFSET:
+            next_offset = offset + limit
+
+    # the index may still hold messages that were purged since
+    rows = db.execute(
+        select(
+            models.Message.id,
+            models.Message.sender,
+            models.Message.date_created,
+        ).where(models.Message.id.in_([hit[0] for hit in hits]))
+    ).all()
+    names = users.usernames(db, (row.sender for row in rows))
+    found = {row[0]: row for row in rows if row.sender in names}
+
+    results = []
+    for message_id, room_id, snippet in hits:
+        row = found.get(message_id)
+        if row is None:
+            continue
+        result = serialize_message(
+            message_id, names[row.sender], row.sender, _highlight(snippet), row[2]
+        )
+        result["snippet"] = result.pop("message")
+        result["room"] = room_id
+        results.append(result)
+    return results, next_offset
@@ -0,0 +1,144 @@
+# -------------------------
+# Serialization
+# -------------------------
+# One place that decides how JSON is encoded and HTTP bodies are compressed:
+#
+#   json_provider(app)    Flask JSON provider (jsonify, request.get_json)
+#   socketio_json()       json module for Socket.IO packets
+#   compress_response()   after_request hook, negotiated br / gzip
+#
+# orjson and brotli are used when installed (JSON_BACKEND=auto); without
+# them Flask's provider, the stdlib json module and gzip are used, so the
+# wire format stays the same either way.
+import gzip
+import json
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+from config import (
+    COMPRESS_BROTLI_QUALITY,
+    COMPRESS_GZIP_LEVEL,
+    COMPRESS_MIN_BYTES,
+    JSON_BACKEND,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def use_orjson() -> bool:
+    if JSON_BACKEND == "stdlib":
+        return False
+    if JSON_BACKEND == "orjson" and orjson is None:
+        raise RuntimeError("JSON_BACKEND=orjson needs orjson (pip install orjson)")
+    if JSON_BACKEND not in ("auto", "orjson"):
+        raise RuntimeError(f"Unknown JSON_BACKEND: {JSON_BACKEND}")
+    return orjson is not None
+
+
+# -------------------------
+# JSON
+# -------------------------
+class OrjsonProvider(DefaultJSONProvider):
+    # same output as DefaultJSONProvider (sorted keys, Flask's handling of
+    # dates, decimals and dataclasses through default()) minus the
+    # str round trip; non-ASCII is sent as UTF-8 instead of \u escapes
+    def _options(self) -> int:
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs.keys() - {"default"}:
+            # indent, separators... are only asked for when debugging
+            return super().dumps(obj, **kwargs)
+        default = kwargs.get("default", self.default)
+        return orjson.dumps(obj, default=default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options())
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+
+def json_provider(app) -> DefaultJSONProvider:
+    if use_orjson():
+        return OrjsonProvider(app)
+    return DefaultJSONProvider(app)
+
+
+class OrjsonModule:
+    # the subset of the json module Socket.IO calls: dumps(data,
+    # separators=...) and loads(); orjson output is already compact
+    @staticmethod
+    def dumps(obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+
+def socketio_json():
+    return OrjsonModule if use_orjson() else json
+
+
+# -------------------------
+# compression
+# -------------------------
+def negotiate_encoding(accept_encodings) -> str | None:
+    # prefer brotli, then gzip, honouring q=0
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL)
+
+
+def compress_response(response):
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.content_length is None or response.content_length < COMPRESS_MIN_BYTES:
+        return response
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    # the compressed bytes differ from the identity ones; keep the tag but
+    # mark it weak so If-None-Match still matches either representation
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,37 @@
+# -------------------------
+# Socket session expiry
+# -------------------------
+# A socket is authenticated once, on connect, but its access token still
+# expires. socket_state keeps the token's exp as expires_at. Clients are
+# sent an auth_expiry hint and renew in place with refresh_auth, so they do
+# not have to reconnect. A socket still unrenewed SOCKET_AUTH_GRACE seconds
+# after expiry is disconnected by the sweeper in app.py.
+import random
+import time
+
+from config import SOCKET_AUTH_GRACE, SOCKET_AUTH_REFRESH_WINDOW
+
+MIN_REFRESH_LEAD = 30
+
+
+def expiry_hint(expires_at: int) -> dict:
+    # refresh_in is jittered over the last SOCKET_AUTH_REFRESH_WINDOW seconds
+    # so a wave of sockets that connected together spreads out again
+    expires_in = max(0, expires_at - int(time.time()))
+    lead = random.uniform(
+        min(MIN_REFRESH_LEAD, SOCKET_AUTH_REFRESH_WINDOW), SOCKET_AUTH_REFRESH_WINDOW
+    )
+    return {
+        "expires_at": expires_at,
+        "expires_in": expires_in,
+        "refresh_in": max(0, int(expires_in - lead)),
+    }
+
+
+def expired_sids(socket_state: dict, now: float | None = None) -> list[str]:
+    deadline = (now or time.time()) - SOCKET_AUTH_GRACE
+    return [
+        sid
+        for sid, state in list(socket_state.items())
+        if state.get("expires_at", deadline + 1) < deadline
+    ]
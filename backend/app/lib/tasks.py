@@ -0,0 +1,110 @@
+# -------------------------
+# Job definitions
+# -------------------------
+# The tasks lib/jobs.py workers run; importing this module registers them.
+#
+#   purge_room              batch-delete a tombstoned room (from delete_room)
+#   purge_tombstoned_rooms  hourly, re-enqueues purges that never finished
+#   retention               every RETENTION_INTERVAL, when retention is set
+#   search_index            queue "search", every SEARCH_POLL_INTERVAL; brings
+#                           the local search index up to date. Exactly one
+#                           worker per index file may serve this queue.
+#   flush_reactions         every REACTION_FLUSH_INTERVAL, writes reaction
+#                           changes from Redis to the database
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+import models
+from config import (
+    MESSAGE_RETENTION_DAYS,
+    REACTION_FLUSH_INTERVAL,
+    RETENTION_INTERVAL,
+    ROOM_RETENTION_DAYS,
+    SEARCH_BATCH_SIZE,
+    SEARCH_DATABASE_URL,
+    SEARCH_POLL_INTERVAL,
+)
+from db import make_engine, session_local
+from lib.jobs import enqueue, periodic, release, task
+from lib.kv import create_kv
+from lib.reactions import flush as flush_reaction_changes
+from lib.retention import run_retention
+from lib.room_purge import get_purge_progress, job_key
+from lib.room_purge import purge_room as purge_room_rows
+from lib.search import SearchIndex
+
+# a search_index run gives its worker back after this many seconds and
+# continues on the next one
+SEARCH_JOB_BUDGET = 30
+
+kv = create_kv()
+_search_index = None
+_search_sessions = None
+
+
+@task("purge_room")
+def purge_room(room_id: str):
+    if purge_room_rows(session_local, kv, room_id):
+        return
+    # False also means "already running" or "nothing to purge"; only a
+    # failure is retried
+    if get_purge_progress(kv, room_id).get("status") == "failed":
+        raise RuntimeError(f"Room purge failed: {room_id}")
+    # the room may still be tombstoned (another purge held the lock); let the
+    # next hourly sweep enqueue it rather than wait out the key's TTL
+    release(kv, job_key(room_id))
+
+
+@task("purge_tombstoned_rooms")
+def purge_tombstoned_rooms():
+    db = session_local()
+    try:
+        room_ids = db.scalars(
+            select(models.Room.room_id).where(models.Room.date_deleted.isnot(None))
+        ).all()
+    finally:
+        db.close()
+    for room_id in room_ids:
+        # same key as delete_room, so a purge still queued is not doubled
+        enqueue(
+            kv,
+            "purge_room",
+            {"room_id": room_id},
+            idempotency_key=job_key(room_id),
+        )
+
+
+@task("retention")
+def retention():
+    run_retention(session_local, kv)
+
+
+@task("search_index", queue="search", retries=0)
+def search_index():
+    global _search_index, _search_sessions
+
+    if _search_index is None:
+        _search_index = SearchIndex()
+        _search_sessions = session_local
+        if SEARCH_DATABASE_URL:
+            _search_sessions = sessionmaker(bind=make_engine(SEARCH_DATABASE_URL))
+    _search_index.catch_up(
+        kv,
+        _search_sessions,
+        SEARCH_BATCH_SIZE,
+        deadline=time.monotonic() + SEARCH_JOB_BUDGET,
+    )
+
+
+@task("flush_reactions")
+def flush_reactions():
+    flush_reaction_changes(session_local, kv)
+
+
+periodic("purge_tombstoned_rooms", 3600)
+if MESSAGE_RETENTION_DAYS or any(ROOM_RETENTION_DAYS.values()):
+    periodic("retention", RETENTION_INTERVAL)
+periodic("search_index", SEARCH_POLL_INTERVAL)
+periodic("flush_reactions", REACTION_FLUSH_INTERVAL)
@@ -0,0 +1,297 @@
+# -------------------------
+# Tracing
+# -------------------------
+# Lightweight spans for HTTP requests and socket events. A root span is
+# opened per sampled request/event (TRACE_SAMPLE_RATE, or a sampled W3C
+# traceparent header) and the current span lives in a contextvar, which
+# gevent keeps per greenlet. Children come from span(), from SQLAlchemy
+# cursor events (instrument_engine) and from the lib.kv command hook.
+#
+# When the root ends the whole trace is written as one OTLP/JSON line to
+# TRACE_FILE through an AsyncSink, so no collector is needed; an
+# OpenTelemetry collector can ingest the file with its otlpjsonfile
+# receiver, and tools/trace_summary.py breaks it down offline.
+#
+# Outside a sampled trace every hook returns after one contextvar lookup.
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import request
+from sqlalchemy import event
+
+from config import (
+    LOG_FILE_BACKUPS,
+    LOG_FILE_MAX_BYTES,
+    LOG_QUEUE_SIZE,
+    TRACE_FILE,
+    TRACE_MAX_SPANS,
+    TRACE_SAMPLE_RATE,
+)
+from lib.kv import add_command_hook
+from lib.log_pipeline import AsyncSink, RotatingFileWriter
+
+SERVICE_NAME = "mivel-chat"
+# OTLP span kinds
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+_current: ContextVar = ContextVar("trace_span", default=None)
+_sink = None
+
+
+class Span:
+    __slots__ = (
+        "attributes",
+        "end_ns",
+        "error",
+        "kind",
+        "name",
+        "parent_id",
+        "span_id",
+        "start_ns",
+        "trace",
+    )
+
+    def __init__(self, trace, name, parent_id, kind, attributes, start_ns=None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def end(self, error=None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = str(error) or type(error).__name__
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            # 1 = OK, 2 = ERROR
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: list[Span] = []
+        self.dropped = 0
+
+    def start(self, name, parent_id, kind, attributes, start_ns=None) -> Span | None:
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return None
+        span = Span(self, name, parent_id, kind, attributes, start_ns)
+        self.spans.append(span)
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def parse_traceparent(header) -> tuple[str, str, bool] | None:
+    # version-traceid-parentid-flags, e.g. 00-<32 hex>-<16 hex>-01
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+# -------------------------
+# roots
+# -------------------------
+def start_root(name: str, traceparent=None, **attributes) -> Span | None:
+    parent = parse_traceparent(traceparent)
+    if parent:
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id = None, None
+        sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    if not sampled:
+        _current.set(None)
+        return None
+    trace = Trace(trace_id or os.urandom(16).hex())
+    root = trace.start(name, parent_id, KIND_SERVER, attributes)
+    _current.set(root)
+    return root
+
+
+def end_root(root: Span | None, error=None):
+    _current.set(None)
+    if root is None:
+        return
+    root.end(error)
+    if root.trace.dropped:
+        root.attributes["trace.dropped_spans"] = root.trace.dropped
+    _export(root.trace)
+
+
+def _export(trace: Trace):
+    global _sink
+    if _sink is None:
+        _sink = AsyncSink(
+            "traces",
+            RotatingFileWriter(TRACE_FILE, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUPS),
+            LOG_QUEUE_SIZE,
+        )
+    payload = {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        _otlp_attribute("service.name", SERVICE_NAME),
+                        _otlp_attribute("process.pid", os.getpid()),
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "lib.tracing"},
+                        "spans": [span.to_otlp() for span in trace.spans],
+                    }
+                ],
+            }
+        ]
+    }
+    _sink(json.dumps(payload, separators=(",", ":")) + "\n")
+
+
+def current_trace_id() -> str | None:
+    current = _current.get()
+    return current.trace.trace_id if current else None
+
+
+# -------------------------
+# children
+# -------------------------
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.trace.start(name, parent.span_id, kind, attributes)
+    if child is None:
+        yield None
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.error = str(e) or type(e).__name__
+        raise
+    finally:
+        child.end()
+        _current.reset(token)
+
+
+def record_span(name: str, seconds: float, kind: int = KIND_CLIENT, **attributes):
+    # for work timed elsewhere (e.g. the lib.kv hook), ending now
+    parent = _current.get()
+    if parent is None:
+        return
+    start_ns = time.time_ns() - int(seconds * 1e9)
+    child = parent.trace.start(name, parent.span_id, kind, attributes, start_ns)
+    if child is not None:
+        child.end()
+
+
+def traced_event(event_name: str):
+    # wraps a Socket.IO handler in a root span
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            root = start_root(f"socket {event_name}", sid=request.sid)
+            error = None
+            try:
+                return handler(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                end_root(root, error)
+
+        return wrapper
+
+    return decorator
+
+
+# -------------------------
+# instrumentation
+# -------------------------
+def instrument_engine(engine):
+    system = engine.dialect.name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        parent = _current.get()
+        if parent is None:
+            return
+        child = parent.trace.start(
+            "db.query",
+            parent.span_id,
+            KIND_CLIENT,
+            {"db.system": system, "db.statement": statement[:500]},
+        )
+        conn.info.setdefault("trace_spans", []).append(child)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        spans = conn.info.get("trace_spans")
+        if spans:
+            child = spans.pop()
+            if child is not None:
+                child.attributes["db.rows"] = cursor.rowcount
+                child.end()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        spans = (
+            context.connection.info.get("trace_spans") if context.connection else None
+        )
+        if spans:
+            child = spans.pop()
+            if child is not None:
+                child.end(context.original_exception)
+
+
+def _trace_redis(command: str, seconds: float):
+    record_span(f"redis {command}", seconds, **{"db.system": "redis"})
+
+
+add_command_hook(_trace_redis)
@@ -0,0 +1,155 @@
+# -------------------------
+# User directory
+# -------------------------
+# user_id -> {"username"} for putting names on messages and members without
+# joining users in every read. Three tiers, each asked only for what the one
+# before it missed:
+#
+#   process LRU     USER_CACHE_SIZE entries, trusted for USER_CACHE_LOCAL_TTL
+#   Redis           userdir:<user_id> (JSON), USER_CACHE_TTL, one MGET
+#   users table     one IN query; the rows found are written back up
+#
+# invalidate() clears an entry from Redis and this process's LRU. Other
+# processes pick up the change when their local copy goes stale, after
+# USER_CACHE_LOCAL_TTL seconds at most. Redis errors fall through to the
+# database.
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from loguru import logger
+from redis import RedisError
+from sqlalchemy import select
+
+import models
+from config import USER_CACHE_LOCAL_TTL, USER_CACHE_SIZE, USER_CACHE_TTL
+from lib.kv import create_kv
+from lib.metrics import USER_CACHE_LOOKUPS
+
+
+def user_key(user_id: str) -> str:
+    return f"userdir:{user_id}"
+
+
+class UserDirectory:
+    def __init__(
+        self,
+        kv,
+        size: int = USER_CACHE_SIZE,
+        local_ttl: float = USER_CACHE_LOCAL_TTL,
+        ttl: int = USER_CACHE_TTL,
+    ):
+        self.kv = kv
+        self.size = size
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        # user_id -> (stored_at, entry), oldest use first
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    # -- local tier --------------------------------------------------------
+    def _get_local(self, user_ids, now: float) -> dict:
+        found = {}
+        with self._lock:
+            for user_id in user_ids:
+                item = self._local.get(user_id)
+                if item is None:
+                    continue
+                if now - item[0] > self.local_ttl:
+                    del self._local[user_id]
+                    continue
+                self._local.move_to_end(user_id)
+                found[user_id] = item[1]
+        return found
+
+    def _put_local(self, entries: dict, now: float):
+        with self._lock:
+            for user_id, entry in entries.items():
+                self._local[user_id] = (now, entry)
+                self._local.move_to_end(user_id)
+            while len(self._local) > self.size:
+                self._local.popitem(last=False)
+
+    # -- lookups -----------------------------------------------------------
+    def get_many(self, db, user_ids) -> dict[str, dict]:
+        # {user_id: {"username"}}; ids that do not exist are left out
+        user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+        if not user_ids:
+            return {}
+        now = time.monotonic()
+        found = self._get_local(user_ids, now)
+        USER_CACHE_LOOKUPS.labels("local").inc(len(found))
+
+        missing = [user_id for user_id in user_ids if user_id not in found]
+        if missing:
+            from_redis = self._get_redis(missing)
+            USER_CACHE_LOOKUPS.labels("redis").inc(len(from_redis))
+            missing = [user_id for user_id in missing if user_id not in from_redis]
+            from_db = self._get_db(db, missing) if missing else {}
+            USER_CACHE_LOOKUPS.labels("db").inc(len(from_db))
+            self._set_redis(from_db)
+            self._put_local({**from_redis, **from_db}, now)
+            found.update(from_redis)
+            found.update(from_db)
+        return found
+
+    def get(self, db, user_id: str) -> dict | None:
+        return self.get_many(db, [user_id]).get(str(user_id))
+
+    def username(self, db, user_id: str) -> str | None:
+        entry = self.get(db, user_id)
+        return entry["username"] if entry else None
+
+    def usernames(self, db, user_ids) -> dict[str, str]:
+        return {
+            user_id: entry["username"]
+            for user_id, entry in self.get_many(db, user_ids).items()
+        }
+
+    def _get_redis(self, user_ids) -> dict:
+        try:
+            values = self.kv.mget([user_key(user_id) for user_id in user_ids])
+        except RedisError as e:
+            logger.warning("User directory Redis read failed", error=str(e))
+            return {}
+        return {
+            user_id: json.loads(value)
+            for user_id, value in zip(user_ids, values)
+            if value is not None
+        }
+
+    def _set_redis(self, entries: dict):
+        if not entries:
+            return
+        try:
+            pipe = self.kv.pipeline(transaction=False)
+            for user_id, entry in entries.items():
+                pipe.set(user_key(user_id), json.dumps(entry), ex=self.ttl)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning("User directory Redis write failed", error=str(e))
+
+    def _get_db(self, db, user_ids) -> dict:
+        rows = db.execute(
+            select(models.User.user_id, models.User.username).where(
+                models.User.user_id.in_(user_ids)
+            )
+        ).all()
+        return {str(user_id): {"username": username} for user_id, username in rows}
+
+    # -- changes -----------------------------------------------------------
+    def invalidate(self, *user_ids):
+        # call after committing a change to a user's row. Cached /members
+        # bodies embed usernames too, so bump those lists as well.
+        with self._lock:
+            for user_id in user_ids:
+                self._local.pop(str(user_id), None)
+        try:
+            self.kv.delete(*(user_key(user_id) for user_id in user_ids))
+        except RedisError as e:
+            logger.warning("User directory invalidation failed", error=str(e))
+
+
+# one per process, so the LRU is shared by every request and event
+users = UserDirectory(create_kv())
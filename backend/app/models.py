@@ -2,13 +2,27 @@
 from datetime import datetime, timezone
 from enum import Enum as EnumType
 
-import cuid2
 from db import Base
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+from lib.ids import CompactId, new_id
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    false,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import Enum
 
-cuid = cuid2.Cuid()
+
+# evaluated per row; passing datetime.now(...) directly would freeze the
+# timestamp at import time
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
 
 
 class MemberRole(EnumType):
@@ -20,16 +34,14 @@ class MemberRole(EnumType):
 
 class User(Base):
     __tablename__ = "users"
-    user_id = Column(
-        String(24), primary_key=True, nullable=False, unique=True, default=cuid.generate
-    )
+    user_id = Column(CompactId, primary_key=True, nullable=False, default=new_id)
     username = Column(String(255), nullable=False, unique=True)
     password_hash = Column(String(255), nullable=False)
-    date_created = Column(DateTime, default=datetime.now(timezone.utc))
+    date_created = Column(DateTime, default=utcnow)
     date_updated = Column(
         DateTime,
-        default=datetime.now(timezone.utc),
-        onupdate=datetime.now(timezone.utc),
+        default=utcnow,
+        onupdate=utcnow,
     )
     rooms = relationship(
         "Room_members", back_populates="user", cascade="all, delete-orphan"
@@ -41,19 +53,23 @@ class User(Base):
 
 class Room(Base):
     __tablename__ = "rooms"
-    room_id = Column(
-        String(24), primary_key=True, nullable=False, unique=True, default=cuid.generate
-    )
+    room_id = Column(CompactId, primary_key=True, nullable=False, default=new_id)
     room_name = Column(String(255), nullable=False, unique=False)
     room_description = Column(
         String(255), nullable=False, unique=False, default="A room"
     )
-    date_created = Column(DateTime, default=datetime.now(timezone.utc))
+    date_created = Column(DateTime, default=utcnow)
     date_updated = Column(
         DateTime,
-        default=datetime.now(timezone.utc),
-        onupdate=datetime.now(timezone.utc),
+        default=utcnow,
+        onupdate=utcnow,
     )
+    # tombstone: set when the room is deleted, the row itself is removed by
+    # lib.room_purge once its members and messages are gone
+    date_deleted = Column(DateTime, nullable=True)
+    # listed in the room directory; a private room is only found by its
+    # members
+    is_public = Column(Boolean, nullable=False, default=False, server_default=false())
     members = relationship(
         "Room_members", back_populates="room", cascade="all, delete-orphan"
     )
@@ -64,28 +80,56 @@ class Room(Base):
 
 class Room_members(Base):
     __tablename__ = "room_members"
+    __table_args__ = (
+        # member listing: one range scan per role segment, count() is
+        # index-only
+        Index("ix_room_members_room_role_user", "room_id", "member_role", "user_id"),
+        # membership checks and "my rooms"
+        Index("ix_room_members_user_room", "user_id", "room_id"),
+    )
     id = Column(Integer, primary_key=True)
-    user_id = Column(String(24), ForeignKey("users.user_id"), nullable=False)
-    room_id = Column(String(24), ForeignKey("rooms.room_id"), nullable=False)
+    user_id = Column(CompactId, ForeignKey("users.user_id"), nullable=False)
+    room_id = Column(CompactId, ForeignKey("rooms.room_id"), nullable=False)
     member_role = Column(
         Enum(MemberRole, name="member_role"), nullable=False, default=MemberRole.MEMBER
     )
-    join_date = Column(DateTime, default=datetime.now(timezone.utc))
+    join_date = Column(DateTime, default=utcnow)
     user = relationship("User", back_populates="rooms")
     room = relationship("Room", back_populates="members")
 
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # history pages, last message and unread counts per room
+        Index("ix_messages_room_id", "room_id", "id"),
+    )
     id = Column(Integer, primary_key=True)
-    sender = Column(String(24), ForeignKey("users.user_id"), nullable=False)
-    room_id = Column(String(24), ForeignKey("rooms.room_id"), nullable=False)
+    sender = Column(CompactId, ForeignKey("users.user_id"), nullable=False)
+    room_id = Column(CompactId, ForeignKey("rooms.room_id"), nullable=False)
     message = Column(Text, nullable=False)
-    date_created = Column(DateTime, default=datetime.now(timezone.utc))
+    # {"<emoji>": count} as JSON, written by the reaction flush so history
+    # reads get counts from the same row; NULL until the first reaction
+    reaction_counts = Column(Text, nullable=True)
+    date_created = Column(DateTime, default=utcnow)
     date_updated = Column(
         DateTime,
-        default=datetime.now(timezone.utc),
-        onupdate=datetime.now(timezone.utc),
+        default=utcnow,
+        onupdate=utcnow,
     )
     user = relationship("User", back_populates="messages")
     room = relationship("Room", back_populates="messages")
+
+
+class MessageReaction(Base):
+    # who reacted with what; written in batches by lib/reactions.py's flush,
+    # never per click
+    __tablename__ = "message_reactions"
+    message_id = Column(
+        Integer,
+        ForeignKey("messages.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    emoji = Column(String(32), primary_key=True)
+    user_id = Column(CompactId, primary_key=True)
+    date_created = Column(DateTime, default=utcnow)
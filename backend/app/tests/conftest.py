@@ -0,0 +1,39 @@
+# This work is licensed under the terms of the MIT license
+# tests/conftest.py
+#
+#   pip install -e ".[test]" && python -m pytest
+#
+# config.py reads the environment at import time; keep tests off MySQL,
+# Redis and the log file. App modules are imported inside fixtures and
+# tests, after this has run.
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", ":memory:")
+os.environ.setdefault("PUBSUB_BACKEND", "local")
+os.environ.setdefault("LOG_FILE", "")
+
+
+@pytest.fixture
+def db():
+    # a fresh in-memory database per test, with every table
+    import models  # noqa: F401
+    from db import Base
+
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
@@ -0,0 +1,145 @@
+# This work is licensed under the terms of the MIT license
+# tests/test_ids.py
+from datetime import datetime, timedelta, timezone
+
+import fakeredis
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, insert, select
+
+from lib.ids import (
+    ID_EPOCH_MS,
+    MAX_ID,
+    MAX_SEQUENCE,
+    MAX_WORKER_ID,
+    MIGRATION_WORKER_ID,
+    CompactId,
+    SnowflakeGenerator,
+    WorkerLease,
+    compose_id,
+    id_timestamp_ms,
+)
+
+
+# -------------------------
+# compose_id
+# -------------------------
+def test_compose_id_round_trips_the_timestamp():
+    ms = ID_EPOCH_MS + 123_456_789
+    value = compose_id(ms, 5, 7)
+    assert value > 0
+    assert id_timestamp_ms(value) == ms
+    assert id_timestamp_ms(str(value)) == ms
+
+
+def test_compose_id_orders_by_time_then_worker_then_sequence():
+    ms = ID_EPOCH_MS + 1000
+    assert compose_id(ms, MAX_WORKER_ID, MAX_SEQUENCE) < compose_id(ms + 1, 0, 0)
+    assert compose_id(ms, 1, MAX_SEQUENCE) < compose_id(ms, 2, 0)
+
+
+def test_compose_id_refuses_times_before_the_epoch():
+    with pytest.raises(ValueError):
+        compose_id(ID_EPOCH_MS - 1, 0, 0)
+
+
+# -------------------------
+# generate_at
+# -------------------------
+def test_generate_at_clamps_rows_older_than_the_epoch():
+    generator = SnowflakeGenerator(MIGRATION_WORKER_ID)
+    first = generator.generate_at(datetime(2023, 6, 1))
+    second = generator.generate_at(datetime(2020, 1, 1))
+    assert 0 < first < second
+    assert id_timestamp_ms(first) == ID_EPOCH_MS
+
+
+def test_generate_at_reads_naive_datetimes_as_utc():
+    naive = datetime(2025, 3, 1, 12, 0, 0)
+    aware = naive.replace(tzinfo=timezone.utc)
+    assert id_timestamp_ms(SnowflakeGenerator(1).generate_at(naive)) == int(
+        aware.timestamp() * 1000
+    )
+
+
+def test_generate_at_handles_missing_dates():
+    generator = SnowflakeGenerator(1)
+    assert id_timestamp_ms(generator.generate_at(None)) == ID_EPOCH_MS
+
+
+def test_generate_at_stays_unique_within_a_millisecond():
+    generator = SnowflakeGenerator(1)
+    when = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    ids = [generator.generate_at(when) for _ in range(MAX_SEQUENCE + 10)]
+    assert ids == sorted(set(ids))
+    # the sequence ran out and borrowed the next millisecond
+    later = when + timedelta(milliseconds=1)
+    assert id_timestamp_ms(ids[-1]) == int(later.timestamp() * 1000)
+
+
+# -------------------------
+# CompactId
+# -------------------------
+def test_compact_id_binds_strings_and_reads_strings():
+    column = CompactId()
+    value = compose_id(ID_EPOCH_MS + 42, 3, 1)
+    assert column.process_bind_param(str(value), None) == value
+    assert column.process_bind_param(value, None) == value
+    assert column.process_result_value(value, None) == str(value)
+    assert column.process_bind_param(None, None) is None
+    assert column.process_result_value(None, None) is None
+
+
+@pytest.mark.parametrize("raw", ["", "abc", "-1", "1.5", "١٢٣", str(MAX_ID + 1)])
+def test_compact_id_binds_invalid_ids_as_null(raw):
+    assert CompactId().process_bind_param(raw, None) is None
+
+
+def test_compact_id_round_trips_through_the_database():
+    metadata = MetaData()
+    table = Table(
+        "things",
+        metadata,
+        Column("pk", Integer, primary_key=True),
+        Column("thing_id", CompactId, nullable=False),
+    )
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    old = str(SnowflakeGenerator(MIGRATION_WORKER_ID).generate_at(datetime(2023, 6, 1)))
+    with engine.begin() as conn:
+        conn.execute(insert(table).values(thing_id=old))
+        found = conn.scalar(select(table.c.thing_id).where(table.c.thing_id == old))
+    assert found == old
+
+
+# -------------------------
+# worker leases
+# -------------------------
+def test_leases_are_unique_and_skip_the_migration_worker():
+    kv = fakeredis.FakeRedis()
+    kv.set("ids:worker:next", MAX_WORKER_ID - 2)
+    worker_ids = [WorkerLease(kv).get() for _ in range(5)]
+    assert len(set(worker_ids)) == 5
+    assert MIGRATION_WORKER_ID not in worker_ids
+
+
+def test_a_taken_slot_is_skipped():
+    kv = fakeredis.FakeRedis()
+    kv.set("ids:worker:1", "someone else")
+    assert WorkerLease(kv).get() == 2
+
+
+def test_a_forked_process_leases_its_own_worker_id():
+    kv = fakeredis.FakeRedis()
+    lease = WorkerLease(kv)
+    parent = lease.get()
+    lease._pid = -1  # what the child sees after os.fork()
+    assert lease.get() != parent
+
+
+def test_a_lost_lease_is_replaced(monkeypatch):
+    kv = fakeredis.FakeRedis()
+    lease = WorkerLease(kv)
+    first = lease.get()
+    kv.set(f"ids:worker:{first}", "someone else")
+    monkeypatch.setattr(lease, "_renewed", lease._renewed - 25)
+    assert lease.get() != first
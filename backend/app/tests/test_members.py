@@ -0,0 +1,117 @@
+# This work is licensed under the terms of the MIT license
+# tests/test_members.py
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import models
+from lib.members import (
+    InvalidQuery,
+    count_members,
+    encode_cursor,
+    list_members_page,
+    wants_page,
+)
+from models import MemberRole
+
+
+@pytest.fixture
+def room(db):
+    # created in this order, so user_ids (the order inside a role) follow it
+    room = models.Room(room_name="general")
+    db.add(room)
+    db.flush()
+    roles = {
+        "olga": MemberRole.OWNER,
+        "ada": MemberRole.ADMIN,
+        "alan": MemberRole.ADMIN,
+        "mia": MemberRole.MEMBER,
+        "max": MemberRole.MEMBER,
+        "mo": MemberRole.MEMBER,
+        "bea": MemberRole.BANNED,
+    }
+    for username, role in roles.items():
+        user = models.User(username=username, password_hash="x")
+        db.add(user)
+        db.flush()
+        db.add(
+            models.Room_members(
+                room_id=room.room_id, user_id=user.user_id, member_role=role
+            )
+        )
+    db.commit()
+    return room.room_id
+
+
+def all_pages(db, room_id, **args):
+    names, cursor = [], None
+    while True:
+        query = {**args, **({"cursor": cursor} if cursor else {})}
+        page = list_members_page(db, room_id, MultiDict(query))
+        names.append([member["username"] for member in page["members"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return names
+
+
+def test_pages_walk_the_role_segments_in_order(db, room):
+    # owners, admins, members; a page may span two segments
+    assert all_pages(db, room, limit="2") == [
+        ["olga", "ada"],
+        ["alan", "mia"],
+        ["max", "mo"],
+    ]
+
+
+def test_banned_members_only_on_request(db, room):
+    assert all_pages(db, room) == [["olga", "ada", "alan", "mia", "max", "mo"]]
+    assert all_pages(db, room, role="banned") == [["bea"]]
+    assert all_pages(db, room, role="admin,owner", limit="1") == [
+        ["olga"],
+        ["ada"],
+        ["alan"],
+    ]
+
+
+def test_username_prefix_pages_by_username(db, room):
+    assert all_pages(db, room, q="m", limit="2") == [["max", "mia"], ["mo"]]
+    assert all_pages(db, room, q="a") == [["ada", "alan"]]
+
+
+def test_count_members_groups_by_role(db, room):
+    assert count_members(db, room) == {
+        "total": 6,
+        "roles": {"OWNER": 1, "ADMIN": 2, "MEMBER": 3, "BANNED": 1},
+    }
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64 !",
+        encode_cursor("x", "MEMBER", "1"),
+        encode_cursor("r", ["MEMBER"], "1"),
+        encode_cursor("r", {"MEMBER": 1}, "1"),
+        encode_cursor("r", "NOBODY", "1"),
+        encode_cursor("r", "MEMBER", "abc"),
+        encode_cursor("r", "BANNED", "1"),
+    ],
+)
+def test_invalid_role_cursor_is_rejected(db, room, cursor):
+    with pytest.raises(InvalidQuery):
+        list_members_page(db, room, MultiDict({"cursor": cursor}))
+
+
+def test_invalid_username_cursor_is_rejected(db, room):
+    for cursor in (encode_cursor("r", "MEMBER", "1"), encode_cursor("u", 5)):
+        with pytest.raises(InvalidQuery):
+            list_members_page(db, room, MultiDict({"q": "m", "cursor": cursor}))
+
+
+def test_page_params_ask_for_a_page():
+    for param in ("limit", "cursor", "role", "q"):
+        assert wants_page(MultiDict({param: ""}))
+
+
+def test_other_params_keep_the_whole_list():
+    assert not wants_page(MultiDict())
+    assert not wants_page(MultiDict({"_": "1700000000", "utm_source": "mail"}))
@@ -0,0 +1,37 @@
+# This work is licensed under the terms of the MIT license
+# tests/test_messages.py
+import models
+from lib.helper import insert_message, recent_messages
+from lib.room_purge import tombstone_room
+
+
+def make_room(db):
+    user = models.User(username="alice", password_hash="x")
+    room = models.Room(room_name="general")
+    db.add_all([user, room])
+    db.commit()
+    return user.user_id, room.room_id
+
+
+def test_insert_message_returns_the_new_id(db):
+    sender, room_id = make_room(db)
+    first = insert_message(db, sender, room_id, "<p>one</p>")
+    second = insert_message(db, sender, room_id, "<p>two</p>")
+    assert first is not None and second is not None
+    assert second[0] > first[0]
+    assert [m["message"] for m in recent_messages(db, room_id)] == [
+        "<p>one</p>",
+        "<p>two</p>",
+    ]
+
+
+def test_insert_message_refuses_a_tombstoned_room(db):
+    sender, room_id = make_room(db)
+    tombstone_room(db, room_id)
+    assert insert_message(db, sender, room_id, "<p>late</p>") is None
+    assert db.query(models.Message).count() == 0
+
+
+def test_insert_message_refuses_an_unknown_room(db):
+    sender, _ = make_room(db)
+    assert insert_message(db, sender, "12345", "<p>nowhere</p>") is None
@@ -0,0 +1,98 @@
+# This work is licensed under the terms of the MIT license
+# tests/test_reactions.py
+import json
+
+import fakeredis
+import pytest
+
+import models
+from config import REACTION_KEY_TTL
+from lib import reactions
+from lib.helper import insert_message
+
+
+@pytest.fixture
+def kv():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def message(db):
+    user = models.User(username="alice", password_hash="x")
+    room = models.Room(room_name="general")
+    db.add_all([user, room])
+    db.commit()
+    message_id, _ = insert_message(db, user.user_id, room.room_id, "<p>hi</p>")
+    return message_id, room.room_id
+
+
+def click(db, kv, message_id, user_id, emoji="👍", add=True):
+    reactions.message_room(db, kv, message_id)
+    return reactions.react(kv, user_id, message_id, emoji, add)
+
+
+def test_a_user_counts_once(db, kv, message):
+    message_id, room_id = message
+    assert reactions.message_room(db, kv, message_id) == room_id
+    assert click(db, kv, message_id, "1") == (True, 1)
+    assert click(db, kv, message_id, "1") == (False, 1)
+    assert click(db, kv, message_id, "2") == (True, 2)
+    assert click(db, kv, message_id, "1", add=False) == (True, 1)
+    assert click(db, kv, message_id, "1", add=False) == (False, 1)
+    assert reactions.fetch_counts(kv, [message_id]) == {message_id: {"👍": 1}}
+
+
+def test_unknown_messages_have_no_room(db, kv):
+    assert reactions.message_room(db, kv, 404) is None
+
+
+def test_keys_expire_and_clicks_refresh_them(db, kv, message):
+    message_id, _ = message
+    click(db, kv, message_id, "1")
+    counts_ttl = kv.ttl(reactions.counts_key(message_id))
+    who_ttl = kv.ttl(reactions.who_key(message_id))
+    assert 0 < counts_ttl <= REACTION_KEY_TTL
+    # the who set outlives the counts, so a reseed never meets a stale one
+    assert who_ttl > counts_ttl
+    kv.expire(reactions.counts_key(message_id), 10)
+    click(db, kv, message_id, "1")
+    assert kv.ttl(reactions.counts_key(message_id)) > 10
+
+
+def test_flush_writes_rows_and_counts(db, kv, message):
+    message_id, _ = message
+    click(db, kv, message_id, "1")
+    click(db, kv, message_id, "2")
+    click(db, kv, message_id, "2", emoji="🎉")
+    click(db, kv, message_id, "2", emoji="🎉", add=False)
+    result = reactions.flush(lambda: db, kv)
+    assert result == {"ops": 4, "messages": 1}
+    rows = db.query(models.MessageReaction.user_id, models.MessageReaction.emoji)
+    assert sorted(rows.all()) == [("1", "👍"), ("2", "👍")]
+    db.expire_all()
+    counts = db.get(models.Message, message_id).reaction_counts
+    assert json.loads(counts) == {"👍": 2}
+    assert reactions.flush(lambda: db, kv) == {"ops": 0, "messages": 0}
+
+
+def test_expired_keys_are_seeded_from_the_database(db, kv, message):
+    message_id, _ = message
+    click(db, kv, message_id, "1")
+    click(db, kv, message_id, "2")
+    reactions.flush(lambda: db, kv)
+    kv.delete(reactions.counts_key(message_id), reactions.who_key(message_id))
+    # already counted before the keys expired
+    assert click(db, kv, message_id, "1") == (False, 2)
+    assert click(db, kv, message_id, "3") == (True, 3)
+
+
+def test_flush_keeps_database_counts_when_keys_are_gone(db, kv, message):
+    message_id, _ = message
+    click(db, kv, message_id, "1")
+    reactions.flush(lambda: db, kv)
+    click(db, kv, message_id, "2")
+    kv.delete(reactions.counts_key(message_id))
+    reactions.flush(lambda: db, kv)
+    db.expire_all()
+    counts = db.get(models.Message, message_id).reaction_counts
+    assert json.loads(counts) == {"👍": 1}
@@ -0,0 +1,40 @@
+# This work is licensed under the terms of the MIT license
+# tests/test_read_markers.py
+import models
+from lib.helper import insert_message
+from lib.read_markers import UNREAD_CAP, UNREAD_OVERFLOW, unread_counts
+
+
+def make_rooms(db):
+    alice = models.User(username="alice", password_hash="x")
+    bob = models.User(username="bob", password_hash="x")
+    quiet = models.Room(room_name="quiet")
+    busy = models.Room(room_name="busy")
+    db.add_all([alice, bob, quiet, busy])
+    db.commit()
+    return alice.user_id, bob.user_id, quiet.room_id, busy.room_id
+
+
+def test_unread_counts_skip_own_and_read_messages(db):
+    alice, bob, quiet, _ = make_rooms(db)
+    seen, _ = insert_message(db, bob, quiet, "<p>seen</p>")
+    insert_message(db, bob, quiet, "<p>new</p>")
+    insert_message(db, alice, quiet, "<p>mine</p>")
+    assert unread_counts(db, alice, {quiet: seen}) == {quiet: 1}
+
+
+def test_unread_counts_stop_at_the_cap(db):
+    alice, bob, quiet, busy = make_rooms(db)
+    for i in range(UNREAD_CAP + 5):
+        insert_message(db, bob, busy, f"<p>{i}</p>")
+    for i in range(UNREAD_CAP - 1):
+        insert_message(db, bob, quiet, f"<p>{i}</p>")
+    assert unread_counts(db, alice, {quiet: 0, busy: 0}) == {
+        quiet: UNREAD_CAP - 1,
+        busy: UNREAD_OVERFLOW,
+    }
+
+
+def test_unread_counts_without_markers(db):
+    alice, _, _, _ = make_rooms(db)
+    assert unread_counts(db, alice, {}) == {}
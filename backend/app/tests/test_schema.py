@@ -0,0 +1,38 @@
+# This work is licensed under the terms of the MIT license
+# tests/test_schema.py
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from tools import add_columns
+
+
+@pytest.fixture
+def old_engine(monkeypatch):
+    # a rooms table from before room tombstones
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE rooms (room_id VARCHAR(20) PRIMARY KEY, "
+                "room_name VARCHAR(255), room_description VARCHAR(255), "
+                "date_created DATETIME, date_updated DATETIME)"
+            )
+        )
+    monkeypatch.setattr(add_columns, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+def test_add_columns_upgrades_an_existing_table(old_engine):
+    assert any(
+        line.startswith("rooms: date_deleted")
+        for line in add_columns.add_columns(dry_run=True)
+    )
+    assert "date_deleted" not in column_names(old_engine)
+    add_columns.add_columns()
+    assert "date_deleted" in column_names(old_engine)
+    assert add_columns.add_columns() == []
+
+
+def column_names(engine):
+    return {column["name"] for column in inspect(engine).get_columns("rooms")}
@@ -0,0 +1,32 @@
+# This work is licensed under the terms of the MIT license
+# tests/test_tasks.py
+import fakeredis
+import pytest
+
+from lib import tasks
+from lib.jobs import enqueue
+from lib.room_purge import job_key
+
+
+@pytest.fixture
+def kv(monkeypatch):
+    kv = fakeredis.FakeRedis()
+    monkeypatch.setattr(tasks, "kv", kv)
+    return kv
+
+
+def test_unfinished_purge_can_be_enqueued_again(kv, monkeypatch):
+    # another worker held the room's purge lock
+    monkeypatch.setattr(tasks, "purge_room_rows", lambda *args: False)
+    assert enqueue(kv, "purge_room", {"room_id": "1"}, idempotency_key=job_key("1"))
+    tasks.purge_room("1")
+    assert enqueue(kv, "purge_room", {"room_id": "1"}, idempotency_key=job_key("1"))
+
+
+def test_failed_purge_keeps_its_key_for_the_retry(kv, monkeypatch):
+    monkeypatch.setattr(tasks, "purge_room_rows", lambda *args: False)
+    kv.hset("room_purge:1", "status", "failed")
+    enqueue(kv, "purge_room", {"room_id": "1"}, idempotency_key=job_key("1"))
+    with pytest.raises(RuntimeError):
+        tasks.purge_room("1")
+    assert not enqueue(kv, "purge_room", {"room_id": "1"}, idempotency_key=job_key("1"))
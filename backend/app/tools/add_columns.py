@@ -0,0 +1,49 @@
+# This work is licensed under the terms of the MIT license
+# tools/add_columns.py
+#
+# Adds the columns declared in models.py that an existing database is
+# missing (e.g. rooms.is_public). Like tools/create_indexes.py, this covers
+# what init_db()'s create_all() leaves out for tables that already exist. New
+# columns must be nullable or have a server_default. tools/init_db.py runs
+# this on every deployment.
+#
+#   python -m tools.add_columns [--dry-run]
+import argparse
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+import models  # noqa: F401  (registers the tables on Base.metadata)
+from db import Base, engine
+
+
+def add_columns(dry_run: bool = False) -> list[str]:
+    # "table: column spec" for each column added (or, dry run, missing)
+    added = []
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            spec = CreateColumn(column).compile(dialect=engine.dialect)
+            added.append(f"{table.name}: {spec}")
+            if not dry_run:
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {spec}"))
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="only list them")
+    args = parser.parse_args()
+
+    for line in add_columns(args.dry_run):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# This work is licensed under the terms of the MIT license
+# tools/build_directory.py
+#
+# Rebuilds the room and user directory (lib/directory.py) from the
+# database: once after upgrading, and whenever Redis lost it. Searches keep
+# working on the old index until the new one is swapped in.
+#
+#   python -m tools.build_directory [--batch-size 5000]
+import argparse
+
+from db import session_local
+from lib.directory import rebuild
+from lib.kv import connect_kv
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    db = session_local()
+    try:
+        counts = rebuild(db, connect_kv(), args.batch_size)
+    finally:
+        db.close()
+    for key, count in counts.items():
+        print(f"{key}: {count} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# This work is licensed under the terms of the MIT license
+# tools/create_indexes.py
+#
+# Creates the indexes declared in models.py that an existing database is
+# missing. init_db()'s create_all() only creates missing tables, so indexes
+# added to a table that already exists have to be created here once.
+# tools/init_db.py runs this on every deployment.
+#
+#   python -m tools.create_indexes [--dry-run]
+import argparse
+
+from sqlalchemy import inspect
+
+import models  # noqa: F401  (registers the tables on Base.metadata)
+from db import Base, engine
+
+
+def create_indexes(dry_run: bool = False) -> list[str]:
+    # "table: index" for each index created (or, dry run, missing)
+    created = []
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            created.append(f"{table.name}: {index.name}")
+            if not dry_run:
+                index.create(bind=engine)
+    return created
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="only list them")
+    args = parser.parse_args()
+
+    for line in create_indexes(args.dry_run):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# This work is licensed under the terms of the MIT license
+# tools/export_room.py
+#
+# Writes a room's messages to a gzip-compressed NDJSON file, the same format
+# as GET /room/<room_id>/export (lib/export.py). An interrupted export is
+# continued with --resume: the file is cut back to its last complete gzip
+# member and the export goes on after the last id in it.
+#
+#   python -m tools.export_room ROOM_ID [-o room.ndjson.gz] [--resume]
+import argparse
+import os
+import sys
+
+from config import EXPORT_BATCH_SIZE
+from db import session_local
+from lib.export import export_batches, gzip_members, scan_export
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("room_id")
+    parser.add_argument("-o", "--output", help="default: room-<room_id>.ndjson.gz")
+    parser.add_argument("--after-id", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument(
+        "--resume", action="store_true", help="continue an interrupted export"
+    )
+    args = parser.parse_args()
+    path = args.output or f"room-{args.room_id}.ndjson.gz"
+
+    after_id = args.after_id
+    mode = "wb"
+    if args.resume and os.path.exists(path):
+        with open(path, "rb") as f:
+            offset, last_id, complete = scan_export(f)
+        if complete:
+            print(f"{path} is already complete")
+            return
+        after_id = last_id if last_id is not None else after_id
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+        mode = "ab"
+        print(f"resuming {path} after message {after_id}", file=sys.stderr)
+
+    written = 0
+    with open(path, mode) as f:
+        batches = export_batches(
+            session_local, args.room_id, after_id, batch_size=args.batch_size
+        )
+        for member in gzip_members(batches):
+            f.write(member)
+            written += len(member)
+    print(f"wrote {written} bytes to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# This work is licensed under the terms of the MIT license
+# tools/init_db.py
+#
+# Brings the database up to models.py: creates the missing tables, then adds
+# the columns and indexes missing from tables that already exist
+# (tools/add_columns.py, tools/create_indexes.py), e.g. rooms.date_deleted on
+# a database from before room tombstones. Run it once per deployment, before
+# the app and worker.py start (docker-compose's migrate service does); app
+# processes only check that the database answers.
+#
+#   python -m tools.init_db [--wait SECONDS]
+import argparse
+import time
+
+from loguru import logger
+from sqlalchemy.exc import OperationalError
+
+from db import init_db
+from tools.add_columns import add_columns
+from tools.create_indexes import create_indexes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--wait",
+        type=float,
+        default=0,
+        help="keep retrying this many seconds while the database is not up yet",
+    )
+    args = parser.parse_args()
+
+    deadline = time.monotonic() + args.wait
+    while True:
+        try:
+            init_db()
+            break
+        except OperationalError as e:
+            if time.monotonic() >= deadline:
+                raise
+            logger.warning("Database not ready, retrying", error=str(e))
+            time.sleep(2)
+    # columns first: a new index may be on a new column
+    for column in add_columns():
+        logger.info("Column added", column=column)
+    for index in create_indexes():
+        logger.info("Index created", index=index)
+    logger.info("Database schema ready")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# This work is licensed under the terms of the MIT license
+# tools/migrate_compact_ids.py
+#
+# Rewrites the cuid2 VARCHAR(24) keys of an existing MySQL/MariaDB database to
+# the BIGINT ids from lib/ids.py. Every phase works in bounded batches and can
+# be re-run after an interruption; already migrated rows are skipped.
+#
+#   python -m tools.migrate_compact_ids --phase assign
+#   python -m tools.migrate_compact_ids --phase rewrite
+#   python -m tools.migrate_compact_ids --phase swap     # maintenance window
+#
+# After the swap, issued JWTs still carry the old string ids in `sub`, so
+# every client has to log in again.
+import argparse
+import time
+
+from loguru import logger
+from sqlalchemy import text
+
+from db import engine
+from lib.ids import MIGRATION_WORKER_ID, SnowflakeGenerator, id_timestamp_ms
+
+# (table, old key column, new key column)
+KEY_TABLES = [
+    ("users", "user_id", "new_id"),
+    ("rooms", "room_id", "new_id"),
+]
+
+# (table, [(old column, new column, referenced table)])
+REFERENCING_TABLES = [
+    (
+        "room_members",
+        [("user_id", "new_user_id", "users"), ("room_id", "new_room_id", "rooms")],
+    ),
+    (
+        "messages",
+        [("sender", "new_sender", "users"), ("room_id", "new_room_id", "rooms")],
+    ),
+]
+
+
+def column_exists(conn, table: str, column: str) -> bool:
+    return bool(
+        conn.execute(
+            text(
+                "SELECT COUNT(*) FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() "
+                "AND TABLE_NAME = :table AND COLUMN_NAME = :column"
+            ),
+            {"table": table, "column": column},
+        ).scalar()
+    )
+
+
+def column_type(conn, table: str, column: str) -> str | None:
+    return conn.execute(
+        text(
+            "SELECT DATA_TYPE FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() "
+            "AND TABLE_NAME = :table AND COLUMN_NAME = :column"
+        ),
+        {"table": table, "column": column},
+    ).scalar()
+
+
+def foreign_keys(conn, table: str) -> list[str]:
+    rows = conn.execute(
+        text(
+            "SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS "
+            "WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+        ),
+        {"table": table},
+    ).all()
+    return [name for (name,) in rows]
+
+
+# -------------------------
+# phase 1: mint new ids
+# -------------------------
+def assign_ids(batch_size: int, pause: float):
+    for table, old_column, new_column in KEY_TABLES:
+        with engine.begin() as conn:
+            if column_type(conn, table, old_column) == "bigint":
+                logger.info("Already swapped, skipping", table=table)
+                continue
+            if not column_exists(conn, table, new_column):
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {table} ADD COLUMN {new_column} BIGINT NULL, "
+                        f"ADD UNIQUE KEY ux_{table}_{new_column} ({new_column})"
+                    )
+                )
+
+        generator = SnowflakeGenerator(MIGRATION_WORKER_ID)
+        with engine.connect() as conn:
+            last_id = conn.execute(
+                text(f"SELECT MAX({new_column}) FROM {table}")
+            ).scalar()
+        if last_id is not None:
+            # resume strictly after the last id minted by a previous run
+            generator.next_for(id_timestamp_ms(last_id))
+
+        migrated = 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    text(
+                        f"SELECT {old_column}, date_created FROM {table} "
+                        f"WHERE {new_column} IS NULL "
+                        f"ORDER BY date_created, {old_column} LIMIT :limit"
+                    ),
+                    {"limit": batch_size},
+                ).all()
+                if not rows:
+                    break
+                conn.execute(
+                    text(
+                        f"UPDATE {table} SET {new_column} = :new_id "
+                        f"WHERE {old_column} = :old_id"
+                    ),
+                    [
+                        # generate_at() takes care of old and missing dates
+                        {"old_id": old_id, "new_id": generator.generate_at(created)}
+                        for old_id, created in rows
+                    ],
+                )
+            migrated += len(rows)
+            logger.info("Assigned ids", table=table, migrated=migrated)
+            time.sleep(pause)
+
+
+# -------------------------
+# phase 2: rewrite foreign keys
+# -------------------------
+def rewrite_references(batch_size: int, pause: float):
+    for table, columns in REFERENCING_TABLES:
+        with engine.begin() as conn:
+            if column_type(conn, table, columns[0][0]) == "bigint":
+                logger.info("Already swapped, skipping", table=table)
+                continue
+            for _, new_column, _ in columns:
+                if not column_exists(conn, table, new_column):
+                    conn.execute(
+                        text(f"ALTER TABLE {table} ADD COLUMN {new_column} BIGINT NULL")
+                    )
+            max_id = conn.execute(text(f"SELECT MAX(id) FROM {table}")).scalar() or 0
+
+        joins = " ".join(
+            f"JOIN {ref} r{i} ON r{i}.{ref[:-1]}_id = t.{old}"
+            for i, (old, _, ref) in enumerate(columns)
+        )
+        assignments = ", ".join(
+            f"t.{new} = r{i}.new_id" for i, (_, new, _) in enumerate(columns)
+        )
+        pending = " OR ".join(f"t.{new} IS NULL" for _, new, _ in columns)
+
+        # walk the clustered index in id ranges so each UPDATE locks a
+        # bounded slice, and rows done by an earlier run are cheap to skip
+        low = 0
+        while low < max_id:
+            high = low + batch_size
+            with engine.begin() as conn:
+                result = conn.execute(
+                    text(
+                        f"UPDATE {table} t {joins} SET {assignments} "
+                        f"WHERE t.id > :low AND t.id <= :high AND ({pending})"
+                    ),
+                    {"low": low, "high": high},
+                )
+            logger.info(
+                "Rewrote references",
+                table=table,
+                upto=min(high, max_id),
+                of=max_id,
+                rows=result.rowcount,
+            )
+            low = high
+            time.sleep(pause)
+
+
+# -------------------------
+# phase 3: swap columns
+# -------------------------
+def swap_columns():
+    with engine.begin() as conn:
+        pending_columns = [(table, new) for table, _, new in KEY_TABLES] + [
+            (table, new)
+            for table, columns in REFERENCING_TABLES
+            for _, new, _ in columns
+        ]
+        for table, new_column in pending_columns:
+            if not column_exists(conn, table, new_column):
+                continue
+            missing = conn.execute(
+                text(f"SELECT COUNT(*) FROM {table} WHERE {new_column} IS NULL")
+            ).scalar()
+            if missing:
+                raise RuntimeError(
+                    f"{missing} rows in {table} still lack {new_column}; "
+                    "re-run the assign and rewrite phases first"
+                )
+
+        for table, columns in REFERENCING_TABLES:
+            if column_type(conn, table, columns[0][0]) == "bigint":
+                continue
+            for name in foreign_keys(conn, table):
+                conn.execute(text(f"ALTER TABLE {table} DROP FOREIGN KEY {name}"))
+
+        for table, old_column, new_column in KEY_TABLES:
+            if column_type(conn, table, old_column) == "bigint":
+                continue
+            conn.execute(
+                text(
+                    f"ALTER TABLE {table} DROP PRIMARY KEY, DROP COLUMN {old_column}, "
+                    f"DROP INDEX ux_{table}_{new_column}, "
+                    f"CHANGE {new_column} {old_column} BIGINT NOT NULL, "
+                    f"ADD PRIMARY KEY ({old_column})"
+                )
+            )
+
+        for table, columns in REFERENCING_TABLES:
+            if column_type(conn, table, columns[0][0]) == "bigint":
+                continue
+            changes = []
+            for old, new, ref in columns:
+                changes += [
+                    f"DROP COLUMN {old}",
+                    f"CHANGE {new} {old} BIGINT NOT NULL",
+                ]
+            conn.execute(text(f"ALTER TABLE {table} {', '.join(changes)}"))
+            conn.execute(
+                text(
+                    f"ALTER TABLE {table} "
+                    + ", ".join(
+                        f"ADD FOREIGN KEY ({old}) REFERENCES {ref} ({ref[:-1]}_id)"
+                        for old, _, ref in columns
+                    )
+                )
+            )
+    logger.info("Swapped key columns")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--phase", choices=["assign", "rewrite", "swap", "all"], default="all"
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument(
+        "--pause", type=float, default=0.05, help="seconds to sleep between batches"
+    )
+    args = parser.parse_args()
+
+    if args.phase in ("assign", "all"):
+        assign_ids(args.batch_size, args.pause)
+    if args.phase in ("rewrite", "all"):
+        rewrite_references(args.batch_size, args.pause)
+    if args.phase in ("swap", "all"):
+        swap_columns()
+
+
+if __name__ == "__main__":
+    main()
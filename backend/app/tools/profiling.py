@@ -0,0 +1,62 @@
+# This work is licensed under the terms of the MIT license
+# tools/profiling.py
+#
+# Switches sampled profiling on or off for every worker.
+#
+#   # write the Redis flag directly
+#   python -m tools.profiling --fraction 0.05 --duration 300
+#   # or go through the signed admin endpoint (needs PROFILING_SECRET)
+#   python -m tools.profiling --url http://localhost:5000 --fraction 0.05
+#   # off
+#   python -m tools.profiling --fraction 0
+#
+# Profiles land in PROFILE_DIR on the worker that served the request; render
+# them with flamegraph.pl or load them into speedscope.
+import argparse
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from config import PROFILING_SECRET
+from lib.kv import connect_kv
+from lib.profiling import Profiler, sign
+
+
+def post_signed(url: str, fraction: float, duration: float) -> dict:
+    if not PROFILING_SECRET:
+        sys.exit("PROFILING_SECRET is not set")
+    body = json.dumps({"fraction": fraction, "duration": duration}).encode()
+    timestamp = str(time.time())
+    req = urllib.request.Request(
+        f"{url}/admin/profiling",
+        data=body,
+        headers={
+            "Content-Type": "application/json",
+            "X-Timestamp": timestamp,
+            "X-Signature": sign(PROFILING_SECRET, timestamp, body),
+        },
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        sys.exit(f"{e.code}: {e.read().decode()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fraction", type=float, required=True)
+    parser.add_argument("--duration", type=float, default=300, help="seconds")
+    parser.add_argument("--url", help="use the admin endpoint of this server")
+    args = parser.parse_args()
+
+    if args.url:
+        print(post_signed(args.url, args.fraction, args.duration))
+    else:
+        print(Profiler(connect_kv()).enable(args.fraction, args.duration))
+
+
+if __name__ == "__main__":
+    main()
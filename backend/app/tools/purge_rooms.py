@@ -0,0 +1,34 @@
+# This work is licensed under the terms of the MIT license
+# tools/purge_rooms.py
+#
+# Finishes the purge of every tombstoned room, e.g. after a worker died
+# mid-purge. Safe to run while the app is serving; rooms that are already
+# being purged elsewhere are skipped.
+#
+#   python -m tools.purge_rooms [--room ROOM_ID] [--batch-size 1000]
+import argparse
+
+from config import ROOM_PURGE_BATCH_SIZE, ROOM_PURGE_PAUSE
+from db import session_local
+from lib.kv import connect_kv
+from lib.room_purge import get_purge_progress, purge_room, purge_tombstoned_rooms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--room", help="purge a single tombstoned room")
+    parser.add_argument("--batch-size", type=int, default=ROOM_PURGE_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=ROOM_PURGE_PAUSE)
+    args = parser.parse_args()
+
+    kv = connect_kv()
+    options = {"batch_size": args.batch_size, "pause": args.pause}
+    if args.room:
+        purge_room(session_local, kv, args.room, **options)
+        print(get_purge_progress(kv, args.room))
+    else:
+        print(f"purged {purge_tombstoned_rooms(session_local, kv, **options)} rooms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# This work is licensed under the terms of the MIT license
+# tools/retention.py
+#
+# Runs the message retention purge (lib/retention.py) every
+# RETENTION_INTERVAL seconds, or once. Only one purge runs at a time across
+# all hosts; a second process waits for the next interval.
+#
+#   python -m tools.retention --once
+#   python -m tools.retention --metrics-port 9102   # serve /metrics too
+import argparse
+import time
+
+from prometheus_client import start_http_server
+
+from config import RETENTION_BATCH_SIZE, RETENTION_INTERVAL, RETENTION_PAUSE
+from db import session_local
+from lib.kv import connect_kv
+from lib.retention import run_retention
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=RETENTION_PAUSE)
+    parser.add_argument("--metrics-port", type=int, help="expose Prometheus metrics")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    kv = connect_kv()
+    while True:
+        deleted = run_retention(
+            session_local, kv, batch_size=args.batch_size, pause=args.pause
+        )
+        print(f"deleted {deleted or 0} messages", flush=True)
+        if args.once:
+            return
+        time.sleep(RETENTION_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# This work is licensed under the terms of the MIT license
+# tools/search_indexer.py
+#
+# Keeps the message search index (lib/search.py) up to date. Drains the
+# search:queue fed by send_message and tails the messages table by primary
+# key, so the same loop backfills an empty index. Drops the messages that
+# purges queue on search:deleted. Run exactly one per index
+# file, on the host (or volume) the app workers read it from.
+#
+#   python -m tools.search_indexer                # run forever
+#   python -m tools.search_indexer --once         # catch up, then exit
+#   python -m tools.search_indexer --rebuild      # drop the index first
+import argparse
+import os
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from config import (
+    SEARCH_BATCH_SIZE,
+    SEARCH_DATABASE_URL,
+    SEARCH_INDEX_PATH,
+    SEARCH_POLL_INTERVAL,
+)
+from db import make_engine, session_local
+from lib.kv import connect_kv
+from lib.search import SearchIndex, index_status
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default=SEARCH_INDEX_PATH)
+    parser.add_argument("--batch-size", type=int, default=SEARCH_BATCH_SIZE)
+    parser.add_argument("--once", action="store_true", help="exit when caught up")
+    parser.add_argument("--rebuild", action="store_true", help="start from scratch")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+
+    session_factory = session_local
+    if SEARCH_DATABASE_URL:
+        session_factory = sessionmaker(bind=make_engine(SEARCH_DATABASE_URL))
+
+    kv = connect_kv()
+    index = SearchIndex(args.path)
+    while True:
+        indexed = index.catch_up(kv, session_factory, args.batch_size)
+        if indexed or args.once:
+            status = index_status(kv, args.path)
+            print(
+                f"caught up: {indexed} messages, "
+                f"watermark {index.get_meta('watermark')}, "
+                f"{status['queued']} queued",
+                flush=True,
+            )
+        if args.once:
+            return
+        time.sleep(SEARCH_POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
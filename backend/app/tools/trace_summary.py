@@ -0,0 +1,67 @@
+# This work is licensed under the terms of the MIT license
+# tools/trace_summary.py
+#
+# Per-phase latency breakdown of the traces written by lib/tracing.py.
+# For every root (route or socket event) it lists each span name with its
+# count, p50/p99 duration and share of the root's total time.
+#
+#   python -m tools.trace_summary traces/spans.jsonl
+#   python -m tools.trace_summary traces/spans.jsonl --root "socket send_message"
+import argparse
+import json
+import statistics
+from collections import defaultdict
+
+
+def load_traces(path: str):
+    with open(path) as f:
+        for line in f:
+            for resource in json.loads(line)["resourceSpans"]:
+                for scope in resource["scopeSpans"]:
+                    yield scope["spans"]
+
+
+def duration_ms(span: dict) -> float:
+    return (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(path: str, root_filter: str | None) -> dict:
+    # root name -> span name -> durations
+    summary = defaultdict(lambda: defaultdict(list))
+    for spans in load_traces(path):
+        root = next((s for s in spans if "parentSpanId" not in s), spans[0])
+        if root_filter and root["name"] != root_filter:
+            continue
+        for span in spans:
+            summary[root["name"]][span["name"]].append(duration_ms(span))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--root", help="only traces whose root span has this name")
+    args = parser.parse_args()
+
+    for root_name, spans in summarize(args.path, args.root).items():
+        root_times = spans[root_name]
+        total = sum(root_times)
+        print(f"{root_name}  ({len(root_times)} traces)")
+        print(f"  {'span':<32} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'share':>7}")
+        rows = sorted(spans.items(), key=lambda item: -sum(item[1]))
+        for name, times in rows:
+            print(
+                f"  {name[:32]:<32} {len(times):>7} "
+                f"{statistics.median(times):>9.3f} {percentile(times, 99):>9.3f} "
+                f"{sum(times) / total if total else 0:>7.1%}"
+            )
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# This work is licensed under the terms of the MIT license
+# worker.py
+#
+# Background job worker (lib/jobs.py), run next to the gunicorn app. Any
+# number can serve "default"; exactly one per search index file may serve
+# "search".
+#
+#   python worker.py                          # default queue
+#   python worker.py --queues default,search  # also keep the search index
+#
+# Serves Prometheus metrics on JOBS_METRICS_PORT. SIGTERM lets the current
+# job finish before exiting.
+import argparse
+import signal
+
+from prometheus_client import start_http_server
+
+import lib.tasks  # noqa: F401  registers the tasks
+from config import JOBS_METRICS_PORT
+from lib.jobs import Worker
+from lib.kv import connect_kv
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queues", default="default", help="comma separated")
+    parser.add_argument("--name", help="defaults to host:pid")
+    args = parser.parse_args()
+
+    if JOBS_METRICS_PORT:
+        start_http_server(JOBS_METRICS_PORT)
+    worker = Worker(connect_kv(), args.queues.split(","), name=args.name)
+
+    def stop(signum, frame):
+        worker.stopped = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
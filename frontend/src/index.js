@@ -12,6 +12,8 @@ import {
 } from "./template.js";
 
 const API_BASE = "http://localhost:5000";
+// the server's REACTION_EMOJI; it refuses anything else
+const REACTION_EMOJI = ["👍", "❤️", "😂", "😮", "😢", "🎉", "🙏", "👀"];
 
 function decodeUserIdFromToken(token) {
   try {
@@ -29,8 +31,19 @@ const state = {
   username: localStorage.getItem("username") || "",
   authMode: "login",
   rooms: [],
+  // history and members of one room, delivered with /bootstrap
+  prefetched: null,
+  lastRoomId: localStorage.getItem("last_room") || "",
   activeRoom: null,
   socket: null,
+  // messages sent but not acked yet, by client_id; resent with the same id
+  // after a reconnect, the server drops the duplicate
+  pending: new Map(),
+  // message_id -> {emoji: count} for the messages on screen
+  reactions: new Map(),
+  // "<message_id>:<emoji>" this user reacted with, as far as we know
+  myReactions: new Set(),
+  authTimer: null,
 };
 
 function saveAuth({ access_token, refresh_token, username }) {
@@ -69,6 +82,9 @@ function clearAuth() {
   localStorage.removeItem("access_token");
   localStorage.removeItem("refresh_token");
   localStorage.removeItem("username");
+  state.lastRoomId = "";
+  state.prefetched = null;
+  localStorage.removeItem("last_room");
 }
 
 async function api(path, options = {}, allowRetry = true) {
@@ -176,28 +192,68 @@ function renderAuthModal() {
   });
 }
 
+async function joinRoom(roomId) {
+  try {
+    await api(`/join_room/${roomId}`, {
+      method: "POST",
+    });
+    document.getElementById("join-room-popup-overlay")?.remove();
+    await renderRooms();
+  } catch (error) {
+    showError(error.message);
+  }
+}
+
+// public rooms and the user's own rooms matching the typed prefix
+async function suggestRooms(query) {
+  const list = document.getElementById("room-suggestions");
+  if (!list) return;
+  if (!query) {
+    list.innerHTML = "";
+    return;
+  }
+  try {
+    const { rooms } = await api(
+      `/directory/rooms?q=${encodeURIComponent(query)}&limit=8`,
+    );
+    if (document.getElementById("join-room-id")?.value.trim() !== query) return;
+    list.innerHTML = rooms
+      .map(
+        (room) =>
+          `<li data-room-id="${room.id}" class="${room.member ? "muted-value" : ""}">${escapeHtml(room.name)}</li>`,
+      )
+      .join("");
+  } catch {
+    list.innerHTML = "";
+  }
+}
+
 function renderJoinRoomPopup() {
   document.body.insertAdjacentHTML("beforeend", joinRoomPopupTemplate());
+  let suggestTimer = null;
+  document.getElementById("join-room-id").addEventListener("input", (event) => {
+    clearTimeout(suggestTimer);
+    const query = event.target.value.trim();
+    suggestTimer = setTimeout(() => suggestRooms(query), 150);
+  });
+  document
+    .getElementById("room-suggestions")
+    .addEventListener("click", (event) => {
+      const roomId = event.target.closest("li")?.dataset.roomId;
+      if (roomId) joinRoom(roomId);
+    });
   document.getElementById("join-room-cancel").addEventListener("click", () => {
     document.getElementById("join-room-popup-overlay")?.remove();
   });
   document
     .getElementById("join-room-submit")
     .addEventListener("click", async () => {
-      const roomId = document.getElementById("join-room-id").value;
+      const roomId = document.getElementById("join-room-id").value.trim();
       if (!roomId) {
         showError("Room ID is required");
         return;
       }
-      try {
-        await api(`/join_room/${roomId}`, {
-          method: "POST",
-        });
-        document.getElementById("join-room-popup")?.remove();
-        await renderRooms();
-      } catch (error) {
-        showError(error.message);
-      }
+      await joinRoom(roomId);
     });
   document.getElementById("open-create-room")?.addEventListener("click", () => {
     document.getElementById("join-room-popup-overlay")?.remove();
@@ -221,6 +277,7 @@ function renderCreateRoomPopup() {
       const roomDescription = document
         .getElementById("room-description")
         .value.trim();
+      const isPublic = document.getElementById("room-public").checked;
 
       if (!roomName) {
         return showError("Room name is required.");
@@ -232,6 +289,7 @@ function renderCreateRoomPopup() {
           body: JSON.stringify({
             room_name: roomName,
             room_description: roomDescription,
+            is_public: isPublic,
           }),
         });
 
@@ -253,8 +311,15 @@ async function renderRooms() {
   const app = document.getElementById("app");
 
   try {
-    const data = await api("/my-rooms");
+    // one round trip for the profile, the room list with unread counts and
+    // the last opened room's history
+    const query = state.lastRoomId
+      ? `?room_id=${encodeURIComponent(state.lastRoomId)}`
+      : "";
+    const data = await api(`/bootstrap${query}`);
     state.rooms = data.rooms || [];
+    state.prefetched = data.room;
+    if (data.user?.username) state.username = data.user.username;
   } catch (error) {
     if (!state.accessToken) {
       app.innerHTML = "";
@@ -286,30 +351,199 @@ async function renderRooms() {
   });
 }
 
-function renderMessage({ sender, message, timestamp, sender_id }) {
+function renderMessage({
+  sender,
+  message,
+  timestamp,
+  sender_id,
+  message_id,
+  client_id,
+  pending,
+  reactions = {},
+}) {
   const container = document.getElementById("chat-container");
+  if (!container) return;
   const mine = sender_id && state.userId === sender_id;
   const date = new Date(timestamp);
 
   container.insertAdjacentHTML(
     "beforeend",
-    `<div class="message ${mine ? "my-message" : ""}">
+    `<div class="message ${mine ? "my-message" : ""} ${pending ? "pending" : ""}"
+      data-message-id="${message_id ?? ""}" data-client-id="${client_id ?? ""}">
       <div class="content">
         ${mine ? "" : `<span class="username">${sender}</span>`}
         <span class="timestamp">${date.toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" })}</span>
         <p>${message}</p>
       </div>
+      <div class="reactions">${reactionsHtml(message_id, reactions)}</div>
     </div>`,
   );
+  if (message_id) state.reactions.set(message_id, reactions);
 
   container.scrollTop = container.scrollHeight;
 }
 
+function reactionsHtml(messageId, reactions) {
+  const chips = Object.entries(reactions)
+    .filter(([, count]) => count > 0)
+    .map(
+      ([emoji, count]) =>
+        `<button class="reaction ${state.myReactions.has(`${messageId}:${emoji}`) ? "mine" : ""}"
+          data-emoji="${emoji}">${emoji} <span>${count}</span></button>`,
+    )
+    .join("");
+  return `${chips}<button class="add-reaction" title="React">+</button>`;
+}
+
+function updateReactions(messageId, reactions) {
+  state.reactions.set(messageId, reactions);
+  const element = document.querySelector(
+    `#chat-container [data-message-id="${messageId}"] .reactions`,
+  );
+  if (element) element.innerHTML = reactionsHtml(messageId, reactions);
+}
+
+function toggleReaction(messageId, emoji) {
+  const key = `${messageId}:${emoji}`;
+  const add = !state.myReactions.has(key);
+  state.socket.emit(
+    add ? "add_reaction" : "remove_reaction",
+    { room: String(state.activeRoom?.id), message_id: messageId, emoji },
+    (ack) => {
+      if (!ack?.ok) return;
+      if (add) state.myReactions.add(key);
+      else state.myReactions.delete(key);
+      // reacted before this page load: the click meant to take it back
+      if (add && !ack.changed) return toggleReaction(messageId, emoji);
+      updateReactions(messageId, {
+        ...state.reactions.get(messageId),
+        [emoji]: ack.count,
+      });
+    },
+  );
+}
+
+function showReactionPicker(messageElement) {
+  const existing = messageElement.querySelector(".reaction-picker");
+  document.querySelectorAll(".reaction-picker").forEach((el) => el.remove());
+  if (existing) return;
+  messageElement.querySelector(".reactions").insertAdjacentHTML(
+    "beforeend",
+    `<span class="reaction-picker">${REACTION_EMOJI.map(
+      (emoji) => `<button data-emoji="${emoji}">${emoji}</button>`,
+    ).join("")}</span>`,
+  );
+}
+
+function escapeHtml(text) {
+  const div = document.createElement("div");
+  div.textContent = text;
+  return div.innerHTML;
+}
+
+function newClientId() {
+  return window.crypto?.randomUUID
+    ? crypto.randomUUID()
+    : Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
+function renderPending(clientId) {
+  const { message, sentAt } = state.pending.get(clientId);
+  renderMessage({
+    sender: state.username,
+    sender_id: state.userId,
+    message: `<p>${escapeHtml(message)}</p>`,
+    timestamp: sentAt,
+    client_id: clientId,
+    pending: true,
+  });
+}
+
+// the server stored the message: drop the pending mark, or the whole copy
+// if history already shows it, and swap in the rendered HTML when known
+function confirmMessage(clientId, { message_id, timestamp, message }) {
+  state.pending.delete(clientId);
+  const container = document.getElementById("chat-container");
+  const element = container?.querySelector(`[data-client-id="${clientId}"]`);
+  if (!element) return false;
+  const shown = container.querySelector(`[data-message-id="${message_id}"]`);
+  if (shown && shown !== element) {
+    element.remove();
+    return true;
+  }
+  element.classList.remove("pending");
+  element.dataset.messageId = message_id;
+  const date = new Date(timestamp);
+  element.querySelector(".timestamp").textContent = date.toLocaleTimeString(
+    [],
+    { hour: "2-digit", minute: "2-digit" },
+  );
+  if (message) element.querySelector("p").outerHTML = message;
+  return true;
+}
+
+function sendPending(clientId) {
+  const item = state.pending.get(clientId);
+  if (!item || !state.socket?.connected) return;
+
+  state.socket
+    .timeout(10000)
+    .emit(
+      "send_message",
+      { room: item.room, message: item.message, client_id: clientId },
+      (err, ack) => {
+        // no ack: stays pending and is resent once the room is rejoined
+        if (err || !state.pending.has(clientId)) return;
+        if (ack.ok) {
+          confirmMessage(clientId, ack);
+        } else if (ack.error === "Send in progress") {
+          setTimeout(() => sendPending(clientId), 1000);
+        } else {
+          state.pending.delete(clientId);
+          document
+            .querySelector(`[data-client-id="${clientId}"]`)
+            ?.classList.add("failed");
+          showError(ack.error);
+        }
+      },
+    );
+}
+
+function resendPending(roomId) {
+  for (const [clientId, item] of state.pending) {
+    if (item.room === roomId) sendPending(clientId);
+  }
+}
+
 function renderChat(room) {
   state.activeRoom = null; // reset first to avoid stale room
+  state.lastRoomId = String(room.id);
+  localStorage.setItem("last_room", state.lastRoomId);
   const app = document.getElementById("app");
   app.innerHTML = chatPageTemplate(room.name);
 
+  // show the prefetched page right away; fetch_history replaces it once the
+  // socket has joined the room
+  if (state.prefetched && String(state.prefetched.id) === String(room.id)) {
+    state.prefetched.messages.forEach(renderMessage);
+  }
+  state.prefetched = null;
+
+  document.getElementById("chat-container").addEventListener("click", (e) => {
+    const messageElement = e.target.closest(".message");
+    const messageId = Number(messageElement?.dataset.messageId);
+    // pending messages have no id to react to yet
+    if (!messageId) return;
+    if (e.target.closest(".add-reaction")) {
+      showReactionPicker(messageElement);
+      return;
+    }
+    const button = e.target.closest("[data-emoji]");
+    if (!button) return;
+    button.closest(".reaction-picker")?.remove();
+    toggleReaction(messageId, button.dataset.emoji);
+  });
+
   document.getElementById("back-button").addEventListener("click", () => {
     if (state.activeRoom) {
       state.socket?.emit("leave_room", { room: state.activeRoom.id });
@@ -346,6 +580,7 @@ function renderChat(room) {
     if (data.rooms.includes(String(room.id))) {
       state.activeRoom = room; // only set after join success
       state.socket.emit("fetch_history", { room: String(room.id) });
+      resendPending(String(room.id));
     } else {
       showError("Failed to join room");
     }
@@ -357,6 +592,9 @@ function renderChat(room) {
     if (!container) return;
     container.innerHTML = "";
     data.messages.forEach(renderMessage);
+    for (const [clientId, item] of state.pending) {
+      if (item.room === String(room.id)) renderPending(clientId);
+    }
   });
 }
 
@@ -389,25 +627,57 @@ function renderAbout() {
   });
 }
 
-async function renderRoomSettings() {
+// One page of members: owners and admins first, banned members last so
+// they can still be unbanned from here.
+async function fetchMembersPage(room, cursor) {
+  const params = new URLSearchParams({
+    limit: "100",
+    role: "owner,admin,member,banned",
+  });
+  if (cursor) params.set("cursor", cursor);
+  const page = await api(`/room/${room.id}/members?${params}`);
+  return {
+    members: page.members.map((m) => ({
+      id: m.id,
+      name: m.username,
+      role: m.role,
+    })),
+    nextCursor: page.next_cursor,
+  };
+}
+
+async function renderRoomSettings(reload = true) {
   const app = document.getElementById("app");
   const room = state.activeRoom;
   if (!room) return;
 
-  try {
-    const members = await api(`/room/${room.id}/members`);
-    room.members = members.map((m) => ({
-      id: m.id,
-      name: m.username,
-      role: m.role,
-    }));
-  } catch (err) {
-    showError("Failed to fetch members: " + err.message);
-    room.members = [];
+  if (reload) {
+    try {
+      const page = await fetchMembersPage(room);
+      room.members = page.members;
+      room.membersCursor = page.nextCursor;
+    } catch (err) {
+      showError("Failed to fetch members: " + err.message);
+      room.members = [];
+      room.membersCursor = null;
+    }
   }
 
   app.innerHTML = roomSettingsTemplate(state.activeRoom);
 
+  document
+    .getElementById("load-more-members")
+    ?.addEventListener("click", async () => {
+      try {
+        const page = await fetchMembersPage(room, room.membersCursor);
+        room.members = room.members.concat(page.members);
+        room.membersCursor = page.nextCursor;
+        renderRoomSettings(false);
+      } catch (err) {
+        showError("Failed to fetch members: " + err.message);
+      }
+    });
+
   document.getElementById("back-button").addEventListener("click", () => {
     if (state.activeRoom) {
       renderChat(state.activeRoom);
@@ -550,14 +820,59 @@ function sendActiveMessage() {
     return;
   }
 
-  state.socket?.emit("send_message", {
-    room: state.activeRoom.id,
+  // shown at once; the ack or our own new_message confirms it
+  const clientId = newClientId();
+  state.pending.set(clientId, {
+    room: String(state.activeRoom.id),
     message,
+    sentAt: new Date().toISOString(),
   });
+  renderPending(clientId);
+  sendPending(clientId);
 
   input.value = "";
 }
 
+// renew the socket's session in place before the token expires; the server
+// picks a jittered refresh_in so clients do not all refresh at once
+function scheduleAuthRefresh(refreshIn) {
+  clearTimeout(state.authTimer);
+  state.authTimer = setTimeout(refreshSocketAuth, refreshIn * 1000);
+}
+
+function refreshSocketAuth() {
+  if (!state.socket?.connected || !state.refreshToken) return;
+
+  state.socket
+    .timeout(10000)
+    .emit(
+      "refresh_auth",
+      { refresh_token: state.refreshToken },
+      async (err, ack) => {
+        if (!err && ack.ok) {
+          saveAuth({
+            access_token: ack.access_token,
+            refresh_token: state.refreshToken,
+            username: state.username,
+          });
+          scheduleAuthRefresh(ack.refresh_in);
+          return;
+        }
+        // no answer: refresh over HTTP and hand the socket the new token
+        if (await refreshAccessToken()) {
+          state.socket?.emit(
+            "refresh_auth",
+            { token: state.accessToken },
+            (retry) => retry?.ok && scheduleAuthRefresh(retry.refresh_in),
+          );
+        } else {
+          state.socket?.disconnect();
+          renderAuthModal();
+        }
+      },
+    );
+}
+
 async function initSocket() {
   if (!window.io || !state.accessToken) return;
 
@@ -572,7 +887,8 @@ async function initSocket() {
   if (state.socket) state.socket.disconnect();
 
   state.socket = io("http://localhost:5000", {
-    auth: { token: state.accessToken },
+    // read on every (re)connect, so a reconnect uses the newest token
+    auth: (cb) => cb({ token: state.accessToken }),
     transports: ["websocket"],
   });
 
@@ -588,10 +904,42 @@ async function initSocket() {
     }
   });
 
-  state.socket.on("disconnect", () => console.log("Disconnected"));
+  state.socket.on("disconnect", () => {
+    clearTimeout(state.authTimer);
+    console.log("Disconnected");
+  });
+  state.socket.on("auth_expiry", ({ refresh_in }) =>
+    scheduleAuthRefresh(refresh_in),
+  );
+  // the session ran out without a refresh; the server does not reconnect us
+  state.socket.on("auth_expired", () => initSocket());
   state.socket.on("error", (data) => showError(data.error));
 
-  state.socket.on("new_message", renderMessage);
+  state.socket.on("new_message", (data) => {
+    // our own message comes back too; it replaces the pending copy
+    if (!(data.client_id && confirmMessage(data.client_id, data))) {
+      renderMessage(data);
+    }
+    if (state.activeRoom && String(state.activeRoom.id) === data.room) {
+      state.socket.emit("mark_read", {
+        room: data.room,
+        message_id: data.message_id,
+      });
+    }
+  });
+  // counts of the messages that changed, at most a few times a second
+  state.socket.on("reactions", (data) => {
+    if (!state.activeRoom || String(state.activeRoom.id) !== data.room) return;
+    for (const { message_id, reactions } of data.messages) {
+      updateReactions(message_id, reactions);
+    }
+  });
+  state.socket.on("room_deleted", ({ room }) => {
+    if (state.activeRoom && String(state.activeRoom.id) === room) {
+      state.activeRoom = null;
+    }
+    renderRooms();
+  });
 }
 
 async function bootstrap() {
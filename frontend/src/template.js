@@ -20,8 +20,15 @@ export const roomListTemplate = (rooms = []) => `
             .map(
               (room) => `
     <div class="room" data-id="${room.id}">
-        <div class="room-name">${room.name}</div>
-        <div class="room-description">${room.description || "No description"}</div>
+        <div class="room-name">
+          ${room.name}
+          ${room.unread ? `<span class="unread-badge">${room.unread}</span>` : ""}
+        </div>
+        <div class="room-description">${
+          room.last_message
+            ? `${room.last_message.sender}: ${room.last_message.preview}`
+            : room.description || "No description"
+        }</div>
     </div>
     `,
             )
@@ -151,6 +158,11 @@ export const roomSettingsTemplate = (room) => {
     `,
     )
     .join("")}
+  ${
+    room.membersCursor
+      ? `<button id="load-more-members" class="pill-button" type="button">Load more</button>`
+      : ""
+  }
   </div>
 
   <div class="settings-footer">
@@ -206,6 +218,10 @@ export const createRoomPopupTemplate = () => `
     <h2>Create room</h2>
     <input id="room-name" placeholder="Room name" />
     <input id="room-description" placeholder="Room description" />
+    <label class="checkbox">
+      <input id="room-public" type="checkbox" />
+      Public (anyone can find it by name)
+    </label>
     <div class="actions">
       <button id="create-room-submit" class="button" type="button">Create</button>
       <button id="create-room-cancel" class="button" type="button">Cancel</button>
@@ -219,7 +235,8 @@ export const joinRoomPopupTemplate = () => `
 <div id="join-room-popup-overlay" class="overlay">
   <div class="auth-modal">
     <h2>Join room</h2>
-    <input id="join-room-id" placeholder="Room ID" />
+    <input id="join-room-id" placeholder="Room name or ID" autocomplete="off" />
+    <ul id="room-suggestions" class="suggestions"></ul>
     <div class="actions">
       <button id="join-room-submit" class="button" type="button">Join</button>
       <button id="join-room-cancel" class="button" type="button">Cancel</button>